@@ -1,23 +1,60 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.exceptions import RequestValidationError
 import os
 import sys
-import time
-import traceback
+import hmac
+import logging
 from pathlib import Path
 import asyncio
-from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
 
 # Add the parent directory to sys.path to allow imports from sibling directories
 sys.path.append(str(Path(__file__).parent.parent))
-from routers import refine, explain
+from services.logging_config import configure_logging
+configure_logging()
+
+from routers import refine, explain, refine_explain, results, jobs, admin
+from services.gemini_service import model_router, BUSY_MESSAGE
+from services.rate_limiter import create_rate_limiter
+from services.asgi import JSON_RESPONSE_CLASS, TimingMiddleware, RateLimitMiddleware, CompressionMiddleware
+from services.admission import Overloaded
+from services.tokens import InputTooLarge
+from services.profiling import ProfilingMiddleware, loop_monitor, profiler
+from services.traffic import TrafficMiddleware, traffic_recorder
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Endpoints that are never rate limited or timed
+UNLIMITED_PATHS = ["/", "/health", "/metrics"]
+
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>" (the
+# bearer token of a Prometheus scrape config)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Import the provider SDKs and create their clients in the background, so
+    # the worker accepts connections (and serves cached responses) meanwhile
+    model_router.warm()
+    # Every worker reports its event-loop lag and logs steps that block it
+    if loop_monitor is not None:
+        loop_monitor.start()
+    yield
+    if loop_monitor is not None:
+        loop_monitor.stop()
+
 
 app = FastAPI(
     title="Prompt Engineering API",
     description="API for generating and refining AI prompts",
     version="1.0.0",
+    default_response_class=JSON_RESPONSE_CLASS,
+    lifespan=lifespan,
 )
 
 # Add CORS middleware with more permissive settings for testing
@@ -29,82 +66,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Simple rate limiter
-class RateLimiter:
-    def __init__(self, rate_limit=10, time_window=60):
-        self.rate_limit = rate_limit  # Max requests per time window
-        self.time_window = time_window  # Time window in seconds
-        self.request_counts = defaultdict(list)  # IP -> list of request timestamps
-    
-    def is_rate_limited(self, client_ip):
-        # Clean up old requests
-        current_time = time.time()
-        self.request_counts[client_ip] = [
-            timestamp for timestamp in self.request_counts[client_ip] 
-            if current_time - timestamp < self.time_window
-        ]
-        
-        # Check if rate limited
-        if len(self.request_counts[client_ip]) >= self.rate_limit:
-            return True
-        
-        # Record this request
-        self.request_counts[client_ip].append(current_time)
-        return False
-
-# Create rate limiter instance (50 requests per minute instead of 10)
-rate_limiter = RateLimiter(rate_limit=50, time_window=60)
-
-# Add rate limiter middleware
-@app.middleware("http")
-async def rate_limit_middleware(request: Request, call_next):
-    client_ip = request.client.host
-    
-    # Skip rate limiting for health check endpoints
-    if request.url.path in ["/", "/health"]:
-        return await call_next(request)
-    
-    # Check if rate limited
-    if rate_limiter.is_rate_limited(client_ip):
-        return JSONResponse(
-            status_code=429,
-            content={"detail": "Rate limit exceeded. Please try again later."}
-        )
-    
-    return await call_next(request)
-
-# Add request timing middleware
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    try:
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        response.headers["X-Process-Time"] = str(process_time)
-        print(f"Request to {request.url.path} took {process_time:.2f} seconds")
-        return response
-    except Exception as e:
-        process_time = time.time() - start_time
-        print(f"Error in request to {request.url.path} after {process_time:.2f} seconds: {str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={"detail": f"Internal server error: {str(e)}"}
-        )
-
-# Global exception handler
+# Sliding-window rate limiter (50 requests per minute per client by default)
+rate_limiter = create_rate_limiter()
+
+# Pure ASGI middleware, outermost last: request tracking for the profiler
+# and loop watchdog, the opt-in traffic recorder, timing and error
+# handling, rate limiting, then compression of large complete responses
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, exempt_paths=UNLIMITED_PATHS)
+app.add_middleware(TimingMiddleware, skip_paths=UNLIMITED_PATHS)
+if traffic_recorder.enabled:
+    app.add_middleware(TrafficMiddleware, recorder=traffic_recorder, skip_paths=UNLIMITED_PATHS)
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# Errors on paths the timing middleware skips end up here
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    print(f"Global exception: {str(exc)}")
-    print(traceback.format_exc())
+    logger.error("Global exception: %s", exc, exc_info=exc)
     return JSONResponse(
         status_code=500,
         content={"detail": f"Internal server error: {str(exc)}"}
     )
 
+# Upstream calls shed by the admission controller fail fast instead of queueing for a minute
+@app.exception_handler(Overloaded)
+async def overloaded_exception_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": BUSY_MESSAGE},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Input over INPUT_TOKEN_BUDGET that the budget policy did not shorten enough
+@app.exception_handler(InputTooLarge)
+async def input_too_large_exception_handler(request: Request, exc: InputTooLarge):
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
 # Validation error handler
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    print(f"Validation error: {exc.errors()}")
+    logger.debug("Validation error: %s", exc.errors())
     return JSONResponse(
         status_code=422,
         content={"detail": exc.errors()}
@@ -113,18 +114,26 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 # Include routers
 app.include_router(refine.router)
 app.include_router(explain.router)
+app.include_router(refine_explain.router)
+app.include_router(results.router)
+app.include_router(jobs.router)
+app.include_router(admin.router)
 
 # Add a root endpoint for API health check
 @app.get("/")
 async def root():
     return {"status": "API is running", "version": "1.0.0"}
 
-# Add a health check endpoint
+# Liveness check; the detailed service stats are at /admin/stats
 @app.get("/health")
 async def health_check():
-    return {
-        "status": "healthy",
-        "services": {
-            "gemini_api": "connected" if os.getenv("GEMINI_API_KEY") else "not configured"
-        }
-    }
\ No newline at end of file
+    return {"status": "healthy"}
+
+# Prometheus metrics, merged across workers when METRICS_DIR is set
+@app.get("/metrics")
+async def metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and not hmac.compare_digest(
+        (authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode()
+    ):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,170 @@
+"""Requests/sec of the HTTP stack for cached and health-check paths.
+
+Compares the app as shipped (pure ASGI middleware, orjson when installed,
+compression) with a baseline built the previous way: the same routes behind
+Starlette `@app.middleware("http")` functions and the standard JSON encoder.
+Requests are driven straight through the ASGI interface in-process, so the
+numbers measure the framework and middleware cost of a request, not the
+network. Cached routes are warmed first, so no model calls are timed.
+
+Usage (from the backend directory):
+    python benchmarks/bench_http.py [--requests 3000] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# Configure the app for an isolated, offline run before it is imported
+os.environ["GEMINI_FAKE"] = "1"
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["CACHE_SNAPSHOT"] = "0"
+os.environ["RATE_LIMIT_BACKEND"] = "memory"
+os.environ["RATE_LIMIT"] = str(10 ** 9)
+os.environ["RATE_LIMIT_ROUTES"] = ""
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.append(str(Path(__file__).parent.parent))
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from Backend import main as app_module
+from routers import refine, explain
+from services.asgi import FAST_JSON, route_label
+from services.metrics import REGISTRY, REQUEST_LATENCY, RATE_LIMIT_REJECTIONS
+from services.rate_limiter import rate_limit_headers
+
+REFINE_BODY = {
+    "raw_input": "Write a follow-up email to a client about the delayed project timeline",
+    "mode": "few-shot",
+    "tone": "professional",
+}
+EXPLAIN_BODY = {"prompt": "You are a senior editor. Rewrite the text below for clarity and brevity."}
+PATHS = [
+    ("GET /", "GET", "/", None),
+    ("GET /health", "GET", "/health", None),
+    ("POST /refine (cached)", "POST", "/refine", REFINE_BODY),
+    ("POST /explain (cached)", "POST", "/explain", EXPLAIN_BODY),
+]
+
+
+def build_baseline_app():
+    """The same routes behind BaseHTTPMiddleware functions, as before the ASGI rewrite"""
+    app = FastAPI()
+    limiter = app_module.rate_limiter
+
+    @app.middleware("http")
+    async def rate_limit_middleware(request: Request, call_next):
+        if request.url.path in app_module.UNLIMITED_PATHS:
+            return await call_next(request)
+        result = await limiter.check(request.client.host, request.url.path, request.headers.get("X-API-Key"))
+        if result.limited:
+            RATE_LIMIT_REJECTIONS.inc(route=request.url.path)
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Rate limit exceeded. Please try again later."},
+                headers=rate_limit_headers(result),
+            )
+        response = await call_next(request)
+        response.headers.update(rate_limit_headers(result))
+        return response
+
+    @app.middleware("http")
+    async def add_process_time_header(request: Request, call_next):
+        start_time = time.time()
+        REGISTRY.ensure_flusher()
+        response = await call_next(request)
+        process_time = time.time() - start_time
+        response.headers["X-Process-Time"] = str(process_time)
+        REQUEST_LATENCY.observe(
+            process_time, route=route_label(request.scope), method=request.method, status=response.status_code
+        )
+        return response
+
+    app.include_router(refine.router)
+    app.include_router(explain.router)
+    app.add_api_route("/", app_module.root, methods=["GET"])
+    app.add_api_route("/health", app_module.health_check, methods=["GET"])
+    return app
+
+
+async def call(app, method, path, body):
+    """Send one request through the ASGI interface and return the status code"""
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"bench"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+            (b"accept-encoding", b"gzip, br"),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    sent = False
+    status = None
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def measure(app, method, path, body, requests, concurrency):
+    for _ in range(20):
+        status = await call(app, method, path, body)
+    assert status == 200, f"{method} {path} returned {status}"
+
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await call(app, method, path, body)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - started)
+
+
+async def run(args):
+    apps = [("baseline", build_baseline_app()), ("asgi", app_module.app)]
+    print(f"JSON encoder: {'orjson' if FAST_JSON else 'json'}, {args.requests} requests at concurrency {args.concurrency}\n")
+    print(f"{'path':<24} {'baseline rps':>13} {'asgi rps':>10} {'change':>8}")
+    for label, method, path, body in PATHS:
+        rates = [await measure(app, method, path, body, args.requests, args.concurrency) for _, app in apps]
+        print(f"{label:<24} {rates[0]:>13.0f} {rates[1]:>10.0f} {rates[1] / rates[0] - 1:>+8.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Deterministic load benchmark for /refine and /explain against the offline fake model.
+
+Drives the FastAPI app in-process (no network, no API key) with workloads
+that differ in how often inputs repeat, and reports throughput, latency
+percentiles, cache hit ratio and upstream call counts per route. Results
+can be saved and later compared against, failing the run on regressions.
+
+Usage (from the backend directory):
+    python benchmarks/bench_load.py
+    python benchmarks/bench_load.py --requests 1000 --concurrency 64 --repetition 0,0.5,0.9
+    python benchmarks/bench_load.py --save baseline.json
+    python benchmarks/bench_load.py --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+# Configure the app for an isolated, offline run before it is imported
+os.environ["GEMINI_FAKE"] = "1"
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["CACHE_SNAPSHOT"] = "0"
+os.environ["RATE_LIMIT_BACKEND"] = "memory"
+os.environ["RATE_LIMIT"] = str(10 ** 9)
+os.environ["RATE_LIMIT_ROUTES"] = ""
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import httpx
+from Backend.main import app
+import services.gemini_service as gemini_service
+from routers import explain
+
+MODES = [("basic", 0.3), ("quick", 0.2), ("deep", 0.3), ("few-shot", 0.1), ("cot", 0.1)]
+TONES = ["default", "professional", "friendly"]
+TOPICS = [
+    "email about project update", "follow up email", "blog post on remote work",
+    "product description for running shoes", "summary of a research paper",
+    "onboarding checklist for new hires", "tweet announcing a feature",
+    "cover letter for a data analyst role", "meeting agenda for sprint review",
+    "explain recursion to a beginner",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def build_workload(count, repetition, explain_share, seed):
+    """Requests where a `repetition` fraction reuse inputs from a small hot set"""
+    rng = random.Random(seed)
+    hot = [f"{topic}" for topic in TOPICS]
+    workload = []
+    for number in range(count):
+        if rng.random() < repetition:
+            text = rng.choice(hot)
+        else:
+            text = f"{rng.choice(TOPICS)} #{seed}-{number}"
+        if rng.random() < explain_share:
+            workload.append(("/explain", {"prompt": text}))
+        else:
+            mode = rng.choices([m for m, _ in MODES], weights=[w for _, w in MODES])[0]
+            # Hot inputs keep a fixed mode/tone so repeats are real cache candidates
+            tone = TONES[hash(text) % len(TONES)] if text in hot else rng.choice(TONES)
+            if text in hot:
+                mode = MODES[len(text) % len(MODES)][0]
+            workload.append(("/refine", {
+                "raw_input": text, "mode": mode, "tone": tone,
+                "persona": "none", "return_format": "plain",
+            }))
+    return workload
+
+
+def reset_state():
+    for cache in (gemini_service.response_cache, explain.explain_cache):
+        backend = getattr(cache, "backend", cache)
+        if hasattr(backend, "cache"):
+            backend.cache.clear()
+
+
+def cache_counters():
+    refine_stats = gemini_service.response_cache.stats()
+    explain_stats = explain.explain_cache.stats()
+    return {
+        "/refine": (refine_stats["hits"], refine_stats["misses"]),
+        "/explain": (explain_stats["hits"], explain_stats["misses"]),
+    }
+
+
+async def run_workload(workload, concurrency):
+    transport = httpx.ASGITransport(app=app)
+    latencies = {"/refine": [], "/explain": []}
+    failures = {"/refine": 0, "/explain": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def send(route, payload):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(route, json=payload)
+                latencies[route].append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    failures[route] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(route, payload) for route, payload in workload))
+        elapsed = time.perf_counter() - started
+    return latencies, failures, elapsed
+
+
+def run(args, repetition):
+    reset_state()
+    model = gemini_service.GEMINI_MODEL
+    workload = build_workload(args.requests, repetition, args.explain_share, args.seed)
+    calls_before = model.calls
+    cache_before = cache_counters()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        latencies, failures, elapsed = asyncio.run(run_workload(workload, args.concurrency))
+
+    cache_after = cache_counters()
+    result = {
+        "repetition": repetition,
+        "requests": len(workload),
+        "elapsed": elapsed,
+        "throughput": len(workload) / elapsed,
+        "upstream_calls": model.calls - calls_before,
+        "routes": {},
+    }
+    for route, values in latencies.items():
+        hits = cache_after[route][0] - cache_before[route][0]
+        misses = cache_after[route][1] - cache_before[route][1]
+        result["routes"][route] = {
+            "count": len(values),
+            "failures": failures[route],
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+        }
+    return result
+
+
+def report(results):
+    print(f"{'repeat':>6} {'route':<9} {'reqs':>5} {'fail':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'hit %':>6}")
+    for result in results:
+        for route, stats in result["routes"].items():
+            print(
+                f"{result['repetition']:>6.2f} {route:<9} {stats['count']:>5} {stats['failures']:>4} "
+                f"{stats['p50'] * 1e3:>8.1f} {stats['p95'] * 1e3:>8.1f} {stats['p99'] * 1e3:>8.1f} "
+                f"{stats['hit_ratio'] * 100:>6.1f}"
+            )
+        print(
+            f"{'':>6} {'total':<9} {result['requests']:>5} throughput {result['throughput']:.1f} req/s, "
+            f"upstream calls {result['upstream_calls']}"
+        )
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions against a saved baseline"""
+    regressions = []
+    previous = {r["repetition"]: r for r in baseline}
+    for result in results:
+        old = previous.get(result["repetition"])
+        if old is None:
+            continue
+        if result["throughput"] < old["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"repetition {result['repetition']}: throughput {result['throughput']:.1f} < {old['throughput']:.1f} req/s"
+            )
+        if result["upstream_calls"] > old["upstream_calls"] * (1 + tolerance):
+            regressions.append(
+                f"repetition {result['repetition']}: upstream calls {result['upstream_calls']} > {old['upstream_calls']}"
+            )
+        for route, stats in result["routes"].items():
+            old_stats = old["routes"].get(route)
+            if old_stats and stats["p95"] > old_stats["p95"] * (1 + tolerance):
+                regressions.append(
+                    f"repetition {result['repetition']} {route}: p95 {stats['p95'] * 1e3:.1f} ms "
+                    f"> {old_stats['p95'] * 1e3:.1f} ms"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--repetition", default="0,0.5,0.9", help="comma-separated repeat rates")
+    parser.add_argument("--explain-share", type=float, default=0.25)
+    parser.add_argument("--latency-median", type=float, default=0.05, help="fake model median latency (s)")
+    parser.add_argument("--latency-p99", type=float, default=0.25, help="fake model p99 latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--api-timeout", type=float, default=2.0, help="MAX_API_TIMEOUT for the run (s)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression fraction")
+    args = parser.parse_args()
+
+    model = gemini_service.GEMINI_MODEL
+    model.latency_median = args.latency_median
+    model.latency_p99 = max(args.latency_p99, args.latency_median)
+    model.error_rate = args.error_rate
+    model.timeout_rate = args.timeout_rate
+    model.hang_seconds = args.api_timeout * 2
+    model.random.seed(args.seed)
+    gemini_service.MAX_API_TIMEOUT = args.api_timeout
+
+    results = [run(args, float(rate)) for rate in args.repetition.split(",")]
+    report(results)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+        print(f"\nSaved results to {args.save}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if regressions:
+            print("\nPerformance regressions:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
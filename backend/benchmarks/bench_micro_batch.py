@@ -0,0 +1,101 @@
+"""Upstream calls and latency with and without micro-batching.
+
+Sends waves of distinct (uncacheable) /refine and /explain requests at the
+service layer against the offline fake model, once with MICRO_BATCH off
+and once with it on, and reports requests per upstream call (what an RPM
+quota is spent on), throughput and latency percentiles. The fake model
+answers a packed call as fast as a single one, so the latency figures are
+optimistic; the call counts are what matters.
+
+Usage (from the backend directory):
+    python benchmarks/bench_micro_batch.py [--requests 400] [--concurrency 32] [--latency 0.8]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+# Configure an isolated, offline run before the app modules are imported
+os.environ["GEMINI_FAKE"] = "1"
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["CACHE_SNAPSHOT"] = "0"
+os.environ["SEMANTIC_CACHE"] = "0"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.append(str(Path(__file__).parent.parent))
+import services.gemini_service as gemini_service
+from services.micro_batch import micro_batcher
+from routers import explain
+
+MODES = ["basic", "quick", "deep"]
+TOPICS = [
+    "email about project update", "blog post on remote work", "product description for running shoes",
+    "summary of a research paper", "onboarding checklist for new hires", "cover letter for a data analyst role",
+]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(enabled, args, run_id):
+    gemini_service.MICRO_BATCH = enabled
+    model = gemini_service.GEMINI_MODEL
+    model.latency_median, model.latency_p99 = args.latency, args.latency * 2
+    calls_before = model.calls
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(number):
+        topic = f"{rng.choice(TOPICS)} #{run_id}-{number}"
+        async with semaphore:
+            started = time.perf_counter()
+            if number % 4 == 3:
+                await explain.get_explanation(f"Write a {topic}")
+            else:
+                await gemini_service.generate_refined_prompts(topic, rng.choice(MODES))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(number) for number in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    calls = model.calls - calls_before
+    return {
+        "calls": calls,
+        "per_call": args.requests / max(1, calls),
+        "rps": args.requests / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+    }
+
+
+async def main_async(args):
+    print(f"{args.requests} distinct requests at concurrency {args.concurrency}, model latency ~{args.latency}s\n")
+    print(f"{'micro-batch':<12} {'upstream calls':>14} {'req/call':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for run_id, enabled in enumerate((False, True)):
+        result = await run(enabled, args, run_id)
+        print(
+            f"{'on' if enabled else 'off':<12} {result['calls']:>14} {result['per_call']:>9.2f} "
+            f"{result['rps']:>8.1f} {result['p50'] * 1000:>8.0f} {result['p95'] * 1000:>8.0f}"
+        )
+    stats = micro_batcher.stats()
+    print(f"\nbatches {stats['batches']}, items in batches {stats['batched_items']}, fallbacks {stats['fallbacks']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.8, help="median fake-model latency in seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
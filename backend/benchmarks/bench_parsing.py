@@ -0,0 +1,106 @@
+"""Micro-benchmark for response post-processing.
+
+Runs every captured response in corpus/responses.json through the current
+parsing pipeline and through the original regex implementation, checks
+that both produce identical output, and reports the time per call.
+
+Usage (from the backend directory):
+    python benchmarks/bench_parsing.py [--repeat 2000] [--scale 1,10,50]
+"""
+import argparse
+import json
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from services.parsing import parse_response
+
+CORPUS_PATH = Path(__file__).parent / "corpus" / "responses.json"
+
+
+# Reference implementation: the post-processing as it was before the
+# precompiled pipeline. Kept verbatim so the benchmark can prove the
+# outputs are identical.
+def legacy_clean_markdown_text(text):
+    text = re.sub(r'^\s*\*\s+', '- ', text, flags=re.MULTILINE)
+    text = re.sub(r'\*\*Variant (\d+):\*\*', 'Variant \\1:', text)
+    text = re.sub(r'(Variant \d+:)(\S)', '\\1 \\2', text)
+    text = re.sub(r'(?<!\*)\*(?!\*)', '', text)
+    text = re.sub(r'\*\*(.*?)\*\*', '\\1', text)
+    return text
+
+
+def legacy_parse_response(text, mode, return_format):
+    if return_format == "json":
+        try:
+            return json.loads(text)
+        except Exception:
+            return [text]
+    elif mode in ["basic", "quick"]:
+        lines = re.findall(r"^(?:[-*]\s*)?(.*\S.*)$", text, re.MULTILINE)
+        return [l.strip() for l in lines if l.strip() and not l.lower().startswith("prompt")]
+    elif mode == "deep":
+        variants = re.findall(
+            r"(?:\*\*)?Variant (\d+)(?:\*\*)?:(.+?)(?=(?:\n(?:\*\*)?Variant \d+(?:\*\*)?:|$))",
+            text,
+            re.DOTALL
+        )
+        if not variants:
+            return [legacy_clean_markdown_text(text)]
+        cleaned_variants = []
+        for variant_num, variant_content in variants:
+            if variant_content.strip():
+                cleaned_variants.append(legacy_clean_markdown_text(f"Variant {variant_num}:{variant_content}"))
+        return cleaned_variants if cleaned_variants else [legacy_clean_markdown_text(text)]
+    else:
+        return [legacy_clean_markdown_text(text)]
+
+
+def scaled(entry, factor):
+    """Repeat a response body to simulate longer outputs"""
+    if factor == 1 or entry["return_format"] == "json":
+        return entry["text"]
+    return "\n\n".join([entry["text"]] * factor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="calls per corpus entry")
+    parser.add_argument("--scale", default="1,10,50", help="comma-separated size multipliers")
+    args = parser.parse_args()
+
+    corpus = json.loads(CORPUS_PATH.read_text(encoding="utf-8"))
+    factors = [int(f) for f in args.scale.split(",")]
+
+    print(f"{'mode':<10} {'format':<9} {'scale':>5} {'chars':>7} {'legacy us':>10} {'new us':>9} {'speedup':>8}")
+    total_legacy = total_new = 0.0
+    for factor in factors:
+        for entry in corpus:
+            text = scaled(entry, factor).strip()
+            mode, fmt = entry["mode"], entry["return_format"]
+
+            expected = legacy_parse_response(text, mode, fmt)
+            actual = parse_response(text, mode, fmt)
+            if expected != actual:
+                print(f"MISMATCH for {mode}/{fmt} at scale {factor}")
+                print(f"  legacy: {expected!r}")
+                print(f"  new:    {actual!r}")
+                sys.exit(1)
+
+            repeat = max(1, args.repeat // factor)
+            legacy = timeit.timeit(lambda: legacy_parse_response(text, mode, fmt), number=repeat) / repeat
+            new = timeit.timeit(lambda: parse_response(text, mode, fmt), number=repeat) / repeat
+            total_legacy += legacy
+            total_new += new
+            print(
+                f"{mode:<10} {fmt:<9} {factor:>5} {len(text):>7} "
+                f"{legacy * 1e6:>10.1f} {new * 1e6:>9.1f} {legacy / new:>7.2f}x"
+            )
+
+    print(f"\nAll outputs identical. Overall speedup: {total_legacy / total_new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Micro-benchmark for the near-duplicate cache index.
+
+Indexes a large set of synthetic prompts, then times lookups for exact
+repeats, trivial variations (case, hyphens, punctuation, spacing), small
+edits and unrelated inputs, and reports the hit rate and latency of each.
+
+Usage (from the backend directory):
+    python benchmarks/bench_semantic_cache.py [--entries 100000] [--queries 2000]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from services.cache_backends import MemoryCacheBackend
+from services.semantic_cache import SemanticCache, SEMANTIC_CACHE_THRESHOLD
+
+VERBS = ["write", "draft", "summarize", "explain", "create", "plan", "review", "outline", "design", "compare"]
+NOUNS = [
+    "email", "report", "blog post", "landing page", "cover letter", "lesson plan", "press release",
+    "product description", "workout routine", "budget", "meeting agenda", "user story", "poem",
+]
+TOPICS = [
+    "the quarterly sales numbers", "our new onboarding flow", "a trip to Lisbon", "machine learning basics",
+    "my manager", "the follow-up with a client", "a vegan dinner party", "remote team culture",
+    "the database migration", "a kids science fair", "climate policy", "a job interview",
+]
+MODES = [("deep", "default", "", "plain"), ("quick", "friendly", "", "plain"), ("basic", "formal", "", "markdown")]
+
+
+def make_prompt(rng):
+    words = [rng.choice(VERBS), "a", rng.choice(NOUNS), "about", rng.choice(TOPICS)]
+    extra = " ".join(rng.choice(NOUNS + TOPICS) for _ in range(rng.randint(0, 6)))
+    return f"{' '.join(words).capitalize()} {extra} #{rng.randint(0, 10**9)}".strip()
+
+
+def trivial_variant(text, rng):
+    text = text.lower() if rng.random() < 0.5 else text.upper()
+    text = text.replace(" ", "  ", 1).replace("follow up", "follow-up")
+    return text + rng.choice([".", "!", "?", " ..."])
+
+
+def small_edit(text, rng):
+    words = text.split()
+    words[rng.randrange(len(words))] = rng.choice(NOUNS + VERBS)
+    return " ".join(words)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000, help="indexed inputs")
+    parser.add_argument("--queries", type=int, default=2000, help="lookups per query kind")
+    parser.add_argument("--threshold", type=float, default=SEMANTIC_CACHE_THRESHOLD)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    index = SemanticCache(
+        MemoryCacheBackend("bench"), threshold=args.threshold, max_entries=args.entries, enabled=True
+    )
+
+    started = time.perf_counter()
+    indexed = []
+    for i in range(args.entries):
+        partition = rng.choice(MODES)
+        prompt = make_prompt(rng)
+        index.add(partition, prompt, f"key-{i}")
+        indexed.append((partition, prompt, f"key-{i}"))
+    build = time.perf_counter() - started
+    print(f"Indexed {len(index)} inputs in {build:.2f}s ({build / args.entries * 1e6:.1f} us per add)\n")
+
+    kinds = {
+        "exact": lambda p, t: (p, t),
+        "trivial": lambda p, t: (p, trivial_variant(t, rng)),
+        "small edit": lambda p, t: (p, small_edit(t, rng)),
+        "other mode": lambda p, t: (MODES[(MODES.index(p) + 1) % len(MODES)], t),
+        "unrelated": lambda p, t: (p, make_prompt(rng)),
+    }
+    print(f"{'query':<12} {'hit rate':>9} {'p50 us':>8} {'p99 us':>8} {'max us':>8}")
+    for kind, make_query in kinds.items():
+        samples, hits = [], 0
+        for _ in range(args.queries):
+            partition, prompt, key = rng.choice(indexed)
+            query_partition, query = make_query(partition, prompt)
+            started = time.perf_counter()
+            found = index.find(query_partition, query)
+            samples.append((time.perf_counter() - started) * 1e6)
+            hits += found is not None
+        print(
+            f"{kind:<12} {hits / args.queries:>8.1%} {percentile(samples, 0.5):>8.1f} "
+            f"{percentile(samples, 0.99):>8.1f} {max(samples):>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Benchmark for cache snapshots and warm start.
+
+Measures the on-disk size of a snapshot, how long a fresh worker takes to
+index it and to serve entries from it, compaction time, and how long
+warm_cache.py takes to pre-warm a set of hot prompts against the offline
+fake model. Everything runs in a temporary directory.
+
+Usage (from the backend directory):
+    python benchmarks/bench_snapshot.py [--entries 2000] [--hot 200] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Configure an isolated, offline run before the app modules are imported
+WORK_DIR = tempfile.mkdtemp(prefix="bench_snapshot_")
+os.environ["GEMINI_FAKE"] = "1"
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["CACHE_SNAPSHOT"] = "1"
+os.environ["CACHE_SNAPSHOT_PATH"] = os.path.join(WORK_DIR, "warm.snapshot")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.append(str(Path(__file__).parent.parent))
+from services.cache_backends import MemoryCacheBackend
+from services.cache_snapshot import CacheSnapshot, cache_snapshot
+from services.fake_model import fake_completion
+from services.parsing import parse_response
+from services.singleflight import SingleFlight
+from services.stale_cache import StaleCache
+import services.gemini_service as gemini_service
+import warm_cache
+
+MODES = ["basic", "quick", "deep", "few-shot", "cot"]
+TOPICS = [
+    "email about project update", "blog post on remote work", "product description for running shoes",
+    "summary of a research paper", "onboarding checklist for new hires", "cover letter for a data analyst role",
+]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def make_entries(count, rng):
+    """Realistic (key, value) pairs: parsed fake-model responses"""
+    entries = []
+    for number in range(count):
+        mode = rng.choice(MODES)
+        raw_input = f"{rng.choice(TOPICS)} #{number}"
+        prompt = gemini_service.build_prompt(mode, "default", "", "plain", raw_input)
+        value = parse_response(fake_completion(prompt, rng), mode, "plain")
+        entries.append((gemini_service.get_cache_key(prompt, mode), value))
+    return entries
+
+
+async def bench_format(args, rng):
+    path = os.path.join(WORK_DIR, "format.snapshot")
+    entries = make_entries(args.entries, rng)
+    writer = CacheSnapshot(path)
+
+    started = time.perf_counter()
+    for key, value in entries:
+        writer.append("refine", key, time.time(), value)
+    append_seconds = time.perf_counter() - started
+    size = os.path.getsize(path)
+    print(f"Snapshot of {len(entries)} entries: {size / 1024:.0f} KiB ({size / len(entries):.0f} bytes/entry)")
+    print(f"  append       {append_seconds / len(entries) * 1e6:8.1f} us/entry")
+
+    # A restarted worker: index on first use, then copy entries into its memory cache on demand
+    cache = StaleCache(MemoryCacheBackend("refine"), SingleFlight("refine"), snapshot=CacheSnapshot(path))
+    started = time.perf_counter()
+    cache.snapshot.get("refine", "")
+    print(f"  index        {(time.perf_counter() - started) * 1e3:8.1f} ms")
+    samples = []
+    for key, value in entries:
+        started = time.perf_counter()
+        entry = await cache.lookup(key)
+        samples.append((time.perf_counter() - started) * 1e6)
+        assert entry is not None and entry.value == value
+    print(f"  first lookup {percentile(samples, 0.5):8.1f} us p50, {percentile(samples, 0.99):.1f} us p99")
+
+    # Every key rewritten once more, as after an hour of refreshes
+    for key, value in entries:
+        writer.append("refine", key, time.time(), value)
+    started = time.perf_counter()
+    records, compacted = writer.compact()
+    print(
+        f"  compaction   {(time.perf_counter() - started) * 1e3:8.1f} ms "
+        f"({2 * len(entries)} records -> {records}, {compacted / 1024:.0f} KiB)\n"
+    )
+
+
+def bench_warmup(args, rng):
+    model = gemini_service.GEMINI_MODEL
+    model.latency_median = args.latency_median
+    model.latency_p99 = max(args.latency_p99, args.latency_median)
+    items = [("refine", {"raw_input": f"{rng.choice(TOPICS)} #hot-{n}", "mode": rng.choice(MODES)})
+             for n in range(args.hot)]
+
+    calls = model.calls
+    started = time.perf_counter()
+    counts = asyncio.run(warm_cache.warm(items, args.concurrency))
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(cache_snapshot.path)
+    print(
+        f"Warm-up of {args.hot} hot prompts at concurrency {args.concurrency}: {elapsed:.2f}s "
+        f"({model.calls - calls} model calls, {counts['failed']} failed), snapshot {size / 1024:.0f} KiB"
+    )
+
+    # The same prompts in a fresh worker are served from the snapshot without model calls
+    gemini_service.response_cache.backend.cache.clear()
+    cache_snapshot._index = None
+    calls = model.calls
+    started = time.perf_counter()
+    counts = asyncio.run(warm_cache.warm(items, args.concurrency))
+    elapsed = time.perf_counter() - started
+    print(
+        f"Restarted worker: {counts['cached']} of {args.hot} hot prompts served from the snapshot "
+        f"in {elapsed * 1e3:.1f} ms ({model.calls - calls} model calls)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=2000, help="entries in the format benchmark")
+    parser.add_argument("--hot", type=int, default=200, help="hot prompts to pre-warm")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-median", type=float, default=0.05, help="fake model median latency (s)")
+    parser.add_argument("--latency-p99", type=float, default=0.25, help="fake model p99 latency (s)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    try:
+        asyncio.run(bench_format(args, rng))
+        bench_warmup(args, rng)
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Cold-start cost of the app: import time and latency of the first requests.
+
+Each sample starts a fresh interpreter with `-X importtime`, imports
+Backend.main and reports the cumulative import time of the app plus the
+modules that contribute most to it. A second fresh process starts the app
+(offline fake model) and times its first GET /health and POST /refine.
+With a real GEMINI_API_KEY configured, provider SDKs must not be imported
+until the app starts; the benchmark fails if google.generativeai is.
+
+Save a baseline, then compare later runs against it; the script exits with
+status 1 when a median is more than --tolerance (and --min-delta seconds)
+above the baseline:
+    python benchmarks/bench_startup.py --save startup_baseline.json
+    python benchmarks/bench_startup.py --baseline startup_baseline.json [--tolerance 0.25]
+
+Usage (from the backend directory):
+    python benchmarks/bench_startup.py [--runs 5] [--top 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+# Environment of every child: offline, in-memory and isolated from any .env cache settings
+CHILD_ENV = {
+    "CACHE_BACKEND": "memory",
+    "CACHE_SNAPSHOT": "0",
+    "RATE_LIMIT_BACKEND": "memory",
+    "LOG_LEVEL": "WARNING",
+}
+
+IMPORT_SCRIPT = """
+import sys
+import Backend.main
+print("LAZY_SDK", "google.generativeai" not in sys.modules)
+"""
+
+FIRST_REQUEST_SCRIPT = """
+import json
+import time
+started = time.perf_counter()
+from fastapi.testclient import TestClient
+from Backend.main import app
+imported = time.perf_counter()
+with TestClient(app) as client:
+    ready = time.perf_counter()
+    assert client.get("/health").status_code == 200
+    health = time.perf_counter()
+    response = client.post("/refine", json={"raw_input": "Summarize this quarterly report", "mode": "deep"})
+    assert response.status_code == 200, response.text
+    refine = time.perf_counter()
+print("RESULT " + json.dumps({
+    "import_s": imported - started,
+    "startup_s": ready - imported,
+    "first_health_s": health - ready,
+    "first_refine_s": refine - health,
+}))
+"""
+
+
+def run_child(script, extra_env, importtime=False):
+    env = dict(os.environ, **CHILD_ENV, **extra_env)
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", script]
+    result = subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"Child process failed:\n{result.stderr[-2000:]}")
+    return result
+
+
+def parse_importtime(stderr, module="Backend.main"):
+    """Cumulative import time of module and of each module it imports directly, in seconds.
+
+    -X importtime lists a module after everything it imported, each nested
+    level indented by two more spaces.
+    """
+    total, direct, pending = 0.0, {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        seconds = int(cumulative_us) / 1e6
+        if depth == 1:
+            pending[name.strip()] = seconds
+        elif depth == 0:
+            if name.strip() == module:
+                total, direct = seconds, pending
+            pending = {}
+    return total, direct
+
+
+def measure_imports(runs, top):
+    totals = []
+    modules = {}
+    lazy = True
+    for _ in range(runs):
+        # A configured (dummy) key makes the real Gemini provider part of the app
+        result = run_child(IMPORT_SCRIPT, {"GEMINI_API_KEY": "dummy", "GEMINI_FAKE": ""}, importtime=True)
+        lazy = lazy and "LAZY_SDK True" in result.stdout
+        total, direct = parse_importtime(result.stderr)
+        totals.append(total)
+        for name, seconds in direct.items():
+            modules.setdefault(name, []).append(seconds)
+    heaviest = sorted(
+        ((name, statistics.median(times)) for name, times in modules.items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:top]
+    return statistics.median(totals), heaviest, lazy
+
+
+def measure_first_requests(runs):
+    samples = []
+    for _ in range(runs):
+        result = run_child(FIRST_REQUEST_SCRIPT, {"GEMINI_FAKE": "1", "FAKE_LATENCY_MEDIAN": "0.01", "FAKE_LATENCY_P99": "0.02"})
+        line = next(line for line in result.stdout.splitlines() if line.startswith("RESULT "))
+        samples.append(json.loads(line[len("RESULT "):]))
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--top", type=int, default=10, help="heaviest direct imports to list")
+    parser.add_argument("--save", help="write the medians to this JSON file")
+    parser.add_argument("--baseline", help="compare against medians saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the baseline")
+    parser.add_argument("--min-delta", type=float, default=0.02, help="slowdowns under this many seconds never fail")
+    args = parser.parse_args()
+
+    import_s, heaviest, lazy = measure_imports(args.runs, args.top)
+    print(f"import Backend.main: {import_s * 1000:.0f} ms (median of {args.runs}, -X importtime)")
+    print("\nHeaviest imports of Backend.main:")
+    for name, seconds in heaviest:
+        print(f"  {name:<40} {seconds * 1000:>7.0f} ms")
+
+    first = measure_first_requests(args.runs)
+    print(f"\nFirst requests (median of {args.runs} fresh processes, fake model):")
+    for key, seconds in first.items():
+        print(f"  {key:<16} {seconds * 1000:>7.1f} ms")
+
+    results = dict(first, importtime_s=import_s)
+    failures = []
+    if not lazy:
+        failures.append("google.generativeai is imported with the app instead of at startup")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nAgainst {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for key, seconds in results.items():
+            if key not in baseline:
+                continue
+            change = seconds / baseline[key] - 1 if baseline[key] else 0.0
+            # Millisecond timings are noisy; only slowdowns that also cost real time count
+            regressed = change > args.tolerance and seconds - baseline[key] > args.min_delta
+            print(f"  {key:<16} {baseline[key] * 1000:>7.1f} -> {seconds * 1000:>7.1f} ms {change:>+7.0%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                failures.append(f"{key} regressed by {change:.0%}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved medians to {args.save}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""Replay recorded production traffic against the app and the offline fake model.
+
+Reads the traces written by the traffic recorder (TRAFFIC_LOG_DIR, see
+services/traffic.py) and sends the same sequence of requests: the same
+routes, modes, options, input lengths and repeat pattern, at the recorded
+arrival times divided by --speed. Inputs are only stored as hashes, so each
+distinct hash is replaced by synthetic text of the recorded length; exact
+repeats (and therefore exact cache hits) are reproduced, near-duplicates
+matched by the semantic cache are not.
+
+By default the app runs in-process with the fake model, and each recorded
+client gets its own address so per-client rate limits apply as they did.
+Pass --env to try other settings (cache size, rate limits, scheduler
+budgets), or --url to replay against a server started separately, e.g.
+with GEMINI_FAKE=1 and a different number of workers; all requests then
+come from this machine's address, and cache hit ratios are only reported
+if ADMIN_TOKEN holds the server's admin token (they come from /admin/stats).
+
+Usage (from the backend directory):
+    python benchmarks/replay_traffic.py /var/log/prompt-tools/traffic --speed 10
+    python benchmarks/replay_traffic.py traces/ --speed 60 --env CACHE_MAX_ENTRIES=200 --env RATE_LIMIT=30
+    python benchmarks/replay_traffic.py traces/ --url http://localhost:8000 --speed 5
+"""
+import argparse
+import asyncio
+import contextlib
+import glob
+import json
+import os
+import random
+import secrets
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+# Routes that can be replayed from their recorded shape
+REPLAYABLE = {
+    "/refine", "/refine/stream", "/refine/batch", "/refine/explain",
+    "/explain", "/explain/stream", "/jobs/refine", "/jobs/explain",
+}
+EXPLAIN_ROUTES = {"/explain", "/explain/stream", "/jobs/explain"}
+
+WORDS = (
+    "write draft summarize email report project update team customer product launch meeting "
+    "agenda blog post remote work research paper onboarding checklist cover letter data analyst "
+    "quarterly review marketing plan feature announcement tweet outline story lesson beginner "
+    "recursion budget proposal follow up reminder policy guide tutorial"
+).split()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def load_trace(paths):
+    """Recorded requests from trace files or directories of them, oldest first"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "traffic-*.jsonl*")))
+        else:
+            files.append(path)
+    records = []
+    for name in files:
+        with open(name, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def synthesize(digest, length):
+    """Deterministic stand-in text of the given length for an input hash"""
+    rng = random.Random(digest)
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:max(1, length)]
+
+
+def refine_body(shape):
+    persona = shape.get("persona")
+    return {
+        "raw_input": synthesize(shape.get("h", ""), shape.get("len", 40)),
+        "mode": shape.get("mode", "deep"),
+        "tone": shape.get("tone", "default"),
+        # Personas are recorded as hashes too
+        "persona": synthesize(persona, 24) if persona else "",
+        "return_format": shape.get("fmt", "plain"),
+    }
+
+
+def build_request(record):
+    """(route, JSON body) to send for a recorded request, or None if it can't be replayed"""
+    route = record.get("route")
+    if record.get("method") != "POST" or route not in REPLAYABLE or "h" not in record and "items" not in record:
+        return None
+    if route in EXPLAIN_ROUTES:
+        return route, {"prompt": synthesize(record["h"], record.get("len", 40))}
+    if route == "/refine/batch":
+        body = {"items": [refine_body(item) for item in record.get("items", [])]}
+        if "concurrency" in record:
+            body["concurrency"] = record["concurrency"]
+        return route, body
+    return route, refine_body(record)
+
+
+def client_address(digest):
+    """A stable private IP for a recorded (hashed) client"""
+    number = int(digest[:6], 16) if digest else 0
+    return f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+
+
+def cache_counters(stats):
+    caches = stats.get("cache", {})
+    return {name: (caches[name]["hits"], caches[name]["misses"]) for name in ("refine", "explain") if name in caches}
+
+
+async def replay(records, args, app=None):
+    """Send the recorded requests on their (compressed) schedule; returns per-route samples"""
+    clients = {}
+    results = []
+
+    def client_for(record):
+        # In-process, each recorded client gets its own address
+        key = record.get("client", "") if app is not None else None
+        if key not in clients:
+            clients[key] = make_client(args, app, client_address(key) if key is not None else None)
+        return clients[key]
+
+    async def send(record, route, body):
+        start = time.perf_counter()
+        try:
+            response = await client_for(record).post(route, json=body)
+            status = response.status_code
+        except Exception as e:
+            status = type(e).__name__
+        results.append((route, status, time.perf_counter() - start))
+
+    t0 = records[0]["t"]
+    started = time.perf_counter()
+    tasks = []
+    for record in records:
+        request = build_request(record)
+        if request is None:
+            continue
+        delay = (record["t"] - t0) / args.speed - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(record, *request)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    for client in clients.values():
+        await client.aclose()
+    return results, elapsed
+
+
+def make_client(args, app, address=None):
+    if app is None:
+        return httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    transport = httpx.ASGITransport(app=app, client=(address or "127.0.0.1", 50000))
+    return httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=args.timeout)
+
+
+async def get_stats(args, app):
+    """The app's /admin/stats, or {} without a valid ADMIN_TOKEN"""
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token:
+        return {}
+    async with make_client(args, app) as client:
+        response = await client.get("/admin/stats", headers={"X-Admin-Token": token})
+    return response.json() if response.status_code == 200 else {}
+
+
+async def run(records, args):
+    app = None
+    model = None
+    if not args.url:
+        from Backend.main import app
+        import services.gemini_service as gemini_service
+        model = gemini_service.GEMINI_MODEL
+        model.latency_median, model.latency_p99 = args.latency, max(args.latency * 4, args.latency)
+
+    async with (app.router.lifespan_context(app) if app is not None else contextlib.AsyncExitStack()):
+        before = cache_counters(await get_stats(args, app))
+        calls_before = model.calls if model is not None else None
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results, elapsed = await replay(records, args, app)
+        after = cache_counters(await get_stats(args, app))
+    upstream = model.calls - calls_before if model is not None else None
+    hits = {
+        name: (after[name][0] - before[name][0], after[name][1] - before[name][1])
+        for name in after if name in before
+    }
+    return results, elapsed, hits, upstream
+
+
+def summarize_trace(records):
+    span = records[-1]["t"] - records[0]["t"] if records else 0.0
+    print(f"Trace: {len(records)} requests over {span:.0f} s")
+    routes = Counter(record.get("route") for record in records)
+    print("  routes: " + ", ".join(f"{route} {count}" for route, count in routes.most_common()))
+    modes = Counter(record.get("mode") for record in records if record.get("mode"))
+    if modes:
+        print("  modes:  " + ", ".join(f"{mode} {count}" for mode, count in modes.most_common()))
+    outcomes = Counter(record.get("cache") for record in records if record.get("cache"))
+    if outcomes:
+        total = sum(outcomes.values())
+        print("  cache:  " + ", ".join(f"{name} {count / total:.0%}" for name, count in outcomes.most_common()))
+    lengths = [record["len"] for record in records if "len" in record]
+    if lengths:
+        print(f"  input length p50 {percentile(lengths, 50)}, p95 {percentile(lengths, 95)} characters")
+    clients = len({record.get("client") for record in records})
+    distinct = len({record["h"] for record in records if "h" in record})
+    print(f"  {clients} clients, {distinct} distinct inputs")
+
+
+def report(records, results, elapsed, hits, upstream):
+    recorded = {}
+    for record in records:
+        if build_request(record) is not None:
+            recorded.setdefault(record["route"], []).append(record.get("dur", 0.0))
+
+    print(f"\nReplay: {len(results)} requests in {elapsed:.1f} s ({len(results) / max(elapsed, 1e-9):.1f} req/s)")
+    print(f"{'route':<17} {'reqs':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rec p95':>8}  status")
+    by_route = {}
+    for route, status, latency in results:
+        by_route.setdefault(route, []).append((status, latency))
+    for route, samples in sorted(by_route.items()):
+        latencies = [latency for _, latency in samples]
+        statuses = Counter(status for status, _ in samples)
+        print(
+            f"{route:<17} {len(samples):>5} {percentile(latencies, 50) * 1e3:>8.1f} "
+            f"{percentile(latencies, 95) * 1e3:>8.1f} {percentile(latencies, 99) * 1e3:>8.1f} "
+            f"{percentile(recorded.get(route, []), 95) * 1e3:>8.1f}  "
+            + " ".join(f"{status}:{count}" for status, count in sorted(statuses.items(), key=str))
+        )
+    for name, (hit, miss) in hits.items():
+        print(f"{name} cache: {hit} hits, {miss} misses ({hit / max(1, hit + miss):.0%} hit ratio)")
+    if upstream is not None:
+        print(f"upstream calls: {upstream}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("traces", nargs="+", help="trace files or directories of traffic-*.jsonl files")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression: 10 replays 10x faster")
+    parser.add_argument("--limit", type=int, help="replay at most this many requests")
+    parser.add_argument("--skip", type=int, default=0, help="start this many requests into the trace")
+    parser.add_argument("--url", help="replay against this running server instead of the app in-process")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="setting for the in-process app (repeatable)")
+    parser.add_argument("--latency", type=float, default=0.8, help="median fake-model latency in seconds")
+    parser.add_argument("--timeout", type=float, default=120, help="client timeout per request in seconds")
+    args = parser.parse_args()
+
+    records = load_trace(args.traces)[args.skip:]
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        sys.exit("No recorded requests found")
+    summarize_trace(records)
+
+    if not args.url:
+        # An isolated, offline app that does not record the replay itself
+        os.environ.update({
+            "GEMINI_FAKE": "1",
+            "CACHE_BACKEND": "memory",
+            "CACHE_SNAPSHOT": "0",
+            "RATE_LIMIT_BACKEND": "memory",
+            "LOG_LEVEL": "WARNING",
+        })
+        os.environ.pop("TRAFFIC_LOG_DIR", None)
+        # Lets the replay read the cache counters from /admin/stats
+        os.environ.setdefault("ADMIN_TOKEN", secrets.token_hex(16))
+        for setting in args.env:
+            name, _, value = setting.partition("=")
+            os.environ[name] = value
+        sys.path.append(str(Path(__file__).parent.parent))
+
+    results, elapsed, hits, upstream = asyncio.run(run(records, args))
+    report(records, results, elapsed, hits, upstream)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic import BaseModel
 
 class PromptRequest(BaseModel):
@@ -6,3 +7,14 @@ class PromptRequest(BaseModel):
     tone: str = "default"
     persona: str = ""
     return_format: str = "plain"
+
+class BatchRefineRequest(BaseModel):
+    items: List[PromptRequest]
+    # Optional overrides applied to every item
+    mode: Optional[str] = None
+    tone: Optional[str] = None
+    concurrency: Optional[int] = None
+
+class RefineJobRequest(PromptRequest):
+    # Receives the finished job record as a JSON POST
+    callback_url: Optional[str] = None
@@ -0,0 +1,87 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+import os
+import hmac
+from services.profiling import loop_monitor, profiler, render_folded, PROFILE_MAX_SECONDS
+from services.gemini_service import response_cache, semantic_cache, refine_flight, model_router, USE_FAKE_MODEL
+from services.cache_snapshot import cache_snapshot
+from services.jobs import job_queue
+from services.micro_batch import micro_batcher
+from services.scheduler import scheduler
+from services.traffic import traffic_recorder
+from routers import explain, refine_explain
+
+# Admin endpoints are disabled (404) unless ADMIN_TOKEN is set; requests must
+# send it in the X-Admin-Token header. Each answers for the worker that
+# serves it (the pid is included)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+@router.get("/stats")
+async def service_stats():
+    """Provider, cache, queue and upstream stats of this worker (GET /health only answers liveness)"""
+    return {
+        "pid": os.getpid(),
+        "services": {
+            "gemini_api": "fake" if USE_FAKE_MODEL else "connected" if os.getenv("GEMINI_API_KEY") else "not configured",
+            "openai_api": "connected" if os.getenv("OPENAI_API_KEY") and not USE_FAKE_MODEL else "not configured",
+        },
+        "cache": {
+            "refine": response_cache.stats(),
+            "explain": explain.explain_cache.stats(),
+            "refine_semantic": semantic_cache.stats(),
+            "explain_semantic": explain.explain_semantic_cache.stats(),
+            "snapshot": cache_snapshot.stats() if cache_snapshot else None,
+        },
+        "in_flight": {
+            "refine": refine_flight.stats(),
+            "explain": explain.explain_flight.stats(),
+            "refine_explain": refine_explain.refine_explain_flight.stats(),
+        },
+        "jobs": job_queue.stats(),
+        "micro_batch": micro_batcher.stats(),
+        "scheduler": scheduler.stats(),
+        "traffic_recorder": traffic_recorder.stats(),
+        "event_loop": loop_monitor.stats() if loop_monitor is not None else None,
+        "upstream": model_router.stats(),
+    }
+
+@router.get("/loop")
+async def loop_status(blocks: bool = Query(True, description="include recent blocking steps and their stacks")):
+    """Event-loop lag, blocking steps and GC activity of this worker"""
+    if loop_monitor is None:
+        raise HTTPException(status_code=404, detail="Loop monitor is disabled (LOOP_MONITOR=0)")
+    status = loop_monitor.stats()
+    if blocks:
+        status["recent_blocks"] = list(loop_monitor.recent)
+    return status
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def capture_profile(seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS)):
+    """Sample everything this worker's loop does for `seconds`, as collapsed stacks"""
+    try:
+        stacks = await profiler.capture(seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(render_folded(stacks), headers={"X-Worker-Pid": str(os.getpid())})
+
+@router.get("/profile/requests", response_class=PlainTextResponse)
+async def sampled_request_profile(reset: bool = False):
+    """Collapsed stacks of the requests sampled so far (PROFILE_SAMPLE_RATE)"""
+    return PlainTextResponse(
+        render_folded(profiler.request_stacks(reset=reset)), headers={"X-Worker-Pid": str(os.getpid())}
+    )
+
+@router.post("/profile/sample-rate")
+async def set_sample_rate(rate: float = Query(..., ge=0, le=1)):
+    """Change the fraction of requests this worker samples"""
+    profiler.sample_rate = rate
+    return profiler.stats()
@@ -1,90 +1,216 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import google.generativeai as genai
-import os
 import asyncio
 import time
-import traceback
+import logging
 import hashlib
-from dotenv import load_dotenv
-from services.gemini_service import GEMINI_MODEL, MAX_API_TIMEOUT
+from services.gemini_service import model_router, BUSY_MESSAGE, NOT_CONFIGURED_MESSAGE, request_model, stream_model
+from services.admission import Overloaded
+from services.providers import should_fail_over
+from services.cache_backends import create_cache
+from services.semantic_cache import SemanticCache
+from services.stale_cache import StaleCache, FRESH
+from services.cache_snapshot import cache_snapshot
+from services.singleflight import SingleFlight
+from services.streaming import format_sse, SSE_HEADERS
+from services.traffic import note_cache
+from services.results import track_results, note_stored, stored_key, result_link
+from services.tokens import fit_input
+from services.metrics import STAGE_LATENCY
 
-load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Simple in-memory cache for explain endpoint
-explain_cache = {}
+# In-flight explain calls, keyed like the cache, so concurrent duplicates share one upstream call
+explain_flight = SingleFlight("explain")
+
+# Bounded cache for explain endpoint (backend chosen by CACHE_BACKEND); stale
+# entries are served while they are refreshed in the background
 CACHE_TTL = 3600  # Cache time-to-live in seconds (1 hour)
+explain_cache = StaleCache(
+    create_cache("explain", ttl=CACHE_TTL), explain_flight, ttl=CACHE_TTL, snapshot=cache_snapshot
+)
+
+# Near-duplicate prompts reuse cached explanations
+explain_semantic_cache = SemanticCache(explain_cache, ttl=explain_cache.hard_ttl)
+EXPLAIN_PARTITION = ("explain",)
+
+EXPLAIN_CRITERIA = (
+    "- What makes this prompt effective or ineffective\n"
+    "- What assumptions it makes\n"
+    "- How it could be improved for clarity, specificity, or neutrality\n"
+)
+EXPLAIN_SECTIONS = "clear sections for 'Effectiveness', 'Assumptions', and 'Improvements'"
+EXPLAIN_SYSTEM_PROMPT = (
+    "You are a prompt engineering expert. Given the following prompt, explain in detail:\n"
+    f"{EXPLAIN_CRITERIA}"
+    f"Return your answer in markdown with {EXPLAIN_SECTIONS}."
+)
+
+def build_explain_prompt(prompt):
+    return f"{EXPLAIN_SYSTEM_PROMPT}\n\nPrompt:\n{prompt}"
 
 def get_explain_cache_key(prompt):
     """Generate a cache key from the prompt"""
     return hashlib.md5(prompt.encode()).hexdigest()
 
+async def cache_explanation(prompt, cache_key, result):
+    """Store an explanation for exact and near-duplicate lookups"""
+    await explain_cache.set(cache_key, result)
+    explain_semantic_cache.add(EXPLAIN_PARTITION, prompt, cache_key)
+
+async def fetch_explanation(prompt, cache_key, route="/explain"):
+    """Call the model for an explanation and cache the result"""
+    result = await request_model(
+        EXPLAIN_SYSTEM_PROMPT, prompt, build_explain_prompt(prompt), route=route, mode="explain"
+    )
+    await cache_explanation(prompt, cache_key, result)
+    return result
+
 class ExplainRequest(BaseModel):
     prompt: str
 
+async def get_explanation(prompt, route="/explain"):
+    """Explanation for prompt from the caches, an identical call in flight, or the model"""
+    cache_key = get_explain_cache_key(prompt)
+
+    async def fetch():
+        return await fetch_explanation(prompt, cache_key, route=route)
+
+    # Check cache first; a stale entry is served now and refreshed in the background
+    with STAGE_LATENCY.time(route=route, mode="explain", stage="cache_lookup"):
+        entry = await explain_cache.lookup(cache_key)
+    if entry is not None and entry.usable:
+        logger.debug("Cache hit for explain endpoint (%s)", entry.state)
+        if entry.state != FRESH:
+            note_cache("stale")
+            note_stored("explain", cache_key)
+            explain_cache.revalidate(cache_key, fetch)
+            return explain_cache.serve_stale(entry, "revalidate")
+        note_cache("hit")
+        note_stored("explain", cache_key)
+        return entry.value
+
+    with STAGE_LATENCY.time(route=route, mode="explain", stage="semantic_lookup"):
+        similar = await explain_semantic_cache.get(EXPLAIN_PARTITION, prompt)
+    if similar is not None:
+        note_cache("semantic")
+        return similar
+
+    # An expired explanation beats an error while every provider's circuit is open
+    if entry is not None and not model_router.available():
+        note_cache("stale")
+        note_stored("explain", cache_key)
+        return explain_cache.serve_stale(entry, "circuit_open")
+
+    try:
+        note_cache("coalesced" if explain_flight.in_flight(cache_key) else "miss")
+        result = await explain_flight.do(cache_key, fetch)
+        note_stored("explain", cache_key)
+        return result
+    except Exception as e:
+        if entry is not None and should_fail_over(e):
+            note_stored("explain", cache_key)
+            return explain_cache.serve_stale(entry, "upstream_error")
+        raise
+
 @router.post("/explain")
 async def explain_prompt(request: ExplainRequest):
-    if not GEMINI_MODEL:
-        raise HTTPException(status_code=500, detail="Gemini API not configured")
+    if not model_router:
+        raise HTTPException(status_code=500, detail=NOT_CONFIGURED_MESSAGE)
     
     start_time = time.time()
-    
-    # Check cache first
-    cache_key = get_explain_cache_key(request.prompt)
-    if cache_key in explain_cache:
-        cache_entry = explain_cache[cache_key]
-        # Check if cache entry is still valid
-        if time.time() - cache_entry["timestamp"] < CACHE_TTL:
-            print(f"Cache hit for explain endpoint")
-            return {"explanation": cache_entry["response"]}
-        else:
-            # Remove expired cache entry
-            del explain_cache[cache_key]
-    
-    system_prompt = (
-        "You are a prompt engineering expert. Given the following prompt, explain in detail:\n"
-        "- What makes this prompt effective or ineffective\n"
-        "- What assumptions it makes\n"
-        "- How it could be improved for clarity, specificity, or neutrality\n"
-        "Return your answer in markdown with clear sections for 'Effectiveness', 'Assumptions', and 'Improvements'."
-    )
-    
+    request.prompt = fit_input(request.prompt, "explain")
+
     try:
-        # Create a task for the API call
-        api_task = asyncio.create_task(
-            GEMINI_MODEL.generate_content_async(f"{system_prompt}\n\nPrompt:\n{request.prompt}")
-        )
-        
-        # Wait for the task to complete with a timeout
-        response = await asyncio.wait_for(api_task, timeout=MAX_API_TIMEOUT)
-        
-        elapsed = time.time() - start_time
-        print(f"Explain endpoint response received in {elapsed:.2f} seconds")
-        
-        result = response.text.strip()
-        
-        # Cache the result
-        explain_cache[cache_key] = {
-            "response": result,
-            "timestamp": time.time()
+        track_results()
+        result = await get_explanation(request.prompt)
+        logger.debug("Explain endpoint response received in %.2f seconds", time.time() - start_time)
+        return {
+            "explanation": result,
+            **result_link("explain", stored_key("explain", get_explain_cache_key(request.prompt))),
         }
-        
-        return {"explanation": result}
     except asyncio.TimeoutError:
-        elapsed = time.time() - start_time
-        print(f"Explain endpoint timeout after {elapsed:.2f} seconds")
+        logger.warning("Explain endpoint timeout after %.2f seconds", time.time() - start_time)
         raise HTTPException(
             status_code=504, 
             detail="Request timed out. Please try again with a shorter prompt."
         )
+    except Overloaded:
+        # Surfaced as 503 + Retry-After by the app's exception handler
+        raise
     except Exception as e:
-        elapsed = time.time() - start_time
-        print(f"Error in explain endpoint after {elapsed:.2f} seconds: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error in explain endpoint after %.2f seconds", time.time() - start_time)
         raise HTTPException(
             status_code=500,
             detail=f"Error processing request: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.post("/explain/stream")
+async def explain_prompt_stream(request: ExplainRequest):
+    if not model_router:
+        raise HTTPException(status_code=500, detail=NOT_CONFIGURED_MESSAGE)
+    request.prompt = fit_input(request.prompt, "explain")
+
+    async def events():
+        start_time = time.time()
+        cache_key = get_explain_cache_key(request.prompt)
+        try:
+            # A cache hit, or an identical request already in flight, is replayed as a whole
+            cached = None
+            stored = True  # whether the explanation is the one cached under cache_key
+            entry = await explain_cache.lookup(cache_key)
+            if entry is not None and entry.usable:
+                cached = entry.value
+                note_cache("hit" if entry.state == FRESH else "stale")
+                if entry.state != FRESH:
+                    explain_cache.revalidate(cache_key, lambda: fetch_explanation(request.prompt, cache_key))
+                    explain_cache.serve_stale(entry, "revalidate")
+            if cached is None:
+                cached = await explain_semantic_cache.get(EXPLAIN_PARTITION, request.prompt)
+                if cached is not None:
+                    note_cache("semantic")
+                    stored = False
+            if cached is None and explain_flight.in_flight(cache_key):
+                note_cache("coalesced")
+                cached = await explain_flight.do(cache_key, None)
+            if cached is None and entry is not None and not model_router.available():
+                note_cache("stale")
+                cached = explain_cache.serve_stale(entry, "circuit_open")
+            if cached is not None:
+                link = result_link("explain", cache_key if stored else None)
+                yield format_sse("done", {"explanation": cached, "cached": True, **link})
+                return
+
+            note_cache("miss")
+            parts = []
+            try:
+                async for chunk in stream_model(
+                    build_explain_prompt(request.prompt), route="/explain/stream", mode="explain"
+                ):
+                    parts.append(chunk)
+                    yield format_sse("token", {"text": chunk})
+            except Exception as e:
+                # Fall back to an expired explanation only if nothing has been sent yet
+                if parts or entry is None or not should_fail_over(e):
+                    raise
+                stale = explain_cache.serve_stale(entry, "upstream_error")
+                yield format_sse("done", {"explanation": stale, "cached": True, **result_link("explain", cache_key)})
+                return
+
+            result = "".join(parts).strip()
+            await cache_explanation(request.prompt, cache_key, result)
+            logger.debug("Explain stream completed in %.2f seconds", time.time() - start_time)
+            yield format_sse("done", {"explanation": result, "cached": False, **result_link("explain", cache_key)})
+        except asyncio.TimeoutError:
+            logger.warning("Explain stream timeout after %.2f seconds", time.time() - start_time)
+            yield format_sse("error", {"detail": "Request timed out. Please try again with a shorter prompt."})
+        except Overloaded as e:
+            yield format_sse("error", {"detail": BUSY_MESSAGE, "retry_after": e.retry_after})
+        except Exception as e:
+            logger.exception("Error in explain stream after %.2f seconds", time.time() - start_time)
+            yield format_sse("error", {"detail": f"Error processing request: {str(e)}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
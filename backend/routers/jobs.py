@@ -0,0 +1,93 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse
+from typing import Optional
+from models.prompt_request import RefineJobRequest
+from routers.explain import ExplainRequest, get_explanation, get_explain_cache_key, explain_cache
+from services.gemini_service import (
+    model_router,
+    response_cache,
+    get_refined_prompts,
+    build_prompt,
+    get_cache_key,
+    NOT_CONFIGURED_MESSAGE,
+)
+from services.stale_cache import FRESH
+from services.jobs import job_queue, validate_callback_url, FINISHED
+from services.traffic import note_cache
+from services.tokens import fit_input
+
+router = APIRouter()
+
+class ExplainJobRequest(ExplainRequest):
+    # Receives the finished job record as a JSON POST
+    callback_url: Optional[str] = None
+
+async def fresh_result(cache, cache_key):
+    """A fresh cached result, which finishes a job without queueing it"""
+    entry = await cache.lookup(cache_key)
+    return entry.value if entry is not None and entry.state == FRESH else None
+
+async def submit(kind, run, cache, cache_key, callback_url):
+    if not model_router:
+        raise HTTPException(status_code=500, detail=NOT_CONFIGURED_MESSAGE)
+    if job_queue.unavailable:
+        raise HTTPException(status_code=503, detail=job_queue.unavailable)
+    if callback_url:
+        error = await validate_callback_url(callback_url)
+        if error:
+            raise HTTPException(status_code=422, detail=error)
+
+    # Overloaded (queue full) is surfaced as 503 + Retry-After by the app's exception handler
+    record = await job_queue.submit(
+        kind,
+        run,
+        dedupe_key=cache_key,
+        cached=await fresh_result(cache, cache_key),
+        callback_url=callback_url,
+    )
+    if record["cached"]:
+        note_cache("hit")
+    record["status_url"] = f"/jobs/{record['job_id']}"
+    record["queue_depth"] = job_queue.queue_depth()
+    return JSONResponse(status_code=200 if record["status"] in FINISHED else 202, content=record)
+
+@router.post("/jobs/refine")
+async def submit_refine_job(request: RefineJobRequest):
+    request.raw_input = fit_input(request.raw_input, request.mode)
+    prompt = build_prompt(request.mode, request.tone, request.persona, request.return_format, request.raw_input)
+
+    # The raising path, so a failure ends the job as "failed" with its error
+    async def run():
+        return await get_refined_prompts(
+            request.raw_input,
+            request.mode,
+            request.tone,
+            request.persona,
+            request.return_format,
+            route="/jobs/refine",
+        )
+
+    return await submit(
+        "refine", run, response_cache, get_cache_key(prompt, request.mode), request.callback_url
+    )
+
+@router.post("/jobs/explain")
+async def submit_explain_job(request: ExplainJobRequest):
+    request.prompt = fit_input(request.prompt, "explain")
+
+    async def run():
+        return await get_explanation(request.prompt, route="/jobs/explain")
+
+    return await submit(
+        "explain", run, explain_cache, get_explain_cache_key(request.prompt), request.callback_url
+    )
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = Query(0, ge=0)):
+    """Job status and result; with `wait`, hold the request until the job finishes or `wait` seconds (at most JOB_MAX_WAIT) pass"""
+    if job_queue.unavailable:
+        raise HTTPException(status_code=503, detail=job_queue.unavailable)
+    record = await job_queue.wait(job_id, wait) if wait else await job_queue.get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return record
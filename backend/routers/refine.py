@@ -1,11 +1,29 @@
-from fastapi import APIRouter, BackgroundTasks
-from models.prompt_request import PromptRequest
-from services.gemini_service import generate_refined_prompts
+import json
+from fastapi import APIRouter, BackgroundTasks, HTTPException
+from fastapi.responses import StreamingResponse
+from models.prompt_request import PromptRequest, BatchRefineRequest
+from services.gemini_service import (
+    generate_refined_prompts,
+    stream_refined_prompts,
+    generate_refined_prompts_batch,
+    build_prompt,
+    get_cache_key,
+)
+from services.streaming import format_sse, SSE_HEADERS
+from services.scheduler import priority_class
+from services.traffic import note_cache
+from services.results import track_results, stored_key, result_link
+from services.tokens import fit_input, InputTooLarge
 
 router = APIRouter()
 
+# Largest number of items accepted by /refine/batch
+MAX_BATCH_SIZE = 100
+
 @router.post("/refine")
 async def refine_prompt(request: PromptRequest):
+    request.raw_input = fit_input(request.raw_input, request.mode)
+    track_results()
     refined_prompts = await generate_refined_prompts(
         request.raw_input,
         request.mode,
@@ -13,4 +31,56 @@ async def refine_prompt(request: PromptRequest):
         request.persona,
         request.return_format
     )
-    return {"refined_prompts": refined_prompts}
\ No newline at end of file
+    prompt = build_prompt(request.mode, request.tone, request.persona, request.return_format, request.raw_input)
+    # Stored results can be fetched again, HTTP-cacheably, from result_url
+    cache_key = stored_key("refine", get_cache_key(prompt, request.mode))
+    return {"refined_prompts": refined_prompts, **result_link("refine", cache_key)}
+
+@router.post("/refine/stream")
+async def refine_prompt_stream(request: PromptRequest):
+    request.raw_input = fit_input(request.raw_input, request.mode)
+
+    async def events():
+        async for event, data in stream_refined_prompts(
+            request.raw_input,
+            request.mode,
+            request.tone,
+            request.persona,
+            request.return_format
+        ):
+            yield format_sse(event, data)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/refine/batch")
+async def refine_prompt_batch(request: BatchRefineRequest):
+    if not request.items:
+        raise HTTPException(status_code=422, detail="Batch must contain at least one item")
+    if len(request.items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(request.items)} items (maximum {MAX_BATCH_SIZE})"
+        )
+
+    overrides = {
+        field: value
+        for field, value in (("mode", request.mode), ("tone", request.tone))
+        if value is not None
+    }
+    items = [item.model_copy(update=overrides) for item in request.items]
+    for index, item in enumerate(items):
+        try:
+            item.raw_input = fit_input(item.raw_input, item.mode)
+        except InputTooLarge as e:
+            raise HTTPException(status_code=413, detail=f"Item {index}: {e}")
+    # Batches queue behind interactive traffic in the fair scheduler
+    priority_class.set("bulk")
+    # Items are answered separately, so the recorder gets no single cache outcome
+    note_cache("batch")
+
+    # One NDJSON line per item, in completion order, tagged with its original index
+    async def lines():
+        async for index, refined_prompts in generate_refined_prompts_batch(items, request.concurrency):
+            yield json.dumps({"index": index, "refined_prompts": refined_prompts}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
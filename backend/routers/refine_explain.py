@@ -0,0 +1,201 @@
+from fastapi import APIRouter, HTTPException
+import json
+import time
+import asyncio
+import logging
+from models.prompt_request import PromptRequest
+from services.gemini_service import (
+    model_router,
+    response_cache,
+    semantic_cache,
+    NOT_CONFIGURED_MESSAGE,
+    build_prompt,
+    call_model,
+    get_cache_key,
+    get_partition,
+    cache_refined_prompts,
+    fetch_refined_prompts,
+    get_refined_prompts,
+)
+from services.admission import Overloaded
+from services.singleflight import SingleFlight
+from services.parsing import parse_response, strip_code_fence
+from services.traffic import note_cache
+from services.results import track_results, note_stored, stored_key, result_link
+from services.tokens import fit_input
+from services.metrics import STAGE_LATENCY, REFINE_EXPLAIN_CALLS
+from routers.explain import (
+    EXPLAIN_CRITERIA,
+    EXPLAIN_SECTIONS,
+    get_explanation,
+    get_explain_cache_key,
+    cache_explanation,
+)
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+ROUTE = "/refine/explain"
+
+# In-flight fused calls, keyed like the refine cache
+refine_explain_flight = SingleFlight("refine_explain")
+
+# The answer holds the refinement and an explanation of every variant
+FUSED_MAX_OUTPUT_TOKENS = 4096
+
+def build_fused_prompt(prompt):
+    """A refine prompt that also asks for an explanation of each prompt it produces, as one JSON object"""
+    return (
+        f"{prompt}\n\n"
+        "Then, as a prompt engineering expert, explain in detail for each separate prompt you wrote:\n"
+        f"{EXPLAIN_CRITERIA}\n"
+        'Respond with nothing but a JSON object with two keys: "response", a string holding your complete '
+        'answer to the task above exactly as you would write it on its own, and "explanations", an array '
+        "with one markdown string per prompt in that answer, in the same order, each with "
+        f"{EXPLAIN_SECTIONS}."
+    )
+
+def split_fused_response(text):
+    """(response, explanations) of a fused answer, or None if it is not usable"""
+    try:
+        data = json.loads(strip_code_fence(text))
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    response, explanations = data.get("response"), data.get("explanations")
+    if not isinstance(response, str) or not response.strip() or not isinstance(explanations, list):
+        return None
+    return response.strip(), [e.strip() if isinstance(e, str) else "" for e in explanations]
+
+def explainable_prompts(refined):
+    """The prompts of a refinement, as the strings /explain would be called with"""
+    items = refined if isinstance(refined, list) else [refined]
+    return [item if isinstance(item, str) else json.dumps(item, ensure_ascii=False) for item in items]
+
+async def explain_all(prompts, route=ROUTE):
+    return list(await asyncio.gather(*(get_explanation(prompt, route=route) for prompt in prompts)))
+
+async def fetch_refined_and_explained(prompt, cache_key, mode, return_format, partition, raw_input):
+    """One upstream call for a refinement and its explanations; fills both caches"""
+    text = await call_model(
+        build_fused_prompt(prompt), route=ROUTE, mode=mode,
+        generation={"max_output_tokens": FUSED_MAX_OUTPUT_TOKENS},
+    )
+    fused = split_fused_response(text)
+    if fused is None:
+        # Not the JSON asked for: make the two ordinary calls instead
+        REFINE_EXPLAIN_CALLS.inc(mode=mode, outcome="fallback")
+        logger.warning("Could not split a fused refine-and-explain response (mode: %s); calling separately", mode)
+        refined = await fetch_refined_prompts(prompt, cache_key, mode, return_format, partition, raw_input, route=ROUTE)
+        return refined, await explain_all(explainable_prompts(refined))
+
+    response, explanations = fused
+    with STAGE_LATENCY.time(route=ROUTE, mode=mode, stage="parse"):
+        refined = parse_response(response, mode, return_format)
+    await cache_refined_prompts(cache_key, refined, partition, raw_input)
+
+    prompts = explainable_prompts(refined)
+    if len(explanations) != len(prompts):
+        # Without one explanation per prompt there is no telling which explains
+        # which (parsing may have split or dropped items), so none is used or cached
+        REFINE_EXPLAIN_CALLS.inc(mode=mode, outcome="mismatch")
+        logger.warning(
+            "Fused response explained %d prompts, %d were parsed (mode: %s); explaining separately",
+            len(explanations), len(prompts), mode,
+        )
+        return refined, await explain_all(prompts)
+
+    results = []
+    missing = []
+    for index, variant in enumerate(prompts):
+        explanation = explanations[index]
+        if explanation:
+            await cache_explanation(variant, get_explain_cache_key(variant), explanation)
+            note_stored("explain", get_explain_cache_key(variant))
+        else:
+            missing.append(index)
+        results.append(explanation)
+    if missing:
+        # The model left some explanations empty; explain those prompts on their own
+        REFINE_EXPLAIN_CALLS.inc(mode=mode, outcome="partial")
+        for index, explanation in zip(missing, await explain_all([prompts[i] for i in missing])):
+            results[index] = explanation
+    else:
+        REFINE_EXPLAIN_CALLS.inc(mode=mode, outcome="fused")
+    return refined, results
+
+async def refine_and_explain(raw_input, mode="deep", tone="default", persona="", return_format="plain"):
+    """Refined prompts and an explanation of each, from the caches or a single fused model call"""
+    prompt = build_prompt(mode, tone, persona, return_format, raw_input)
+    cache_key = get_cache_key(prompt, mode)
+    partition = get_partition(mode, tone, persona, return_format)
+
+    # A cached refinement only needs its explanations, which are usually cached too
+    with STAGE_LATENCY.time(route=ROUTE, mode=mode, stage="cache_lookup"):
+        entry = await response_cache.lookup(cache_key)
+    if entry is not None and entry.usable:
+        refined = await get_refined_prompts(raw_input, mode, tone, persona, return_format, route=ROUTE)
+    else:
+        with STAGE_LATENCY.time(route=ROUTE, mode=mode, stage="semantic_lookup"):
+            refined = await semantic_cache.get(partition, raw_input)
+        if refined is not None:
+            note_cache("semantic")
+    if refined is not None:
+        REFINE_EXPLAIN_CALLS.inc(mode=mode, outcome="cached")
+        return refined, await explain_all(explainable_prompts(refined))
+
+    async def fetch():
+        return await fetch_refined_and_explained(prompt, cache_key, mode, return_format, partition, raw_input)
+
+    note_cache("coalesced" if refine_explain_flight.in_flight(cache_key) else "miss")
+    result = await refine_explain_flight.do(cache_key, fetch)
+    # Both the fused and the fallback path store the refinement under cache_key
+    note_stored("refine", cache_key)
+    return result
+
+@router.post("/refine/explain")
+async def refine_and_explain_prompt(request: PromptRequest):
+    if not model_router:
+        raise HTTPException(status_code=500, detail=NOT_CONFIGURED_MESSAGE)
+
+    start_time = time.time()
+    request.raw_input = fit_input(request.raw_input, request.mode)
+
+    try:
+        track_results()
+        refined_prompts, explanations = await refine_and_explain(
+            request.raw_input,
+            request.mode,
+            request.tone,
+            request.persona,
+            request.return_format
+        )
+        logger.debug("Refine-and-explain response received in %.2f seconds", time.time() - start_time)
+        prompt = build_prompt(request.mode, request.tone, request.persona, request.return_format, request.raw_input)
+        # explanations[i] explains refined_prompts[i] (the whole object for JSON output), and
+        # explanation_keys[i] is its key under /results/explain/ when it is stored on its own
+        return {
+            "refined_prompts": refined_prompts,
+            "explanations": explanations,
+            **result_link("refine", stored_key("refine", get_cache_key(prompt, request.mode))),
+            "explanation_keys": [
+                stored_key("explain", get_explain_cache_key(variant)) for variant in explainable_prompts(refined_prompts)
+            ],
+        }
+    except asyncio.TimeoutError:
+        logger.warning("Refine-and-explain timeout after %.2f seconds", time.time() - start_time)
+        raise HTTPException(
+            status_code=504,
+            detail="Request timed out. Please try again with a shorter prompt."
+        )
+    except Overloaded:
+        # Surfaced as 503 + Retry-After by the app's exception handler
+        raise
+    except Exception as e:
+        logger.exception("Error in refine-and-explain endpoint after %.2f seconds", time.time() - start_time)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing request: {str(e)}"
+        )
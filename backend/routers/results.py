@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Header, HTTPException, Response
+from typing import Optional
+from services.gemini_service import response_cache
+from services.asgi import dumps
+from services.results import RESULT_KEY_PATTERN, result_link, entity_tag, etag_matches, cache_control
+from services.metrics import RESULT_READS
+from routers.explain import explain_cache
+
+router = APIRouter(prefix="/results")
+
+# Cache and response field of each kind of result
+RESULT_KINDS = {
+    "refine": (response_cache, "refined_prompts"),
+    "explain": (explain_cache, "explanation"),
+}
+
+@router.get("/{kind}/{key}")
+async def get_result(kind: str, key: str, if_none_match: Optional[str] = Header(None)):
+    """A stored refine or explain result by the result_key its POST returned.
+
+    Only the cache is read: nothing is ever computed here. Responses carry a
+    strong ETag and Cache-Control, so browsers, CDNs and reverse proxies can
+    keep them and revalidate with If-None-Match (answered 304).
+    """
+    if kind not in RESULT_KINDS or not RESULT_KEY_PATTERN.match(key):
+        raise HTTPException(status_code=404, detail="Not Found")
+    cache, field = RESULT_KINDS[kind]
+    entry = await cache.lookup(key)
+    if entry is None or not entry.usable:
+        RESULT_READS.inc(kind=kind, outcome="missing")
+        raise HTTPException(
+            status_code=404, detail="Result not found or expired", headers={"Cache-Control": "no-store"}
+        )
+
+    body = dumps({field: entry.value, **result_link(kind, key)})
+    etag = entity_tag(body)
+    headers = {"ETag": etag, "Cache-Control": cache_control(entry, cache)}
+    matched = etag_matches(if_none_match, etag)
+    if matched:
+        RESULT_READS.inc(kind=kind, outcome="not_modified")
+        # Echo the tag the client holds, which names its (possibly compressed) copy
+        headers["ETag"] = matched
+        return Response(status_code=304, headers=headers)
+    RESULT_READS.inc(kind=kind, outcome="ok")
+    return Response(body, media_type="application/json", headers=headers)
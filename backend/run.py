@@ -29,6 +29,34 @@ if __name__ == "__main__":
             def load(self):
                 return self.application
         
+        # Workers share their metrics through a directory so /metrics on any
+        # worker reports totals; files from a previous run are stale
+        import tempfile
+        os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "prompt_tools_metrics"))
+        from services.metrics import clear_metrics_dir
+        clear_metrics_dir()
+
+        # Workers start from the cache snapshot of the previous run; compact
+        # it once here, then optionally pre-warm it from a list of hot
+        # prompts (in a separate process, so no client is created pre-fork)
+        from services.cache_snapshot import cache_snapshot
+        if cache_snapshot:
+            from services.stale_cache import CACHE_HARD_TTL, CACHE_STALE_IF_ERROR
+            cache_snapshot.compact(max_age=CACHE_HARD_TTL + CACHE_STALE_IF_ERROR)
+        warm_file = os.environ.get("CACHE_WARM_FILE")
+        if warm_file:
+            import sys
+            import subprocess
+            print(f"Pre-warming cache from {warm_file}")
+            subprocess.run(
+                [sys.executable, "warm_cache.py", warm_file],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+
+        # Lets the app check that state shared by workers (such as job
+        # records) is kept somewhere they can all reach
+        os.environ["WEB_CONCURRENCY"] = str(worker_count)
+
         # Import the FastAPI app
         from Backend.main import app
         
@@ -0,0 +1,3 @@
+from services.config import load_config
+
+load_config()
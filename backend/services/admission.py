@@ -0,0 +1,233 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from services.metrics import ADMISSION_LIMIT, ADMISSION_QUEUE_DEPTH, ADMISSION_SHED
+
+logger = logging.getLogger(__name__)
+
+# Upstream concurrency per worker starts at ADMISSION_INITIAL_LIMIT and moves
+# between the min and max with AIMD: +1 per limit's worth of completions,
+# x ADMISSION_BACKOFF on a timeout or an overload error, or when recent
+# latency drifts above ADMISSION_LATENCY_TOLERANCE x the long-run latency
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", 8))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", 1))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", 64))
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", 0.7))
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", 2.0))
+
+# Calls over the limit wait in a bounded FIFO queue for at most this long
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 64))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10))
+
+
+class UpstreamUnavailable(Exception):
+    """Provider-neutral transient upstream failure (rate limited, 5xx, connection lost)"""
+
+
+# Upstream failures that mean "send less", as opposed to a bad request.
+# Providers translate their SDK's rate-limit/5xx errors to UpstreamUnavailable
+OVERLOAD_ERRORS = (asyncio.TimeoutError, UpstreamUnavailable)
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed instead of queued; maps to 503 + Retry-After"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Upstream overloaded ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Adaptive concurrency limit for upstream model calls.
+
+    Calls run immediately while fewer than `limit` are in flight, otherwise
+    they wait in a bounded FIFO queue. A call is shed with Overloaded right
+    away when the queue is full or when its expected wait plus the typical
+    upstream latency would overrun its deadline, and later if it is still
+    queued when that becomes true.
+    """
+
+    def __init__(
+        self,
+        name,
+        initial_limit=ADMISSION_INITIAL_LIMIT,
+        min_limit=ADMISSION_MIN_LIMIT,
+        max_limit=ADMISSION_MAX_LIMIT,
+        queue_size=ADMISSION_QUEUE_SIZE,
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+        backoff=ADMISSION_BACKOFF,
+        latency_tolerance=ADMISSION_LATENCY_TOLERANCE,
+    ):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+        # Long-run latency (what "slow" is measured against) and recent
+        # latency (used to estimate queue waits)
+        self.baseline_latency = None
+        self.recent_latency = None
+
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        ADMISSION_LIMIT.set(self.limit, controller=name)
+
+    @property
+    def capacity(self):
+        return max(self.min_limit, int(self.limit))
+
+    def _expected_latency(self):
+        return self.recent_latency or 0.0
+
+    def retry_after(self):
+        """Seconds until a new call would likely be admitted"""
+        backlog = (len(self._waiters) + 1) / self.capacity
+        return max(1, math.ceil(backlog * self._expected_latency()))
+
+    def _shed(self, reason):
+        self.shed += 1
+        ADMISSION_SHED.inc(controller=self.name, reason=reason)
+        logger.warning(
+            "Shedding upstream call (%s): limit %d, in flight %d, queued %d",
+            reason, self.capacity, self.in_flight, len(self._waiters),
+        )
+        raise Overloaded(reason, self.retry_after())
+
+    async def acquire(self, deadline=None, wait=True):
+        """Wait for an upstream slot; deadline is a time.monotonic() value.
+
+        With wait=False the call is only admitted if a slot is free right
+        now (used for optional work such as hedged requests).
+        """
+        if self.in_flight < self.capacity and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if not wait:
+            raise Overloaded("no_free_slot", self.retry_after())
+
+        if len(self._waiters) >= self.queue_size:
+            self._shed("queue_full")
+
+        timeout = self.queue_timeout
+        if deadline is not None:
+            # Leave enough of the deadline for the call itself
+            budget = deadline - time.monotonic() - self._expected_latency()
+            expected_wait = (len(self._waiters) + 1) / self.capacity * self._expected_latency()
+            if budget <= 0 or expected_wait > budget:
+                self._shed("deadline")
+            timeout = min(timeout, budget)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters), controller=self.name)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._forget(waiter)
+            self._shed("queue_timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the caller went away
+                self.release()
+            else:
+                self._forget(waiter)
+            raise
+        self.admitted += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _forget(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters), controller=self.name)
+
+    def _wake(self):
+        # Hand free slots to queued callers in arrival order
+        while self._waiters and self.in_flight < self.capacity:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            waiter.set_result(None)
+            self.in_flight += 1
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters), controller=self.name)
+
+    def record(self, latency, overloaded=False):
+        """Adjust the limit from one completed upstream call"""
+        now = time.monotonic()
+        if self.recent_latency is None:
+            self.recent_latency = latency
+        else:
+            self.recent_latency += 0.2 * (latency - self.recent_latency)
+        # Compare smoothed latencies rather than single samples, since model
+        # latency is heavy-tailed even when the upstream is healthy
+        slow = (
+            self.baseline_latency is not None
+            and self.recent_latency > self.latency_tolerance * self.baseline_latency
+        )
+        if overloaded or slow:
+            # Back off at most once per typical call so one burst of
+            # failures does not collapse the limit to the minimum
+            if now - self._last_decrease >= (self.baseline_latency or 1.0):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                logger.info("Upstream limit for '%s' lowered to %d", self.name, self.capacity)
+        elif self.in_flight >= self.capacity - 1:
+            # Only grow while the current limit is actually being used
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+        if not overloaded:
+            if self.baseline_latency is None:
+                self.baseline_latency = latency
+            else:
+                self.baseline_latency += 0.05 * (latency - self.baseline_latency)
+
+        ADMISSION_LIMIT.set(self.limit, controller=self.name)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, deadline=None, wait=True):
+        """Hold an upstream slot for the duration of the block and learn from its outcome"""
+        await self.acquire(deadline, wait)
+        started = time.monotonic()
+        try:
+            yield
+        except OVERLOAD_ERRORS:
+            self.record(time.monotonic() - started, overloaded=True)
+            raise
+        else:
+            # Other failures (e.g. a rejected request) and cancellations say
+            # nothing about upstream capacity, so only successes are recorded
+            self.record(time.monotonic() - started)
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "baseline_latency": round(self.baseline_latency, 3) if self.baseline_latency else None,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
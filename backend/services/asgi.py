@@ -0,0 +1,249 @@
+import os
+import gzip
+import json
+import time
+import logging
+from fastapi.responses import JSONResponse
+from services.metrics import REGISTRY, REQUEST_LATENCY, RATE_LIMIT_REJECTIONS
+from services.rate_limiter import rate_limit_headers
+from services.scheduler import client_key
+
+logger = logging.getLogger(__name__)
+
+# JSON responses use orjson when it is installed (pip install orjson); set
+# FAST_JSON=0 to force the standard library encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+FAST_JSON = orjson is not None and os.getenv("FAST_JSON", "1").lower() not in ("0", "false", "no")
+
+# Brotli is used for clients that accept it when the brotli package is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Complete (non-streamed) responses at least this large are compressed
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = 6
+STREAMING_CONTENT_TYPES = (b"text/event-stream", b"application/x-ndjson")
+BROTLI_QUALITY = 4
+COMPRESSED_ENCODINGS = ("br", "gzip")
+
+if FAST_JSON:
+    from fastapi.responses import ORJSONResponse as JSON_RESPONSE_CLASS
+else:
+    JSON_RESPONSE_CLASS = JSONResponse
+
+
+def dumps(content):
+    """Serialize content to JSON bytes the same way JSON_RESPONSE_CLASS does"""
+    if FAST_JSON:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+async def send_json(send, status, content, headers=None):
+    """Send a complete JSON response straight through the ASGI send channel"""
+    body = dumps(content)
+    raw_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode(), str(value).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def encoded_etag(etag, encoding):
+    """The strong ETag of a compressed variant, which must differ from the uncompressed one's"""
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def get_header(scope, name):
+    """First value of a request header (name in lower case, as bytes), or None"""
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def route_label(scope):
+    """Route template for metric labels, so path parameters don't explode cardinality"""
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+class TimingMiddleware:
+    """Adds X-Process-Time, records request latency and turns unhandled errors into 500s.
+
+    Paths in `skip_paths` (health checks, metrics scrapes) go straight
+    through without being timed.
+    """
+
+    def __init__(self, app, skip_paths=()):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        REGISTRY.ensure_flusher()
+        status = 500
+        started = False
+
+        async def send_with_timing(message):
+            nonlocal status, started
+            if message["type"] == "http.response.start":
+                status, started = message["status"], True
+                process_time = time.perf_counter() - start_time
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-process-time", str(process_time).encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception as e:
+            logger.exception(
+                "Error in request to %s after %.2f seconds", scope["path"], time.perf_counter() - start_time
+            )
+            if started:
+                raise
+            status = 500
+            await send_json(send, 500, {"detail": f"Internal server error: {str(e)}"})
+        finally:
+            process_time = time.perf_counter() - start_time
+            REQUEST_LATENCY.observe(process_time, route=route_label(scope), method=scope["method"], status=status)
+            logger.debug("Request to %s took %.2f seconds", scope["path"], process_time)
+
+
+class RateLimitMiddleware:
+    """Rejects clients over their limit with 429 and adds X-RateLimit-* headers otherwise"""
+
+    def __init__(self, app, limiter, exempt_paths=()):
+        self.app = app
+        self.limiter = limiter
+        self.exempt_paths = frozenset(exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        api_key = get_header(scope, b"x-api-key")
+        # The fair scheduler queues upstream calls per client (known API key, else IP)
+        client_key.set(f"key:{api_key}" if api_key in self.limiter.api_keys else client_ip)
+        result = await self.limiter.check(client_ip, scope["path"], api_key)
+        headers = rate_limit_headers(result)
+        if result.limited:
+            RATE_LIMIT_REJECTIONS.inc(route=scope["path"])
+            await send_json(send, 429, {"detail": "Rate limit exceeded. Please try again later."}, headers)
+            return
+
+        raw_headers = [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + raw_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+class CompressionMiddleware:
+    """Brotli/gzip compression for complete responses of at least `minimum_size` bytes.
+
+    Streamed responses (SSE, NDJSON) are passed through untouched so that
+    every event still reaches the client as soon as it is produced. Every
+    other response carries Vary: Accept-Encoding, compressed or not, so a
+    shared cache never hands one client's encoding to another.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    def _encoding(self, scope):
+        accepted = get_header(scope, b"accept-encoding") or ""
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    @staticmethod
+    def _vary(headers):
+        """headers with Accept-Encoding added to Vary (merged into an existing Vary header)"""
+        for index, (key, value) in enumerate(headers):
+            if key == b"vary":
+                if b"accept-encoding" in value.lower() or value.strip() == b"*":
+                    return headers
+                return headers[:index] + [(key, value + b", Accept-Encoding")] + headers[index + 1:]
+        return headers + [(b"vary", b"Accept-Encoding")]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self._encoding(scope)
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                content_type = next((value for key, value in headers if key == b"content-type"), b"")
+                if content_type.startswith(STREAMING_CONTENT_TYPES):
+                    passthrough = True
+                    await send(message)
+                    return
+                message["headers"] = self._vary(headers)
+                if encoding is None:
+                    passthrough = True
+                    await send(message)
+                    return
+                # Held back until the first body chunk shows whether the body is complete
+                start = message
+                return
+
+            body = message.get("body", b"")
+            headers = start["headers"]
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or any(key == b"content-encoding" for key, _ in headers)
+            ):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            if encoding == "br":
+                body = brotli.compress(body, quality=BROTLI_QUALITY)
+            else:
+                body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+            # A strong ETag names the uncompressed body; the compressed one gets its own
+            start["headers"] = [
+                (key, encoded_etag(value.decode("latin-1"), encoding).encode())
+                if key == b"etag" and value.startswith(b'"') else (key, value)
+                for key, value in headers if key != b"content-length"
+            ] + [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(body)).encode()),
+            ]
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
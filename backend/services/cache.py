@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Default budgets, overridable per deployment
+CACHE_TTL = 3600  # Cache time-to-live in seconds (1 hour)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 2000))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 16 * 1024 * 1024))  # 16 MB per cache
+CACHE_SWEEP_INTERVAL = int(os.getenv("CACHE_SWEEP_INTERVAL", 60))  # Seconds between expiry sweeps
+
+
+def estimate_size(value):
+    """Approximate the memory footprint of a cached value in bytes"""
+    if isinstance(value, str):
+        return len(value.encode())
+    return len(json.dumps(value, separators=(",", ":")).encode())
+
+
+class TTLCache:
+    """In-memory LRU cache with a per-entry TTL and entry-count/byte budgets.
+
+    Entries are kept in least-recently-used order so that going over either
+    budget evicts the coldest entries first; a budget of None is unlimited. Expired entries are dropped on
+    lookup and by a periodic background sweep, so keys that are never asked
+    for again do not linger.
+    """
+
+    def __init__(
+        self,
+        name,
+        ttl=CACHE_TTL,
+        max_entries=CACHE_MAX_ENTRIES,
+        max_bytes=CACHE_MAX_BYTES,
+        sweep_interval=CACHE_SWEEP_INTERVAL,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._sweeper = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[2] > time.time()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, size, expires_at = entry
+        if expires_at <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting least-recently-used entries if needed"""
+        size = estimate_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # A single value larger than the whole budget is not worth caching
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        self._entries[key] = (value, size, expires_at)
+        self._bytes += size
+
+        while self._over_budget():
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+        self._ensure_sweeper()
+
+    def delete(self, key):
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def sweep(self):
+        """Drop every expired entry and return how many were removed"""
+        now = time.time()
+        expired = [key for key, entry in self._entries.items() if entry[2] <= now]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _over_budget(self):
+        return (self.max_entries is not None and len(self._entries) > self.max_entries) or (
+            self.max_bytes is not None and self._bytes > self.max_bytes
+        )
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _ensure_sweeper(self):
+        # Start the sweep task lazily so it runs inside the worker's own event
+        # loop (Gunicorn forks workers after the app has been imported)
+        if self._sweeper is not None and not self._sweeper.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._sweeper = loop.create_task(self._sweep_periodically())
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug("Cache '%s' swept %d expired entries", self.name, removed)
@@ -0,0 +1,373 @@
+import os
+import json
+import math
+import time
+import zlib
+import sqlite3
+import asyncio
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from services.cache import (
+    TTLCache,
+    CACHE_TTL,
+    CACHE_MAX_ENTRIES,
+    CACHE_MAX_BYTES,
+    CACHE_SWEEP_INTERVAL,
+)
+from services.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Which backend the refine/explain caches use: "memory" (per worker),
+# "sqlite" (one file shared by every worker on the node) or "redis"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_SQLITE_PATH = os.getenv(
+    "CACHE_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "prompt_tools_cache.sqlite3")
+)
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_KEY_PREFIX = "prompt-tools"
+
+# Values larger than this are zlib-compressed before being stored
+COMPRESS_THRESHOLD = 1024
+_RAW = b"j"
+_COMPRESSED = b"z"
+
+
+def encode_value(value):
+    """Serialize a cached value to compact bytes"""
+    payload = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+    if len(payload) > COMPRESS_THRESHOLD:
+        return _COMPRESSED + zlib.compress(payload, 6)
+    return _RAW + payload
+
+
+def decode_value(data):
+    """Inverse of encode_value"""
+    if isinstance(data, str):
+        data = data.encode()
+    flag, payload = data[:1], data[1:]
+    if flag == _COMPRESSED:
+        payload = zlib.decompress(payload)
+    return json.loads(payload)
+
+
+class CacheBackend:
+    """Async interface shared by all response cache backends"""
+
+    name = "base"
+
+    async def get(self, key):
+        raise NotImplementedError
+
+    async def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Per-process cache backed by TTLCache"""
+
+    def __init__(self, namespace, ttl=CACHE_TTL, **kwargs):
+        self.name = namespace
+        self.cache = TTLCache(namespace, ttl=ttl, **kwargs)
+
+    async def get(self, key):
+        value = self.cache.get(key)
+        CACHE_REQUESTS.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    async def set(self, key, value, ttl=None):
+        self.cache.set(key, value, ttl=ttl)
+
+    async def delete(self, key):
+        self.cache.delete(key)
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats["backend"] = "memory"
+        return stats
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Cache stored in a local SQLite file so every worker on a node shares it.
+
+    The database runs in WAL mode so readers in one worker never block
+    writers in another. A max_entries or max_bytes of None is unlimited. All statements run on a single background thread
+    per worker so the event loop never waits on file locks.
+    """
+
+    def __init__(
+        self,
+        namespace,
+        ttl=CACHE_TTL,
+        path=CACHE_SQLITE_PATH,
+        max_entries=CACHE_MAX_ENTRIES,
+        max_bytes=CACHE_MAX_BYTES,
+        sweep_interval=CACHE_SWEEP_INTERVAL,
+    ):
+        self.name = namespace
+        self.ttl = ttl
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._sweeper = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _connection(self):
+        # Connections must not be shared across fork(), so reopen per process
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value BLOB NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    async def _run(self, fn, *args):
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"cache-{self.name}")
+            self._executor_pid = os.getpid()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _get_sync(self, key):
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.name, key),
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.name, key))
+                conn.commit()
+                self.expirations += 1
+                return None
+            # Only refresh the LRU timestamp occasionally to keep reads cheap
+            conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ? AND accessed_at < ?",
+                (now, self.name, key, now - 60),
+            )
+            conn.commit()
+            return value
+
+    def _set_sync(self, key, data, ttl):
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.name, key, data, now + ttl, now),
+            )
+            conn.commit()
+
+    def _delete_sync(self, key):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.name, key))
+            conn.commit()
+
+    def sweep(self):
+        """Remove expired entries, then trim the namespace to its budgets"""
+        with self._lock:
+            conn = self._connection()
+            expired = conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at <= ?",
+                (self.name, time.time()),
+            ).rowcount
+            self.expirations += expired
+            if self.max_entries is None and self.max_bytes is None:
+                conn.commit()
+                return expired
+
+            # Keep the most recently used entries that fit in both budgets
+            rows = conn.execute(
+                "SELECT key, length(value) FROM cache WHERE namespace = ? ORDER BY accessed_at DESC",
+                (self.name,),
+            ).fetchall()
+            total = 0
+            stale = []
+            for index, (key, size) in enumerate(rows):
+                total += size
+                if (self.max_entries is not None and index >= self.max_entries) or (
+                    self.max_bytes is not None and total > self.max_bytes
+                ):
+                    stale.append((self.name, key))
+            if stale:
+                conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", stale)
+                self.evictions += len(stale)
+            conn.commit()
+            return expired
+
+    async def get(self, key):
+        data = await self._run(self._get_sync, key)
+        if data is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache=self.name, result="miss")
+            return None
+        self.hits += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="hit")
+        return decode_value(data)
+
+    async def set(self, key, value, ttl=None):
+        data = encode_value(value)
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            return
+        await self._run(self._set_sync, key, data, ttl if ttl is not None else self.ttl)
+        self._ensure_sweeper()
+
+    async def delete(self, key):
+        await self._run(self._delete_sync, key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "backend": "sqlite",
+            "path": self.path,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None and not self._sweeper.done():
+            return
+        self._sweeper = asyncio.get_running_loop().create_task(self._sweep_periodically())
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                removed = await self._run(self.sweep)
+                if removed:
+                    logger.debug("Cache '%s' swept %d expired entries", self.name, removed)
+            except Exception:
+                logger.exception("Cache '%s' sweep failed", self.name)
+
+
+class RedisCacheBackend(CacheBackend):
+    """Cache stored in Redis (or anything speaking its protocol).
+
+    `client` may be any object exposing async get/set/delete with the
+    redis-py signatures, which lets tests substitute a local stand-in for a
+    real server. Expiry and LRU eviction are delegated to the server
+    (configure it with a maxmemory policy such as allkeys-lru).
+    """
+
+    def __init__(self, namespace, ttl=CACHE_TTL, url=CACHE_REDIS_URL, client=None):
+        self.name = namespace
+        self.ttl = ttl
+        self.url = url
+        self._client = client
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _redis(self):
+        if self._client is None:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError:
+                raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package (pip install redis)")
+            self._client = aioredis.from_url(self.url)
+        return self._client
+
+    def _key(self, key):
+        return f"{CACHE_KEY_PREFIX}:{self.name}:{key}"
+
+    async def get(self, key):
+        try:
+            data = await self._redis().get(self._key(key))
+        except Exception as e:
+            # Treat an unreachable cache as a miss rather than failing the request
+            self.errors += 1
+            logger.warning("Redis cache get failed: %s", e)
+            data = None
+        if data is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache=self.name, result="miss")
+            return None
+        self.hits += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="hit")
+        return decode_value(data)
+
+    async def set(self, key, value, ttl=None):
+        try:
+            # Redis rejects an expiry of 0, so round sub-second TTLs up rather than down
+            ttl = ttl if ttl is not None else self.ttl
+            await self._redis().set(self._key(key), encode_value(value), ex=max(1, math.ceil(ttl)))
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Redis cache set failed: %s", e)
+
+    async def delete(self, key):
+        try:
+            await self._redis().delete(self._key(key))
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Redis cache delete failed: %s", e)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+        }
+
+
+def create_cache(namespace, ttl=CACHE_TTL, backend=None, **budgets):
+    """Create the response cache for a namespace using the configured backend.
+
+    budgets (max_entries, max_bytes) override the CACHE_MAX_* defaults of the
+    memory and sqlite backends; Redis is bounded by its own maxmemory policy.
+    """
+    backend = (backend or CACHE_BACKEND).lower()
+    if backend == "sqlite":
+        return SQLiteCacheBackend(namespace, ttl=ttl, **budgets)
+    if backend == "redis":
+        return RedisCacheBackend(namespace, ttl=ttl)
+    if backend != "memory":
+        logger.warning("Unknown CACHE_BACKEND '%s', falling back to memory", backend)
+    return MemoryCacheBackend(namespace, ttl=ttl, **budgets)
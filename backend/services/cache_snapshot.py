@@ -0,0 +1,190 @@
+import os
+import mmap
+import time
+import zlib
+import struct
+import logging
+import tempfile
+from services.cache_backends import CACHE_BACKEND, encode_value, decode_value
+
+logger = logging.getLogger(__name__)
+
+# Cached responses are also appended to a snapshot file so that a restarted
+# worker or a new deploy starts warm. Redis keeps its data across restarts,
+# so the snapshot is skipped there unless CACHE_SNAPSHOT=1 is set explicitly
+CACHE_SNAPSHOT = os.getenv("CACHE_SNAPSHOT", "0" if CACHE_BACKEND == "redis" else "1").lower() not in ("0", "false", "no")
+CACHE_SNAPSHOT_PATH = os.getenv(
+    "CACHE_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "prompt_tools_cache.snapshot")
+)
+# Compaction keeps the newest records that fit in this many bytes
+CACHE_SNAPSHOT_MAX_BYTES = int(os.getenv("CACHE_SNAPSHOT_MAX_BYTES", 32 * 1024 * 1024))
+
+MAGIC = b"PTSNAP1\n"
+# Per record: crc32 of everything after it, namespace length, key length,
+# stored_at, value length; then the namespace, key and encode_value() bytes
+_HEADER = struct.Struct(">IBBdI")
+
+
+def pack_record(namespace, key, stored_at, value):
+    namespace, key = namespace.encode(), key.encode()
+    data = encode_value(value)
+    body = _HEADER.pack(0, len(namespace), len(key), stored_at, len(data))[4:] + namespace + key + data
+    return struct.pack(">I", zlib.crc32(body)) + body
+
+
+class CacheSnapshot:
+    """Append-only file of cached responses, read back through mmap.
+
+    Every cache write appends one self-checking record; workers append with
+    O_APPEND in a single write, so they can share the file. Reading only
+    scans record headers to build a (namespace, key) -> offset index, and
+    a value is decoded the first time it is asked for. Records after a torn
+    or corrupt one are ignored. `compact()` rewrites the file with the
+    newest record per key and should run before workers start.
+    """
+
+    def __init__(self, path=CACHE_SNAPSHOT_PATH, max_bytes=CACHE_SNAPSHOT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self._index = None  # (namespace, key) -> (offset, length, stored_at)
+        self._map = None
+        self._pid = None
+
+        self.loaded = 0
+        self.load_seconds = 0.0
+        self.hits = 0
+        self.appended = 0
+        self.errors = 0
+
+    def _scan(self, view):
+        """Yield (namespace, key, stored_at, value offset, value length) for each valid record"""
+        if view[:len(MAGIC)] != MAGIC:
+            return
+        offset, end = len(MAGIC), len(view)
+        while offset + _HEADER.size <= end:
+            crc, ns_len, key_len, stored_at, value_len = _HEADER.unpack_from(view, offset)
+            record_end = offset + _HEADER.size + ns_len + key_len + value_len
+            if record_end > end or zlib.crc32(view[offset + 4:record_end]) != crc:
+                logger.warning("Cache snapshot '%s' has a damaged record at byte %d", self.path, offset)
+                return
+            start = offset + _HEADER.size
+            namespace = bytes(view[start:start + ns_len]).decode()
+            key = bytes(view[start + ns_len:start + ns_len + key_len]).decode()
+            yield namespace, key, stored_at, start + ns_len + key_len, value_len
+            offset = record_end
+
+    def _load(self):
+        # Load once per process; mappings are not reused across fork()
+        if self._index is not None and self._pid == os.getpid():
+            return
+        started = time.perf_counter()
+        self._index, self._map, self._pid = {}, None, os.getpid()
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size > len(MAGIC):
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            logger.warning("Could not open cache snapshot '%s': %s", self.path, e)
+            return
+        if self._map is None:
+            return
+        for namespace, key, stored_at, offset, length in self._scan(memoryview(self._map)):
+            self._index[(namespace, key)] = (offset, length, stored_at)
+        self.loaded = len(self._index)
+        self.load_seconds = time.perf_counter() - started
+        logger.info(
+            "Indexed %d cached responses from '%s' in %.3fs", self.loaded, self.path, self.load_seconds
+        )
+
+    def get(self, namespace, key):
+        """Return (stored_at, value) from the snapshot, or None"""
+        self._load()
+        found = self._index.get((namespace, key))
+        if found is None:
+            return None
+        offset, length, stored_at = found
+        try:
+            value = decode_value(self._map[offset:offset + length])
+        except Exception:
+            self.errors += 1
+            return None
+        self.hits += 1
+        return stored_at, value
+
+    def append(self, namespace, key, stored_at, value):
+        record = pack_record(namespace, key, stored_at, value)
+        try:
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                os.write(fd, MAGIC)
+                os.close(fd)
+            except FileExistsError:
+                pass
+            # Reopened per write so a compaction that replaces the file is picked up
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.write(fd, record)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            self.errors += 1
+            logger.warning("Could not append to cache snapshot '%s': %s", self.path, e)
+            return
+        self.appended += 1
+
+    def compact(self, max_age=None):
+        """Rewrite the snapshot keeping the newest record per key; returns (records, bytes)"""
+        self._index = None
+        self._load()
+        now = time.time()
+        newest = sorted(self._index.items(), key=lambda item: item[1][2], reverse=True)
+        kept, size = [], len(MAGIC)
+        for (namespace, key), (offset, length, stored_at) in newest:
+            if max_age is not None and stored_at < now - max_age:
+                continue
+            record_size = _HEADER.size + len(namespace.encode()) + len(key.encode()) + length
+            if size + record_size > self.max_bytes:
+                break
+            kept.append((namespace, key, offset, length, stored_at))
+            size += record_size
+
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(MAGIC)
+            # Oldest first, so the newest record wins when read back
+            for namespace, key, offset, length, stored_at in reversed(kept):
+                namespace_bytes, key_bytes = namespace.encode(), key.encode()
+                body = (
+                    _HEADER.pack(0, len(namespace_bytes), len(key_bytes), stored_at, length)[4:]
+                    + namespace_bytes + key_bytes + self._map[offset:offset + length]
+                )
+                f.write(struct.pack(">I", zlib.crc32(body)) + body)
+        os.replace(temp_path, self.path)
+        if self._map is not None:
+            self._map.close()
+        self._index = None
+        logger.info("Compacted cache snapshot '%s' to %d records (%d bytes)", self.path, len(kept), size)
+        return len(kept), size
+
+    def stats(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {
+            "path": self.path,
+            "bytes": size,
+            "indexed": len(self._index) if self._index is not None else None,
+            "load_seconds": round(self.load_seconds, 4),
+            "hits": self.hits,
+            "appended": self.appended,
+            "errors": self.errors,
+        }
+
+
+# Shared by the refine and explain caches of this worker
+cache_snapshot = CacheSnapshot() if CACHE_SNAPSHOT else None
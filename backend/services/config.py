@@ -0,0 +1,17 @@
+from dotenv import load_dotenv
+
+_loaded = False
+
+
+def load_config():
+    """Load the nearest .env into the environment, once per process.
+
+    Runs when the services package is first imported, so every module
+    reading settings with os.getenv at import time sees the .env values.
+    Variables already set in the environment take precedence.
+    """
+    global _loaded
+    if _loaded:
+        return
+    load_dotenv()
+    _loaded = True
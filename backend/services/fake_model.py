@@ -0,0 +1,237 @@
+import os
+import json
+import math
+import random
+import asyncio
+from services.micro_batch import unpack_prompt
+
+# Offline stand-in for the Gemini model, enabled with GEMINI_FAKE=1. It
+# needs no API key or network and lets benchmarks measure this service
+# without Google's latency mixed in.
+FAKE_LATENCY_MEDIAN = float(os.getenv("FAKE_LATENCY_MEDIAN", 0.8))  # seconds
+FAKE_LATENCY_P99 = float(os.getenv("FAKE_LATENCY_P99", 4.0))  # seconds
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", 0.0))  # fraction of calls that fail
+FAKE_TIMEOUT_RATE = float(os.getenv("FAKE_TIMEOUT_RATE", 0.0))  # fraction of calls that hang
+FAKE_HANG_SECONDS = float(os.getenv("FAKE_HANG_SECONDS", 300))
+FAKE_SEED = os.getenv("FAKE_SEED")
+
+# Start of the explanation request appended to a refine prompt
+_FUSED_MARKER = "Then, as a prompt engineering expert, explain"
+
+# z-score of the 99th percentile of a standard normal distribution
+_Z99 = 2.326
+
+
+class FakeUsage:
+    """Mimics a Gemini response's usage_metadata, counting about 4 characters per token"""
+
+    def __init__(self, prompt, text):
+        self.prompt_token_count = max(1, len(prompt) // 4)
+        self.candidates_token_count = max(1, len(text) // 4)
+
+
+class FakeResponse:
+    """Mimics the .text (and usage_metadata) of a Gemini response or stream chunk"""
+
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeStreamResponse:
+    """Async iterable of FakeResponse chunks, like a streamed Gemini response"""
+
+    def __init__(self, text, delay, chunk_size=24):
+        self._text = text
+        self._delay = delay
+        self._chunk_size = chunk_size
+
+    async def __aiter__(self):
+        chunks = [self._text[i:i + self._chunk_size] for i in range(0, len(self._text), self._chunk_size)]
+        per_chunk = self._delay / max(1, len(chunks))
+        for chunk in chunks:
+            await asyncio.sleep(per_chunk)
+            yield FakeResponse(chunk)
+
+
+class FakeGenerativeModel:
+    """Drop-in replacement for genai.GenerativeModel that never leaves the process.
+
+    Latency follows a log-normal distribution described by its median and
+    99th percentile. A configurable fraction of calls fail with a 503-style
+    error or hang until the caller's timeout fires. Output text follows the
+    shape each PROMPT_TEMPLATES mode asks for, so the normal parsing paths
+    are exercised.
+    """
+
+    def __init__(
+        self,
+        latency_median=FAKE_LATENCY_MEDIAN,
+        latency_p99=FAKE_LATENCY_P99,
+        error_rate=FAKE_ERROR_RATE,
+        timeout_rate=FAKE_TIMEOUT_RATE,
+        hang_seconds=FAKE_HANG_SECONDS,
+        seed=FAKE_SEED,
+    ):
+        self.latency_median = latency_median
+        self.latency_p99 = max(latency_p99, latency_median)
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.random = random.Random(seed)
+
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.in_flight = 0
+
+    def sample_latency(self):
+        if self.latency_median <= 0:
+            return 0.0
+        sigma = math.log(self.latency_p99 / self.latency_median) / _Z99
+        return self.latency_median * math.exp(sigma * self.random.gauss(0, 1))
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        prompt = contents if isinstance(contents, str) else str(contents)
+        self.calls += 1
+        self.in_flight += 1
+        try:
+            roll = self.random.random()
+            if roll < self.timeout_rate:
+                self.timeouts += 1
+                await asyncio.sleep(self.hang_seconds)
+            latency = self.sample_latency()
+            text = fake_completion(prompt, self.random)
+            # Honour the output cap, at about 4 characters per token
+            max_tokens = (kwargs.get("generation_config") or {}).get("max_output_tokens")
+            if max_tokens:
+                text = text[:max_tokens * 4]
+            if stream:
+                # Time to first token is a fraction of the total; the rest is spread over chunks
+                await asyncio.sleep(latency * 0.2)
+                self._maybe_fail(roll)
+                return FakeStreamResponse(text, latency * 0.8)
+            await asyncio.sleep(latency)
+            self._maybe_fail(roll)
+            return FakeResponse(text, FakeUsage(prompt, text))
+        finally:
+            self.in_flight -= 1
+
+    def _maybe_fail(self, roll):
+        if self.timeout_rate <= roll < self.timeout_rate + self.error_rate:
+            self.errors += 1
+            from google.api_core import exceptions
+            raise exceptions.ServiceUnavailable("Fake upstream error")
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "in_flight": self.in_flight,
+        }
+
+
+def _user_input(prompt):
+    marker = "User input:"
+    if marker in prompt:
+        return prompt.rsplit(marker, 1)[1].strip()
+    marker = "Prompt:\n"
+    if marker in prompt:
+        return prompt.rsplit(marker, 1)[1].strip()
+    return prompt.strip()[-200:]
+
+
+def fake_completion(prompt, rng=random):
+    """Produce realistic text for the mode the prompt was built for"""
+    packed = unpack_prompt(prompt)
+    if packed is not None:
+        # A micro-batched prompt: one answer per input, as a JSON array
+        instructions, items = packed
+        return json.dumps([fake_completion(f"{instructions}\n\nUser input: {item}", rng) for item in items])
+
+    if _FUSED_MARKER in prompt:
+        # A fused refine-and-explain prompt (routers/refine_explain.py): the
+        # refinement plus an explanation of each prompt in it, as a JSON object
+        task = prompt.split(_FUSED_MARKER, 1)[0].strip()
+        response = fake_completion(task, rng)
+        explain = "You are a prompt engineering expert.\n\nPrompt:\n{}"
+        if "Variant 1:" in response:
+            prompts = response.split("Variant ")[1:]
+        elif "one-line prompts" in task:
+            prompts = response.splitlines()
+        else:
+            prompts = [response]
+        explanations = [fake_completion(explain.format(p.strip()), rng) for p in prompts]
+        return json.dumps({"response": response, "explanations": explanations})
+
+    subject = _user_input(prompt)
+    short = subject[:120]
+
+    if "You are a prompt engineering expert" in prompt:
+        return (
+            "## Effectiveness\n"
+            f"The prompt \"{short}\" states the task directly, which helps the model focus, "
+            "but it gives little context about the audience or the desired length.\n\n"
+            "## Assumptions\n"
+            "- The model knows who the recipient is and why they are being contacted.\n"
+            "- A default tone and format are acceptable.\n\n"
+            "## Improvements\n"
+            "- State the audience, purpose and desired tone explicitly.\n"
+            "- Specify the output format and a length limit.\n"
+            "- Add one example of a good answer if the style matters."
+        )
+
+    if "JSON object" in prompt:
+        return (
+            '{"intent": "' + short.replace('"', "'") + '", '
+            '"structure": ["context", "task", "format"], '
+            '"constraints": ["be concise", "professional tone"], '
+            '"final_prompt": "Write ' + short.replace('"', "'") + ' for a professional audience."}'
+        )
+
+    if "single, ready-to-use prompt" in prompt:
+        return f"Write {short} that is clear, concise and suited to a professional audience, in under 150 words."
+
+    if "one-line prompts" in prompt:
+        count = rng.choice([2, 3])
+        lines = [
+            f"- Write {short} in a clear, professional tone.",
+            f"- Draft {short} that highlights the key points in three sentences.",
+            f"- Create {short} with a strong opening line and a clear call to action.",
+        ]
+        return "\n".join(lines[:count])
+
+    if "few-shot" in prompt:
+        return (
+            f"**Prompt:** Write {short}, following the style of the examples below.\n\n"
+            "**Example 1**\n"
+            "* **Input:** Weekly status for the design team\n"
+            "* **Output:** Hi team - this week we finished the onboarding flow and started usability tests.\n\n"
+            "**Example 2**\n"
+            "* **Input:** Reminder about the quarterly review\n"
+            "* **Output:** Hello all - a quick reminder that the quarterly review is on Friday at 10am.\n\n"
+            "Now complete the task for the new input."
+        )
+
+    if "chain-of-thought" in prompt:
+        return (
+            f"You are an expert assistant. Task: {short}.\n\n"
+            "Before answering, explain your reasoning step by step:\n"
+            "1. Restate the goal and the audience.\n"
+            "2. List the information you need and any assumptions.\n"
+            "3. Work through each part of the task in order.\n\n"
+            "Finally, give the answer on its own line prefixed with **Answer:**."
+        )
+
+    # deep (default template)
+    count = rng.choice([2, 3])
+    variants = []
+    for number in range(1, count + 1):
+        variants.append(
+            f"Variant {number}: Write {short} (version {number})\n"
+            f"- Task intent: produce {short} tailored to the reader.\n"
+            "- Format: a short greeting, three dash bullets with the key points, and a closing line.\n"
+            f"- Constraints: under {100 + 50 * number} words, no jargon."
+        )
+    return "Here are refined prompt variants:\n\n" + "\n\n".join(variants)
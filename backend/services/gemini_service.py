@@ -1,49 +1,129 @@
 import os
-from dotenv import load_dotenv
-import google.generativeai as genai
-import re
-import json
 import asyncio
 import time
-import traceback
+import logging
 import hashlib
 from functools import lru_cache
+from services.cache_backends import create_cache
+from services.admission import Overloaded
+from services.providers import GeminiProvider, ProviderRouter, should_fail_over
+from services import openai_service
+from services.semantic_cache import SemanticCache
+from services.stale_cache import StaleCache, FRESH
+from services.cache_snapshot import cache_snapshot
+from services.singleflight import SingleFlight
+from services.micro_batch import micro_batcher, MICRO_BATCH
+from services.scheduler import scheduler, parse_mapping
+from services.tokens import estimate_tokens, upstream_usage
+from services.streaming import VariantStreamParser
+from services.parsing import clean_markdown_text, parse_response
+from services.traffic import note_cache
+from services.results import note_stored, result_link
+from services.metrics import STAGE_LATENCY, MODEL_TOKENS
+
+logger = logging.getLogger(__name__)
 
-load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    print("WARNING: GEMINI_API_KEY environment variable not set!")
-else:
-    genai.configure(api_key=API_KEY)
-
-# Create global model instance for reuse with optimized parameters
-if API_KEY:
-    generation_config = {
-        "temperature": 0.7,       # Lower temperature for more deterministic outputs
-        "top_p": 0.95,            # Slightly more deterministic token selection
-        "top_k": 40,              # More focused token selection
-        "max_output_tokens": 1024, # Reasonable limit for outputs
-    }
-    
-    GEMINI_MODEL = genai.GenerativeModel(
-        "models/gemini-2.0-flash",
-        generation_config=generation_config
-    )
+
+# Serve responses from an offline stand-in instead of Gemini (benchmarks, CI, air-gapped boxes)
+USE_FAKE_MODEL = os.getenv("GEMINI_FAKE", "").lower() in ("1", "true", "yes")
+
+if not API_KEY and not USE_FAKE_MODEL and not openai_service.OPENAI_API_KEY:
+    logger.warning("Neither GEMINI_API_KEY nor OPENAI_API_KEY environment variable is set!")
+
+GEMINI_MODEL_NAME = "models/gemini-2.0-flash"
+generation_config = {
+    "temperature": 0.7,       # Lower temperature for more deterministic outputs
+    "top_p": 0.95,            # Slightly more deterministic token selection
+    "top_k": 40,              # More focused token selection
+    "max_output_tokens": 1024, # Reasonable limit for outputs
+}
+
+# Generation settings of each mode, applied per call over generation_config
+# (and mapped to the OpenAI names): one-line modes get small output caps, so
+# a runaway answer can't cost as much as a few-shot one. MODE_MAX_OUTPUT_TOKENS
+# and MODE_TEMPERATURE ("mode=value,...") override them
+GENERATION_PROFILES = {
+    "basic": {"max_output_tokens": 384, "temperature": 0.5},
+    "quick": {"max_output_tokens": 512},
+    "deep": {"max_output_tokens": 1024},
+    "few-shot": {"max_output_tokens": 1536},
+    "cot": {"max_output_tokens": 1024},
+    "explain": {"max_output_tokens": 1024, "temperature": 0.4},
+}
+for mode, value in parse_mapping(os.getenv("MODE_MAX_OUTPUT_TOKENS", ""), int).items():
+    GENERATION_PROFILES.setdefault(mode, {})["max_output_tokens"] = value
+for mode, value in parse_mapping(os.getenv("MODE_TEMPERATURE", ""), float).items():
+    GENERATION_PROFILES.setdefault(mode, {})["temperature"] = value
+
+def generation_profile(mode, overrides=None):
+    """Per-call generation settings for a mode, with any overrides on top"""
+    profile = dict(GENERATION_PROFILES.get(mode, ()))
+    if overrides:
+        profile.update(overrides)
+    return profile or None
+
+# The offline stand-in is created here; the real GenerativeModel is created by
+# its provider off the event loop at startup, so the SDK (about a second to
+# import) stays out of the app's import time
+if USE_FAKE_MODEL:
+    from services.fake_model import FakeGenerativeModel
+    logger.warning("Using offline fake Gemini model (GEMINI_FAKE=1)")
+    GEMINI_MODEL = FakeGenerativeModel()
 else:
     GEMINI_MODEL = None
 
-# Maximum time to wait for Gemini API response in seconds
+# Providers to route between, in order of preference until live latency and
+# error rates say otherwise; each is used only if it is configured
+LLM_PROVIDERS = [name.strip() for name in os.getenv("LLM_PROVIDERS", "gemini,openai").split(",") if name.strip()]
+
+def create_providers():
+    providers = []
+    for name in LLM_PROVIDERS:
+        if name == "gemini" and USE_FAKE_MODEL:
+            providers.append(GeminiProvider(GEMINI_MODEL, name="fake"))
+        elif name == "gemini" and API_KEY:
+            providers.append(GeminiProvider(
+                api_key=API_KEY, model_name=GEMINI_MODEL_NAME, generation_config=generation_config
+            ))
+        elif name == "openai" and openai_service.OPENAI_API_KEY and not USE_FAKE_MODEL and openai_service.sdk_available():
+            providers.append(openai_service.OpenAIProvider())
+    return providers
+
+# Admission control, retries/hedging/circuit breaking and routing for every model call
+model_router = ProviderRouter(create_providers())
+
+NOT_CONFIGURED_MESSAGE = "Error: no model provider configured. Please set GEMINI_API_KEY or OPENAI_API_KEY in your environment variables."
+
+# Maximum time to wait for a model response in seconds
 MAX_API_TIMEOUT = 60  # Increased from 30 to 60 seconds
 
-# Simple in-memory cache for API responses
-response_cache = {}
+# Upstream calls a single batch may have in flight at once
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 16))
+
+# In-flight refine calls, keyed like the cache, so concurrent duplicates share one upstream call
+refine_flight = SingleFlight("refine")
+
+# Bounded response cache (backend chosen by CACHE_BACKEND, shared across workers unless "memory").
+# Entries older than CACHE_TTL are served stale while they are refreshed in the background
 CACHE_TTL = 3600  # Cache time-to-live in seconds (1 hour)
+response_cache = StaleCache(
+    create_cache("refine", ttl=CACHE_TTL), refine_flight, ttl=CACHE_TTL, snapshot=cache_snapshot
+)
+
+# Near-duplicate inputs (case, spacing, punctuation, small edits) reuse cached answers
+semantic_cache = SemanticCache(response_cache, ttl=response_cache.hard_ttl)
 
 def get_cache_key(prompt, mode):
     """Generate a cache key from the prompt and mode"""
     key_string = f"{prompt}:{mode}"
     return hashlib.md5(key_string.encode()).hexdigest()
 
+def get_partition(mode, tone, persona, return_format):
+    """Near-duplicate matches are only served between requests with the same options"""
+    return (mode, tone or "default", persona or "", return_format)
+
 PROMPT_TEMPLATES = {
     "basic": (
         "Rewrite this input as a single, ready-to-use prompt for an AI assistant. "
@@ -69,7 +149,8 @@ PROMPT_TEMPLATES = {
     ),
 }
 
-def build_prompt(mode, tone, persona, return_format, raw_input):
+def build_instructions(mode, tone, persona, return_format):
+    """The part of a refine prompt that is the same for every input with these options"""
     base_prompt = PROMPT_TEMPLATES.get(mode, PROMPT_TEMPLATES["deep"])
     tone_part = f" Use a {tone} tone." if tone and tone != "default" else ""
     persona_part = f" Write the prompts {persona}." if persona and persona != "none" else ""
@@ -78,27 +159,155 @@ def build_prompt(mode, tone, persona, return_format, raw_input):
         format_part = " Format the output in markdown."
     elif return_format == "json":
         format_part = " Format the output as a JSON object with keys for each component (e.g., intent, structure, constraints, final_prompt, examples, rationale, etc.)."
-    prompt = base_prompt.format(tone_part=tone_part, persona_part=persona_part, format_part=format_part)
-    return f"{prompt}\n\nUser input: {raw_input}"
+    return base_prompt.format(tone_part=tone_part, persona_part=persona_part, format_part=format_part)
 
-def clean_markdown_text(text):
-    # Replace asterisk bullet points with dashes
-    text = re.sub(r'^\s*\*\s+', '- ', text, flags=re.MULTILINE)
-    
-    # Clean up variant headers (remove asterisks from variant labels)
-    text = re.sub(r'\*\*Variant (\d+):\*\*', 'Variant \\1:', text)
-    
-    # Ensure consistent spacing after variant label
-    text = re.sub(r'(Variant \d+:)(\S)', '\\1 \\2', text)
-    
-    # Remove any remaining standalone asterisks
-    text = re.sub(r'(?<!\*)\*(?!\*)', '', text)
-    
-    # Remove double asterisks (bold markdown)
-    text = re.sub(r'\*\*(.*?)\*\*', '\\1', text)
-    
+def build_prompt(mode, tone, persona, return_format, raw_input):
+    return f"{build_instructions(mode, tone, persona, return_format)}\n\nUser input: {raw_input}"
+
+BUSY_MESSAGE = "Sorry, the service is busy right now. Please try again in a few seconds."
+
+def record_tokens(mode, input_tokens, output_tokens, usage=None):
+    """Estimated (and, when the provider reported them, actual) tokens of one upstream call"""
+    MODEL_TOKENS.observe(input_tokens, mode=mode, direction="input", source="estimated")
+    MODEL_TOKENS.observe(output_tokens, mode=mode, direction="output", source="estimated")
+    if usage:
+        MODEL_TOKENS.observe(usage["input"], mode=mode, direction="input", source="actual")
+        MODEL_TOKENS.observe(usage["output"], mode=mode, direction="output", source="actual")
+
+async def call_model(prompt, route="/refine", mode="-", generation=None):
+    """Send a prompt to the best available provider and return the response text.
+
+    The mode's generation profile applies, with `generation` on top.
+    Waiting for quota in the fair scheduler, retries, hedged requests,
+    failover, waiting for an upstream slot and the calls themselves share
+    one MAX_API_TIMEOUT budget. Raises Overloaded if the call was shed or
+    every provider has its circuit open.
+    """
+    deadline = time.monotonic() + MAX_API_TIMEOUT
+    generation = generation_profile(mode, generation)
+    input_tokens = estimate_tokens(prompt)
+    usage = {}
+    upstream_usage.set(usage)
+    if not scheduler.enabled:
+        text = await model_router.complete(prompt, deadline, route=route, mode=mode, generation=generation)
+        record_tokens(mode, input_tokens, estimate_tokens(text), usage)
+        return text
+
+    output_tokens = (generation or {}).get("max_output_tokens")
+    async with scheduler.slot(input_tokens, deadline, mode, output_tokens) as reservation:
+        text = await model_router.complete(prompt, deadline, route=route, mode=mode, generation=generation)
+        output_tokens = estimate_tokens(text)
+        reservation.settle(output_tokens)
+    record_tokens(mode, input_tokens, output_tokens, usage)
     return text
 
+async def stream_model(prompt, route="/refine", mode="-"):
+    """Yield response text chunks from the best available provider, bounded by MAX_API_TIMEOUT"""
+    deadline = time.monotonic() + MAX_API_TIMEOUT
+    generation = generation_profile(mode)
+    input_tokens = estimate_tokens(prompt)
+    output_tokens = 0
+    if not scheduler.enabled:
+        async for text in model_router.stream(prompt, deadline, route=route, mode=mode, generation=generation):
+            output_tokens += estimate_tokens(text)
+            yield text
+        record_tokens(mode, input_tokens, output_tokens)
+        return
+
+    max_output = (generation or {}).get("max_output_tokens")
+    async with scheduler.slot(input_tokens, deadline, mode, max_output) as reservation:
+        async for text in model_router.stream(prompt, deadline, route=route, mode=mode, generation=generation):
+            output_tokens += estimate_tokens(text)
+            yield text
+        reservation.settle(output_tokens)
+    record_tokens(mode, input_tokens, output_tokens)
+
+async def request_model(instructions, item, prompt, route="/refine", mode="-"):
+    """call_model for a prompt made of shared instructions and one input.
+
+    With MICRO_BATCH=1, concurrent calls with the same instructions are
+    packed into a single upstream call.
+    """
+    if not MICRO_BATCH:
+        return await call_model(prompt, route=route, mode=mode)
+
+    async def complete(batch_prompt, generation):
+        return await call_model(batch_prompt, route=route, mode=mode, generation=generation)
+
+    item_tokens = (generation_profile(mode) or {}).get("max_output_tokens")
+    return await micro_batcher.call(complete, instructions, item, prompt, mode=mode, item_tokens=item_tokens)
+
+async def cache_refined_prompts(cache_key, result, partition, raw_input):
+    """Store a refinement for exact and near-duplicate lookups"""
+    await response_cache.set(cache_key, result)
+    semantic_cache.add(partition, raw_input, cache_key)
+
+async def fetch_refined_prompts(prompt, cache_key, mode, return_format, partition, raw_input, route="/refine"):
+    """Call the model for a refinement, parse the response and cache the result"""
+    text = await request_model(build_instructions(*partition), raw_input, prompt, route=route, mode=mode)
+    with STAGE_LATENCY.time(route=route, mode=mode, stage="parse"):
+        result = parse_response(text, mode, return_format)
+    await cache_refined_prompts(cache_key, result, partition, raw_input)
+    return result
+
+async def get_refined_prompts(
+    raw_input: str,
+    mode: str = "deep",
+    tone: str = "default",
+    persona: str = "",
+    return_format: str = "plain",
+    route: str = "/refine",
+):
+    """Refined prompts from the caches, an identical call in flight, or the model; raises on failure"""
+    start_time = time.time()
+    prompt = build_prompt(mode, tone, persona, return_format, raw_input)
+    logger.debug("Sending prompt to model (mode: %s, length: %d)", mode, len(prompt))
+
+    cache_key = get_cache_key(prompt, mode)
+    partition = get_partition(mode, tone, persona, return_format)
+
+    async def fetch():
+        return await fetch_refined_prompts(prompt, cache_key, mode, return_format, partition, raw_input, route=route)
+
+    # Check cache first; a stale entry is served now and refreshed in the background
+    with STAGE_LATENCY.time(route=route, mode=mode, stage="cache_lookup"):
+        entry = await response_cache.lookup(cache_key)
+    if entry is not None and entry.usable:
+        logger.debug("Cache hit for prompt (mode: %s, %s)", mode, entry.state)
+        if entry.state != FRESH:
+            note_cache("stale")
+            note_stored("refine", cache_key)
+            response_cache.revalidate(cache_key, fetch)
+            return response_cache.serve_stale(entry, "revalidate")
+        note_cache("hit")
+        note_stored("refine", cache_key)
+        return entry.value
+
+    with STAGE_LATENCY.time(route=route, mode=mode, stage="semantic_lookup"):
+        similar = await semantic_cache.get(partition, raw_input)
+    if similar is not None:
+        note_cache("semantic")
+        return similar
+
+    # An expired answer beats an error while every provider's circuit is open
+    if entry is not None and not model_router.available():
+        note_cache("stale")
+        note_stored("refine", cache_key)
+        return response_cache.serve_stale(entry, "circuit_open")
+
+    try:
+        # Identical requests already in flight share a single upstream call
+        note_cache("coalesced" if refine_flight.in_flight(cache_key) else "miss")
+        result = await refine_flight.do(cache_key, fetch)
+        note_stored("refine", cache_key)
+        logger.debug("Model response received in %.2f seconds", time.time() - start_time)
+        return result
+    except Exception as e:
+        if entry is not None and should_fail_over(e):
+            note_stored("refine", cache_key)
+            return response_cache.serve_stale(entry, "upstream_error")
+        raise
+
 async def generate_refined_prompts(
     raw_input: str,
     mode: str = "deep",
@@ -106,91 +315,183 @@ async def generate_refined_prompts(
     persona: str = "",
     return_format: str = "plain"
 ):
-    if not API_KEY or not GEMINI_MODEL:
-        return ["Error: Gemini API key not configured. Please check your environment variables."]
+    """Like get_refined_prompts, but failures are answered with an apology instead of raised"""
+    if not model_router:
+        return [NOT_CONFIGURED_MESSAGE]
     
     start_time = time.time()
     
+    try:
+        return await get_refined_prompts(raw_input, mode, tone, persona, return_format)
+    except asyncio.TimeoutError:
+        logger.warning("Model timeout after %.2f seconds (mode: %s)", time.time() - start_time, mode)
+        return ["Sorry, the request timed out. Please try again with a shorter prompt or simpler request."]
+    except Overloaded:
+        # Surfaced as 503 + Retry-After by the app's exception handler
+        raise
+    except Exception as e:
+        logger.exception("Error in refine service after %.2f seconds", time.time() - start_time)
+        return [f"Sorry, something went wrong generating your prompt: {str(e)}. Please try again."]
+
+def replay_refined_prompts(result, emit_variants, cache_key=None):
+    """Events for a result that is served whole instead of streamed"""
+    if emit_variants:
+        for index, variant in enumerate(result):
+            yield "variant", {"index": index, "text": variant}
+    yield "done", {"refined_prompts": result, "cached": True, **result_link("refine", cache_key)}
+
+async def stream_refined_prompts(
+    raw_input: str,
+    mode: str = "deep",
+    tone: str = "default",
+    persona: str = "",
+    return_format: str = "plain"
+):
+    """Yield (event, data) pairs for a refinement as the model produces it.
+
+    Events are "token" for raw text, "variant" for each completed `deep`
+    variant, then a final "done" carrying the same result that
+    generate_refined_prompts would return, or "error".
+    """
+    if not model_router:
+        yield "error", {"detail": NOT_CONFIGURED_MESSAGE}
+        return
+
+    start_time = time.time()
+    emit_variants = mode == "deep" and return_format != "json"
+
     try:
         prompt = build_prompt(mode, tone, persona, return_format, raw_input)
-        print(f"Sending prompt to Gemini API (mode: {mode}, length: {len(prompt)})")
-        
-        # Check cache first
         cache_key = get_cache_key(prompt, mode)
-        if cache_key in response_cache:
-            cache_entry = response_cache[cache_key]
-            # Check if cache entry is still valid
-            if time.time() - cache_entry["timestamp"] < CACHE_TTL:
-                print(f"Cache hit for prompt (mode: {mode})")
-                return cache_entry["response"]
-            else:
-                # Remove expired cache entry
-                del response_cache[cache_key]
-        
-        # Use async version of generate_content with timeout
-        try:
-            # Create a task for the API call
-            api_task = asyncio.create_task(GEMINI_MODEL.generate_content_async(prompt))
-            
-            # Wait for the task to complete with a timeout
-            response = await asyncio.wait_for(api_task, timeout=MAX_API_TIMEOUT)
-            
-            elapsed = time.time() - start_time
-            print(f"Gemini API response received in {elapsed:.2f} seconds")
-            
-            text = response.text.strip()
-        except asyncio.TimeoutError:
-            elapsed = time.time() - start_time
-            print(f"Gemini API timeout after {elapsed:.2f} seconds")
-            return ["Sorry, the request timed out. Please try again with a shorter prompt or simpler request."]
-        
+
+        # A cache hit, or an identical request already in flight, is replayed as a whole
+        partition = get_partition(mode, tone, persona, return_format)
         result = None
-        if return_format == "json":
-            try:
-                # Try to parse as JSON object or array
-                result = json.loads(text)
-            except Exception as e:
-                print(f"JSON parsing error: {str(e)}")
-                # Fallback: return as single string
-                result = [text]
-        elif mode in ["basic", "quick"]:
-            # Extract lines or bullet points
-            lines = re.findall(r"^(?:[-*]\s*)?(.*\S.*)$", text, re.MULTILINE)
-            result = [l.strip() for l in lines if l.strip() and not l.lower().startswith("prompt")]
-        elif mode == "deep":
-            # First, try to extract variants with or without asterisks
-            variants = re.findall(
-                r"(?:\*\*)?Variant (\d+)(?:\*\*)?:(.+?)(?=(?:\n(?:\*\*)?Variant \d+(?:\*\*)?:|$))", 
-                text, 
-                re.DOTALL
-            )
-            
-            if not variants:
-                # If no variants found, return the cleaned text
-                result = [clean_markdown_text(text)]
-            else:
-                # Clean each variant and format properly
-                cleaned_variants = []
-                for variant_num, variant_content in variants:
-                    if variant_content.strip():
-                        variant_text = f"Variant {variant_num}:{variant_content}"
-                        cleaned_variant = clean_markdown_text(variant_text)
-                        cleaned_variants.append(cleaned_variant)
-                
-                result = cleaned_variants if cleaned_variants else [clean_markdown_text(text)]
-        else:
-            # For few-shot and cot, clean and return the full text
-            result = [clean_markdown_text(text)]
-        
-        # Cache the result
-        response_cache[cache_key] = {
-            "response": result,
-            "timestamp": time.time()
-        }
-        
-        return result
+        stored = True  # whether the result is the one cached under cache_key
+        entry = await response_cache.lookup(cache_key)
+        if entry is not None and entry.usable:
+            result = entry.value
+            note_cache("hit" if entry.state == FRESH else "stale")
+            if entry.state != FRESH:
+                response_cache.revalidate(cache_key, lambda: fetch_refined_prompts(
+                    prompt, cache_key, mode, return_format, partition, raw_input
+                ))
+                response_cache.serve_stale(entry, "revalidate")
+        if result is None:
+            result = await semantic_cache.get(partition, raw_input)
+            if result is not None:
+                note_cache("semantic")
+                stored = False
+        if result is None and refine_flight.in_flight(cache_key):
+            note_cache("coalesced")
+            result = await refine_flight.do(cache_key, None)
+        if result is None and entry is not None and not model_router.available():
+            note_cache("stale")
+            result = response_cache.serve_stale(entry, "circuit_open")
+        if result is not None:
+            logger.debug("Replaying cached result for stream (mode: %s)", mode)
+            for event in replay_refined_prompts(result, emit_variants, cache_key if stored else None):
+                yield event
+            return
+
+        note_cache("miss")
+        logger.debug("Streaming prompt from model (mode: %s, length: %d)", mode, len(prompt))
+        parser = VariantStreamParser() if emit_variants else None
+        parts = []
+        index = 0
+        try:
+            async for chunk in stream_model(prompt, route="/refine/stream", mode=mode):
+                if not parts:
+                    logger.debug("Model first chunk received in %.2f seconds", time.time() - start_time)
+                parts.append(chunk)
+                yield "token", {"text": chunk}
+                if parser:
+                    # Each completed block goes through the same parsing as the final result
+                    for block in parser.feed(chunk):
+                        for variant in parse_response(block, mode, return_format):
+                            yield "variant", {"index": index, "text": variant}
+                            index += 1
+        except Exception as e:
+            # Fall back to an expired answer only if nothing has been sent yet
+            if parts or entry is None or not should_fail_over(e):
+                raise
+            stale = response_cache.serve_stale(entry, "upstream_error")
+            for event in replay_refined_prompts(stale, emit_variants, cache_key):
+                yield event
+            return
+        if parser:
+            for block in parser.finish():
+                for variant in parse_response(block, mode, return_format):
+                    yield "variant", {"index": index, "text": variant}
+                    index += 1
+
+        with STAGE_LATENCY.time(route="/refine/stream", mode=mode, stage="parse"):
+            result = parse_response("".join(parts).strip(), mode, return_format)
+        await cache_refined_prompts(cache_key, result, partition, raw_input)
+        logger.debug("Model stream completed in %.2f seconds", time.time() - start_time)
+        yield "done", {"refined_prompts": result, "cached": False, **result_link("refine", cache_key)}
+    except asyncio.TimeoutError:
+        logger.warning("Model stream timeout after %.2f seconds (mode: %s)", time.time() - start_time, mode)
+        yield "error", {"detail": "Sorry, the request timed out. Please try again with a shorter prompt or simpler request."}
+    except Overloaded as e:
+        yield "error", {"detail": BUSY_MESSAGE, "retry_after": e.retry_after}
     except Exception as e:
-        elapsed = time.time() - start_time
-        print(f"Error in Gemini service after {elapsed:.2f} seconds: {str(e)}")
-        print(traceback.format_exc())
-        return [f"Sorry, something went wrong generating your prompt: {str(e)}. Please try again."]
+        logger.exception("Error in refine stream after %.2f seconds", time.time() - start_time)
+        yield "error", {"detail": f"Sorry, something went wrong generating your prompt: {str(e)}. Please try again."}
+
+async def generate_refined_prompts_batch(items, concurrency=BATCH_CONCURRENCY):
+    """Refine many PromptRequest items, yielding (index, result) pairs in completion order.
+
+    Identical items are refined once and fanned back out to every index,
+    cache hits are yielded straight away, and misses go upstream with at
+    most `concurrency` calls in flight. Each result is exactly what
+    generate_refined_prompts returns for that item.
+    """
+    concurrency = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+
+    # Group item indexes by cache key so duplicates share one refinement
+    groups = {}
+    for index, item in enumerate(items):
+        prompt = build_prompt(item.mode, item.tone, item.persona, item.return_format, item.raw_input)
+        cache_key = get_cache_key(prompt, item.mode)
+        if cache_key not in groups:
+            groups[cache_key] = (item, [])
+        groups[cache_key][1].append(index)
+
+    pending = []
+    for cache_key, (item, indexes) in groups.items():
+        # Stale and expired entries take the single-item path, which refreshes them
+        entry = await response_cache.lookup(cache_key)
+        if entry is not None and entry.state == FRESH:
+            for index in indexes:
+                yield index, entry.value
+        else:
+            pending.append((item, indexes))
+
+    if not pending:
+        return
+    logger.debug("Batch refine: %d items, %d unique, %d to generate", len(items), len(groups), len(pending))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def refine(item, indexes):
+        async with semaphore:
+            try:
+                result = await generate_refined_prompts(
+                    item.raw_input, item.mode, item.tone, item.persona, item.return_format
+                )
+            except Overloaded:
+                # The rest of the batch still gets its results
+                result = [BUSY_MESSAGE]
+        return indexes, result
+
+    tasks = [asyncio.ensure_future(refine(item, indexes)) for item, indexes in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            indexes, result = await next_done
+            for index in indexes:
+                yield index, result
+    finally:
+        # Stop outstanding work if the consumer goes away early
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,416 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import ipaddress
+import http.client
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse
+from services.admission import Overloaded
+from services.cache_backends import create_cache, CACHE_BACKEND, MemoryCacheBackend
+from services.scheduler import client_key, priority_class
+from services.traffic import request_notes
+from services.metrics import JOB_QUEUE_DEPTH, JOB_QUEUE_WAIT, JOB_RUN_TIME, JOBS
+
+logger = logging.getLogger(__name__)
+
+# Jobs run on a pool of JOB_WORKERS tasks per worker process, with at most
+# JOB_QUEUE_SIZE waiting; job records live in the JOB_BACKEND store for
+# JOB_TTL seconds, so that any worker can answer a status request
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 8))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 500))
+JOB_TTL = int(os.getenv("JOB_TTL", 3600))
+# A job shed by the admission controller is retried until it is this old
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", 600))
+# Server worker processes (run.py sets this for Gunicorn). With more than
+# one, job records must be in a store they share: JOB_BACKEND defaults to
+# CACHE_BACKEND, or to sqlite when that is the per-process memory backend,
+# and the job endpoints are disabled if it is set to memory explicitly
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+JOB_BACKEND = (
+    os.getenv("JOB_BACKEND")
+    or (CACHE_BACKEND if CACHE_BACKEND != "memory" or WEB_CONCURRENCY <= 1 else "sqlite")
+).lower()
+# Longest a status request may long-poll for the result
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", 30))
+JOB_POLL_INTERVAL = 0.5
+# Scheduler priority class of job work (see services/scheduler.py)
+JOB_PRIORITY = os.getenv("JOB_PRIORITY", "bulk")
+
+# Callbacks are disabled unless JOB_CALLBACK_HOSTS lists the hosts (comma
+# separated) callback URLs may point to. Those must resolve to public
+# addresses, checked again when connecting, unless JOB_CALLBACK_ALLOW_PRIVATE
+# is set (for webhooks on the private network). Redirects are never followed
+JOB_CALLBACK_HOSTS = {h.strip().lower() for h in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if h.strip()}
+JOB_CALLBACK_ALLOW_PRIVATE = os.getenv("JOB_CALLBACK_ALLOW_PRIVATE", "").lower() in ("1", "true", "yes")
+JOB_CALLBACK_TIMEOUT = 10
+JOB_CALLBACK_ATTEMPTS = 3
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+
+def _allowed_address(address):
+    """Whether a callback may connect to this IP address"""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if getattr(ip, "ipv4_mapped", None) is not None:
+        ip = ip.ipv4_mapped
+    # Loopback, private, link-local (cloud metadata), shared and reserved ranges are not global
+    return JOB_CALLBACK_ALLOW_PRIVATE or (ip.is_global and not ip.is_multicast)
+
+
+def _check_addresses(host, infos):
+    """The addresses of a getaddrinfo result; raises ValueError if any of them may not be called"""
+    addresses = [info[4] for info in infos]
+    for sockaddr in addresses:
+        if not _allowed_address(sockaddr[0]):
+            raise ValueError(f"callback_url host '{host}' resolves to a non-public address")
+    return addresses
+
+
+async def validate_callback_url(url):
+    """Return an error message if url may not be used as a callback, else None"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return "callback_url must be an http(s) URL"
+    if not JOB_CALLBACK_HOSTS:
+        return "Callbacks are not enabled on this server (JOB_CALLBACK_HOSTS is not set)"
+    if parsed.hostname.lower() not in JOB_CALLBACK_HOSTS:
+        return f"callback_url host '{parsed.hostname}' is not allowed"
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+        _check_addresses(parsed.hostname, infos)
+    except ValueError as e:
+        return str(e)
+    except OSError:
+        return f"callback_url host '{parsed.hostname}' could not be resolved"
+    return None
+
+
+def _connect_checked(host, port, timeout):
+    """A socket connected to host, after checking every address it resolves to (DNS may have changed)"""
+    addresses = _check_addresses(host, socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+    error = None
+    for sockaddr in addresses:
+        try:
+            return socket.create_connection(sockaddr[:2], timeout=timeout)
+        except OSError as e:
+            error = e
+    raise error or OSError(f"could not connect to {host}")
+
+
+class _CallbackHTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        self.sock = _connect_checked(self.host, self.port, self.timeout)
+
+
+class _CallbackHTTPSConnection(http.client.HTTPSConnection):
+    def connect(self):
+        sock = _connect_checked(self.host, self.port, self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class _CallbackHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_CallbackHTTPConnection, req)
+
+
+class _CallbackHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_CallbackHTTPSConnection, req, context=self._context)
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        # The 3xx is returned as the callback's status instead
+        return None
+
+
+# Direct connections only (no environment proxies), to checked addresses, without redirects
+_callback_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), _CallbackHTTPHandler, _CallbackHTTPSHandler, _NoRedirectHandler
+)
+
+
+def _post_json(url, payload):
+    """POST payload as JSON (blocking; runs in a thread) and return the status code"""
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        with _callback_opener.open(request, timeout=JOB_CALLBACK_TIMEOUT) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+class _Job:
+    __slots__ = ("record", "run", "dedupe_key", "client", "done")
+
+    def __init__(self, record, run, dedupe_key):
+        self.record = record
+        self.run = run
+        self.dedupe_key = dedupe_key
+        self.client = client_key.get()
+        self.done = asyncio.Event()
+
+
+class JobQueue:
+    """Bounded queue of long-running refine/explain calls, run by a worker pool.
+
+    `submit` returns a job record straight away; the work runs in the
+    background and the record (status, timings, result or error) is kept in
+    a cache backend for `ttl` seconds. Jobs without a callback that share a
+    dedupe key (the response cache key) share one run while it is queued or
+    running, and a cached result produces a finished job without queueing
+    at all. Clients poll `get`, long-poll `wait`, or give a callback URL
+    that receives the finished record.
+    """
+
+    def __init__(self, name="jobs", workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, ttl=JOB_TTL, store=None):
+        self.name = name
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        # No entry/byte budget: a record must only ever go away when its TTL
+        # runs out, or a client polling a job it was promised would get a 404
+        self.store = store or create_cache(
+            name, ttl=ttl, backend=JOB_BACKEND, max_entries=None, max_bytes=None
+        )
+        self._jobs = {}  # job id -> _Job, while queued or running in this process
+        self._by_key = {}  # dedupe key -> job id
+        self._queue = None
+        self._running = 0
+        self._pool = []
+        self._pid = None
+        self._loop = None
+        # Why the job endpoints are disabled, or None
+        self.unavailable = None
+        if WEB_CONCURRENCY > 1 and isinstance(self.store, MemoryCacheBackend):
+            self.unavailable = "Jobs need a shared JOB_BACKEND (sqlite or redis) when the server runs several workers"
+            logger.warning("Job endpoints disabled: %s", self.unavailable)
+
+        self.submitted = 0
+        self.deduplicated = 0
+        self.cache_hits = 0
+        self.completed = 0
+        self.failed = 0
+
+
+    def _ensure_workers(self):
+        """Start the worker pool in the current process's event loop, replacing workers that stopped"""
+        pid, loop = os.getpid(), asyncio.get_running_loop()
+        if self._pid == pid and self._loop is loop and all(not task.done() for task in self._pool):
+            return
+        if self._pid != pid:
+            # After a fork, the queue, tasks and jobs belong to the parent process
+            self._queue = None
+            self._jobs.clear()
+            self._by_key.clear()
+        if self._loop is not loop or self._queue is None:
+            # A new event loop needs its own queue and workers; jobs still
+            # waiting are carried over, ones running on the old loop are gone
+            waiting = []
+            while self._queue is not None and not self._queue.empty():
+                waiting.append(self._queue.get_nowait())
+            self._queue = asyncio.Queue()
+            for job in waiting:
+                self._queue.put_nowait(job)
+            self._jobs = {job.record["job_id"]: job for job in waiting}
+            self._by_key = {key: job_id for key, job_id in self._by_key.items() if job_id in self._jobs}
+            self._running = 0
+            self._pool = []
+        self._pool = [task for task in self._pool if not task.done()]
+        self._pool += [asyncio.ensure_future(self._work()) for _ in range(self.workers - len(self._pool))]
+        self._pid, self._loop = pid, loop
+
+    def _new_record(self, kind, callback_url):
+        return {
+            "job_id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "queue_wait": None,
+            "result": None,
+            "error": None,
+            "cached": False,
+            "callback_url": callback_url,
+            "callback_status": None,
+        }
+
+    async def _save(self, record):
+        await self.store.set(record["job_id"], dict(record), ttl=self.ttl)
+
+    def queue_depth(self):
+        """Jobs in this process waiting for a worker"""
+        return len(self._jobs) - self._running if self._pid == os.getpid() else 0
+
+    async def submit(self, kind, run, dedupe_key=None, cached=None, callback_url=None):
+        """Queue run() as a job and return its record.
+
+        `cached` is a result that can be served right away; the job is then
+        finished on creation. Raises Overloaded when the queue is full.
+        """
+        self._ensure_workers()
+        if dedupe_key is not None and cached is None and not callback_url:
+            job_id = self._by_key.get(dedupe_key)
+            if job_id is not None and job_id in self._jobs:
+                self.deduplicated += 1
+                JOBS.inc(kind=kind, outcome="deduplicated")
+                return dict(self._jobs[job_id].record)
+
+        record = self._new_record(kind, callback_url)
+        if cached is not None:
+            now = time.time()
+            record.update(status=DONE, started_at=now, finished_at=now, queue_wait=0.0, result=cached, cached=True)
+            self.cache_hits += 1
+            JOBS.inc(kind=kind, outcome="cached")
+            await self._save(record)
+            if callback_url:
+                asyncio.ensure_future(self._callback(record))
+            return dict(record)
+
+        if self.queue_depth() >= self.max_queued:
+            JOBS.inc(kind=kind, outcome="rejected")
+            # Roughly how long until a worker frees up for the oldest waiting job
+            raise Overloaded("job_queue_full", retry_after=5)
+
+        # Registered before the first await, so concurrent duplicates find it
+        job = _Job(record, run, dedupe_key)
+        self._jobs[record["job_id"]] = job
+        if dedupe_key is not None and not callback_url:
+            self._by_key[dedupe_key] = record["job_id"]
+        await self._save(record)
+        self._queue.put_nowait(job)
+        self.submitted += 1
+        JOB_QUEUE_DEPTH.set(self.queue_depth(), queue=self.name)
+        return dict(record)
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            self._running += 1
+            JOB_QUEUE_DEPTH.set(self.queue_depth(), queue=self.name)
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job %s could not be recorded", job.record["job_id"])
+            finally:
+                self._running -= 1
+                self._finish(job)
+
+    async def _run(self, job):
+        # Worker tasks outlive requests, so the job carries who it is for
+        client_key.set(job.client)
+        priority_class.set(JOB_PRIORITY)
+        request_notes.set(None)
+        record = job.record
+        started = time.time()
+        record.update(status=RUNNING, started_at=started, queue_wait=started - record["created_at"])
+        JOB_QUEUE_WAIT.observe(record["queue_wait"], kind=record["kind"])
+        await self._save(record)
+
+        try:
+            with JOB_RUN_TIME.time(kind=record["kind"]):
+                result = await self._run_with_retries(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Job %s (%s) failed: %s: %s", record["job_id"], record["kind"], type(e).__name__, e)
+            record.update(status=FAILED, error=f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+            self.failed += 1
+        else:
+            record.update(status=DONE, result=result)
+            self.completed += 1
+        record["finished_at"] = time.time()
+        JOBS.inc(kind=record["kind"], outcome=record["status"])
+        await self._save(record)
+        if record["callback_url"]:
+            asyncio.ensure_future(self._callback(dict(record)))
+
+    async def _run_with_retries(self, job):
+        """Run the job, waiting out admission-control shedding until JOB_TIMEOUT"""
+        while True:
+            try:
+                return await job.run()
+            except Overloaded as e:
+                if time.time() + e.retry_after - job.record["created_at"] > JOB_TIMEOUT:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    def _finish(self, job):
+        job_id = job.record["job_id"]
+        self._jobs.pop(job_id, None)
+        if job.dedupe_key is not None and self._by_key.get(job.dedupe_key) == job_id:
+            del self._by_key[job.dedupe_key]
+        job.done.set()
+
+    async def _callback(self, record):
+        """POST the finished record to its callback URL, retrying with backoff"""
+        loop = asyncio.get_running_loop()
+        status = None
+        for attempt in range(JOB_CALLBACK_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(2 ** attempt)
+            try:
+                status = await loop.run_in_executor(None, _post_json, record["callback_url"], record)
+            except Exception as e:
+                status = type(e).__name__
+                logger.warning("Callback for job %s failed: %s", record["job_id"], e)
+                continue
+            # Client errors will not go away by retrying
+            if status < 500:
+                break
+        record["callback_status"] = status
+        delivered = isinstance(status, int) and 200 <= status < 300
+        JOBS.inc(kind=record["kind"], outcome="callback_ok" if delivered else "callback_failed")
+        await self._save(record)
+
+    async def get(self, job_id):
+        """The job's record, or None if it is unknown or has expired"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return dict(job.record)
+        return await self.store.get(job_id)
+
+    async def wait(self, job_id, timeout):
+        """Like get, but waits up to timeout seconds for the job to finish"""
+        deadline = time.monotonic() + min(max(timeout, 0), JOB_MAX_WAIT)
+        job = self._jobs.get(job_id)
+        if job is not None:
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout=max(0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                return dict(job.record)
+        # Jobs running in another worker are only visible through the store
+        while True:
+            record = await self.store.get(job_id)
+            if record is None or record["status"] in FINISHED or time.monotonic() >= deadline:
+                return record
+            await asyncio.sleep(min(JOB_POLL_INTERVAL, max(0, deadline - time.monotonic())))
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self.queue_depth(),
+            "running": self._running if self._pid == os.getpid() else 0,
+            "max_queued": self.max_queued,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "cache_hits": self.cache_hits,
+            "completed": self.completed,
+            "failed": self.failed,
+            "backend": self.store.stats().get("backend"),
+        }
+
+
+job_queue = JobQueue()
@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import queue
+import random
+import logging
+import logging.handlers
+
+# Per-request messages are logged at DEBUG, so the default INFO level keeps
+# them off the hot path entirely; LOG_SAMPLE_RATE thins them out when
+# DEBUG is enabled under real traffic
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # "text" or "json"
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+_queue = None
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of DEBUG/INFO records; warnings and errors always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including any `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+def _start_listener():
+    """Write queued records to stderr from a background thread"""
+    global _listener, _queue
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+
+    _queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(_queue, handler, respect_handler_level=False)
+    _listener.start()
+
+    queue_handler = logging.handlers.QueueHandler(_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if getattr(h, "_prompt_tools", False)]:
+        root.removeHandler(existing)
+    queue_handler._prompt_tools = True
+    root.addHandler(queue_handler)
+
+
+def configure_logging():
+    """Route application logs through a queue so formatting and I/O happen off the event loop.
+
+    Safe to call more than once. The listener thread does not survive
+    fork(), so Gunicorn workers start their own.
+    """
+    if _listener is not None:
+        return
+    logging.getLogger().setLevel(LOG_LEVEL)
+    _start_listener()
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_start_listener)
@@ -0,0 +1,441 @@
+import os
+import json
+import time
+import glob
+import asyncio
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# When set, every worker periodically writes its metrics to a file in this
+# directory and /metrics merges them, so a scrape sees the whole node
+# rather than whichever Gunicorn worker happened to answer
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+# Latency buckets in seconds, spanning cache hits (sub-ms) to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = entry
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            else:
+                entry[0][-1] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class Registry:
+    """Collection of metrics that renders the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.metrics = []
+        self._flusher = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    # Cross-worker aggregation
+
+    def flush(self):
+        """Write this worker's metrics to METRICS_DIR (atomically)"""
+        if not METRICS_DIR:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        with tempfile.NamedTemporaryFile("w", dir=METRICS_DIR, delete=False, suffix=".tmp") as handle:
+            json.dump({"pid": os.getpid(), "metrics": self.snapshot()}, handle, separators=(",", ":"))
+        os.replace(handle.name, path)
+
+    def ensure_flusher(self):
+        """Start the periodic flush task in the current worker's event loop"""
+        if not METRICS_DIR or (self._flusher is not None and not self._flusher.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flusher = loop.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def _collect(self):
+        """Merged {name: {label_key: value}} across every worker's snapshot"""
+        if not METRICS_DIR:
+            return {name: [(tuple(key), value) for key, value in values] for name, values in self.snapshot().items()}
+
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            try:
+                with open(path) as handle:
+                    snapshots.append(json.load(handle))
+            except (OSError, ValueError):
+                continue
+
+        kinds = {metric.name: metric.kind for metric in self.metrics}
+        merged = {}
+        for snapshot in snapshots:
+            alive = _pid_alive(snapshot["pid"])
+            for name, values in snapshot["metrics"].items():
+                kind = kinds.get(name)
+                # Gauges describe live state, so exited workers no longer contribute
+                if kind is None or (kind == "gauge" and not alive):
+                    continue
+                bucket = merged.setdefault(name, {})
+                for key, value in values:
+                    key = tuple(key)
+                    if kind == "histogram":
+                        current = bucket.get(key)
+                        if current is None:
+                            bucket[key] = [list(value[0]), value[1], value[2]]
+                        else:
+                            current[0] = [a + b for a, b in zip(current[0], value[0])]
+                            current[1] += value[1]
+                            current[2] += value[2]
+                    else:
+                        bucket[key] = bucket.get(key, 0) + value
+        return {name: list(values.items()) for name, values in merged.items()}
+
+    def render(self):
+        collected = self._collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, value in sorted(collected.get(metric.name, [])):
+                labels = list(zip(metric.labelnames, key))
+                if metric.kind == "histogram":
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(metric.buckets + (float("inf"),), counts):
+                        cumulative += bucket_count
+                        le = "+Inf" if bound == float("inf") else repr(float(bound))
+                        lines.append(f"{metric.name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_labels(labels)} {total}")
+                    lines.append(f"{metric.name}_count{_labels(labels)} {count}")
+                else:
+                    lines.append(f"{metric.name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def clear_metrics_dir():
+    """Remove snapshots left by previous runs (call once, before workers start)"""
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "End-to-end request latency",
+    ["route", "method", "status"],
+)
+STAGE_LATENCY = REGISTRY.histogram(
+    "prompt_stage_duration_seconds",
+    "Latency of each stage of a refine/explain request",
+    ["route", "mode", "stage"],
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "prompt_cache_requests_total",
+    "Response cache lookups by result",
+    ["cache", "result"],
+)
+COALESCED_REQUESTS = REGISTRY.counter(
+    "prompt_coalesced_requests_total",
+    "Requests that joined an identical in-flight upstream call",
+    ["route"],
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "upstream_requests_in_flight",
+    "Upstream model calls currently in flight",
+    ["provider", "route"],
+)
+UPSTREAM_TIMEOUTS = REGISTRY.counter(
+    "upstream_timeouts_total",
+    "Upstream model calls that hit MAX_API_TIMEOUT",
+    ["provider", "route"],
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "upstream_errors_total",
+    "Upstream model calls that failed",
+    ["provider", "route"],
+)
+RATE_LIMIT_REJECTIONS = REGISTRY.counter(
+    "rate_limit_rejections_total",
+    "Requests rejected by the rate limiter",
+    ["route"],
+)
+ADMISSION_LIMIT = REGISTRY.gauge(
+    "upstream_concurrency_limit",
+    "Current adaptive limit on concurrent upstream calls",
+    ["controller"],
+)
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge(
+    "upstream_queue_depth",
+    "Upstream calls waiting for a slot",
+    ["controller"],
+)
+ADMISSION_SHED = REGISTRY.counter(
+    "upstream_shed_total",
+    "Upstream calls rejected by the admission controller",
+    ["controller", "reason"],
+)
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "upstream_retries_total",
+    "Upstream calls retried after a transient error",
+    ["provider", "route"],
+)
+UPSTREAM_HEDGES = REGISTRY.counter(
+    "upstream_hedges_total",
+    "Hedged second requests sent for slow upstream calls",
+    ["provider", "route"],
+)
+CIRCUIT_STATE = REGISTRY.gauge(
+    "upstream_circuit_state",
+    "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ["circuit"],
+)
+PROVIDER_REQUESTS = REGISTRY.counter(
+    "upstream_provider_requests_total",
+    "Model calls routed to each provider, by outcome",
+    ["provider", "outcome"],
+)
+CACHE_STALE_SERVED = REGISTRY.counter(
+    "prompt_cache_stale_served_total",
+    "Cached responses served past their freshness TTL, by reason",
+    ["cache", "reason"],
+)
+CACHE_REFRESHES = REGISTRY.counter(
+    "prompt_cache_refreshes_total",
+    "Background refreshes of stale cache entries, by outcome",
+    ["cache", "outcome"],
+)
+JOB_QUEUE_DEPTH = REGISTRY.gauge(
+    "job_queue_depth",
+    "Jobs waiting for a worker",
+    ["queue"],
+)
+JOB_QUEUE_WAIT = REGISTRY.histogram(
+    "job_queue_wait_seconds",
+    "Time jobs spent queued before a worker picked them up",
+    ["kind"],
+)
+JOB_RUN_TIME = REGISTRY.histogram(
+    "job_run_seconds",
+    "Time from a worker picking a job up to its result",
+    ["kind"],
+)
+JOBS = REGISTRY.counter(
+    "jobs_total",
+    "Jobs by kind and outcome",
+    ["kind", "outcome"],
+)
+MICRO_BATCH_SIZE = REGISTRY.histogram(
+    "upstream_micro_batch_size",
+    "Requests packed into each micro-batched upstream call",
+    ["mode"],
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+MICRO_BATCH_CALLS = REGISTRY.counter(
+    "upstream_micro_batches_total",
+    "Packed upstream calls, by outcome (ok, fallback to single calls, error)",
+    ["mode", "outcome"],
+)
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge(
+    "scheduler_queue_depth",
+    "Upstream calls waiting in the fair scheduler, by priority class",
+    ["priority"],
+)
+SCHEDULER_WAIT = REGISTRY.histogram(
+    "scheduler_wait_seconds",
+    "Time upstream calls waited for their turn and quota",
+    ["priority"],
+)
+SCHEDULER_DISPATCHED = REGISTRY.counter(
+    "scheduler_dispatched_total",
+    "Upstream calls released by the fair scheduler",
+    ["priority"],
+)
+SCHEDULER_REJECTED = REGISTRY.counter(
+    "scheduler_rejected_total",
+    "Upstream calls shed by the fair scheduler",
+    ["priority", "reason"],
+)
+SCHEDULER_TOKENS = REGISTRY.counter(
+    "scheduler_reserved_tokens_total",
+    "Estimated tokens reserved for dispatched calls",
+    ["priority"],
+)
+SCHEDULER_BUDGET = REGISTRY.gauge(
+    "scheduler_budget_available",
+    "Requests and tokens left in the per-minute quota buckets",
+    ["bucket"],
+)
+REFINE_EXPLAIN_CALLS = REGISTRY.counter(
+    "refine_explain_total",
+    "Fused refine-and-explain requests, by how they were answered (cached, fused, partial, mismatch, fallback)",
+    ["mode", "outcome"],
+)
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a timer that was due (time every coroutine waited)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+EVENT_LOOP_LAG_MAX = REGISTRY.gauge(
+    "event_loop_lag_max_seconds",
+    "Worst event-loop lag over the last 10 seconds, per worker",
+    ["worker"],
+)
+EVENT_LOOP_BLOCKED = REGISTRY.counter(
+    "event_loop_blocked_total",
+    "Steps that held the event loop longer than LOOP_BLOCK_THRESHOLD, by route",
+    ["route"],
+)
+GC_PAUSE = REGISTRY.histogram(
+    "python_gc_pause_seconds",
+    "Garbage collection pauses, by generation",
+    ["generation"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+MODEL_TOKENS = REGISTRY.histogram(
+    "model_tokens",
+    "Tokens per upstream call by mode, direction (input/output) and source (estimated locally or reported by the provider)",
+    ["mode", "direction", "source"],
+    buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+INPUT_BUDGET = REGISTRY.counter(
+    "input_budget_total",
+    "Inputs over INPUT_TOKEN_BUDGET, by what was done (compacted, truncated, rejected)",
+    ["mode", "action"],
+)
+RESULT_READS = REGISTRY.counter(
+    "result_reads_total",
+    "GET /results requests by kind and outcome (ok, not_modified, missing)",
+    ["kind", "outcome"],
+)
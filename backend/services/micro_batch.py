@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import contextvars
+from services.parsing import strip_code_fence
+from services.scheduler import client_key, priority_class
+from services.metrics import MICRO_BATCH_SIZE, MICRO_BATCH_CALLS
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: pack concurrent requests from the same client that share
+# instructions (same mode, tone, persona and format, or /explain) into one
+# upstream call, to get more requests out of a requests-per-minute quota.
+# Requests of different clients are never packed together, so one client's
+# input can't steer the answers to another's. A batch is sent once no new
+# request has joined for MICRO_BATCH_WINDOW seconds, MICRO_BATCH_MAX_WINDOW
+# seconds after it opened, or when it holds MICRO_BATCH_MAX_SIZE requests
+MICRO_BATCH = os.getenv("MICRO_BATCH", "0").lower() in ("1", "true", "yes")
+MICRO_BATCH_WINDOW = float(os.getenv("MICRO_BATCH_WINDOW", 0.005))
+MICRO_BATCH_MAX_WINDOW = float(os.getenv("MICRO_BATCH_MAX_WINDOW", 0.05))
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", 4))
+# Output budget of a packed call: the per-request budget (the mode's
+# max_output_tokens, else this) times the batch size, up to what the model
+# allows in one response
+MICRO_BATCH_ITEM_TOKENS = 1024
+MICRO_BATCH_MAX_OUTPUT_TOKENS = 8192
+
+_BATCH_MARKER = "Inputs (JSON array of {count}):"
+
+
+def pack_prompt(instructions, items):
+    """One prompt asking for the instructions to be applied to every item, answered as a JSON array"""
+    count = len(items)
+    return (
+        f"{instructions}\n\n"
+        f"Apply the instructions above separately to each of the {count} inputs below, as if each "
+        "were the only input. Respond with nothing but a JSON array of "
+        f"{count} strings, in the same order as the inputs, each holding the complete response for "
+        "its input exactly as you would write it on its own.\n\n"
+        f"{_BATCH_MARKER.format(count=count)}\n"
+        f"{json.dumps(items, ensure_ascii=False)}"
+    )
+
+
+def unpack_prompt(prompt):
+    """(instructions, items) of a packed prompt, or None for an ordinary one"""
+    marker = _BATCH_MARKER.split("{", 1)[0]
+    if marker not in prompt:
+        return None
+    head, _, tail = prompt.rpartition(marker)
+    try:
+        items = json.loads(tail.split("\n", 1)[1])
+    except (IndexError, ValueError):
+        return None
+    return head.split("\n\nApply the instructions above", 1)[0], items
+
+
+def split_response(text, count):
+    """The per-item responses of a packed call, or None if the response is not usable"""
+    text = strip_code_fence(text)
+    try:
+        parts = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(parts, list) or len(parts) != count:
+        return None
+    if not all(isinstance(part, str) and part.strip() for part in parts):
+        return None
+    return [part.strip() for part in parts]
+
+
+class _Batch:
+    __slots__ = ("instructions", "mode", "client", "priority", "item_tokens", "items", "opened", "last_joined", "full")
+
+    def __init__(self, instructions, mode, client, priority, item_tokens):
+        self.instructions = instructions
+        self.mode = mode
+        self.client = client
+        self.priority = priority
+        self.item_tokens = item_tokens or MICRO_BATCH_ITEM_TOKENS
+        self.items = []  # (item, single prompt, future, caller's context, caller's complete)
+        self.opened = self.last_joined = time.monotonic()
+        self.full = asyncio.Event()
+
+
+class MicroBatcher:
+    """Packs concurrent model calls of one client with identical instructions into one call.
+
+    `call(complete, instructions, item, prompt)` waits briefly for other
+    calls by the same client with the same instructions, then sends them
+    together as one prompt asking for a JSON array of answers, and returns
+    this item's answer. `complete(prompt, generation)` makes the actual
+    model call. A batch of one is sent as its ordinary `prompt`; if a packed
+    response can't be split back up, every item is retried as its own call
+    with its own `complete`. Single calls run in their caller's context
+    (client, priority, usage notes); packed calls run in a context of their
+    own, as the batch's client and priority class.
+    """
+
+    def __init__(
+        self,
+        window=MICRO_BATCH_WINDOW,
+        max_window=MICRO_BATCH_MAX_WINDOW,
+        max_size=MICRO_BATCH_MAX_SIZE,
+    ):
+        self.window = window
+        self.max_window = max(max_window, window)
+        self.max_size = max(1, max_size)
+        self._open = {}  # (instructions, mode, client, priority class) -> _Batch still accepting items
+        self._tasks = set()  # dispatches in progress (the loop only keeps weak references)
+
+        self.batches = 0
+        self.batched_items = 0
+        self.fallbacks = 0
+
+    async def call(self, complete, instructions, item, prompt, mode="-", item_tokens=None):
+        client = client_key.get()
+        priority = priority_class.get()
+        key = (instructions, mode, client, priority)
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = _Batch(instructions, mode, client, priority, item_tokens)
+            # Started in an empty context, so nothing of this caller's carries over to the batch
+            task = contextvars.Context().run(asyncio.ensure_future, self._dispatch(key, batch, complete))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        future = asyncio.get_running_loop().create_future()
+        # Retrieve the outcome even if this caller has been cancelled meanwhile
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        batch.items.append((item, prompt, future, contextvars.copy_context(), complete))
+        batch.last_joined = time.monotonic()
+        if len(batch.items) >= self.max_size:
+            self._close(key, batch)
+            batch.full.set()
+        return await asyncio.shield(future)
+
+    def _close(self, key, batch):
+        if self._open.get(key) is batch:
+            del self._open[key]
+
+    async def _dispatch(self, key, batch, complete):
+        client_key.set(batch.client)
+        priority_class.set(batch.priority)
+        try:
+            await self._send(key, batch, complete)
+        finally:
+            for _, _, future, _, _ in batch.items:
+                if not future.done():
+                    future.set_exception(RuntimeError("Micro-batch was not completed"))
+
+    async def _send(self, key, batch, complete):
+        # Wait while requests keep joining, up to max_window
+        while not batch.full.is_set():
+            now = time.monotonic()
+            wait = min(batch.last_joined + self.window, batch.opened + self.max_window) - now
+            if wait <= 0:
+                break
+            try:
+                await asyncio.wait_for(batch.full.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+        self._close(key, batch)
+
+        items = batch.items
+        MICRO_BATCH_SIZE.observe(len(items), mode=batch.mode)
+        if len(items) == 1:
+            await self._single(*items[0])
+            return
+
+        self.batches += 1
+        self.batched_items += len(items)
+        budget = min(batch.item_tokens * len(items), MICRO_BATCH_MAX_OUTPUT_TOKENS)
+        try:
+            text = await complete(
+                pack_prompt(batch.instructions, [item for item, _, _, _, _ in items]),
+                {"max_output_tokens": budget},
+            )
+        except Exception as e:
+            # The packed call had the same retries and failover as a single call would
+            for _, _, future, _, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+            MICRO_BATCH_CALLS.inc(mode=batch.mode, outcome="error")
+            return
+
+        parts = split_response(text, len(items))
+        if parts is None:
+            self.fallbacks += 1
+            MICRO_BATCH_CALLS.inc(mode=batch.mode, outcome="fallback")
+            logger.warning("Could not split a batched response for %d items; calling them one by one", len(items))
+            await asyncio.gather(*(self._single(*entry) for entry in items))
+            return
+
+        MICRO_BATCH_CALLS.inc(mode=batch.mode, outcome="ok")
+        for (_, _, future, _, _), part in zip(items, parts):
+            if not future.done():
+                future.set_result(part)
+
+    async def _single(self, item, prompt, future, context, complete):
+        try:
+            # Charged to the caller, like an unbatched call
+            result = await context.run(asyncio.ensure_future, complete(prompt, None))
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            "enabled": MICRO_BATCH,
+            "batches": self.batches,
+            "batched_items": self.batched_items,
+            "fallbacks": self.fallbacks,
+            "open": len(self._open),
+        }
+
+
+micro_batcher = MicroBatcher()
@@ -1,21 +1,98 @@
 import os
-import openai
-
-SYSTEM_PROMPT = (
-    "Refine this input into a high-quality prompt that could be used in an AI assistant. "
-    "Include task intent, format instructions, and constraints. Generate 2–3 prompt variants."
-)
-
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-async def generate_refined_prompts(raw_input: str):
-    response = openai.ChatCompletion.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": raw_input}
-        ],
-        n=3,
-        max_tokens=200,
-    )
-    return [choice["message"]["content"] for choice in response["choices"]]
\ No newline at end of file
+import asyncio
+import logging
+import importlib.util
+from services.admission import UpstreamUnavailable
+from services.providers import Provider
+from services.tokens import report_usage
+
+logger = logging.getLogger(__name__)
+
+# OpenAI chat completions, used as a provider when OPENAI_API_KEY is set.
+# Requires the openai package (1.x, for the async client; in requirements.txt)
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # optional, for compatible gateways
+
+# Same sampling settings as the Gemini model
+generation_config = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "max_tokens": 1024,
+}
+
+# Per-call overrides arrive in Gemini's names; top_k has no equivalent
+_GENERATION_NAMES = {"temperature": "temperature", "top_p": "top_p", "max_output_tokens": "max_tokens"}
+
+# openai error types worth retrying or failing over on
+_TRANSIENT_ERROR_NAMES = ("RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError")
+
+
+def sdk_available():
+    """Whether the openai package can be imported (checked without importing it)"""
+    if importlib.util.find_spec("openai") is not None:
+        return True
+    logger.warning("OPENAI_API_KEY is set but the openai package is not installed; not using OpenAI")
+    return False
+
+
+class OpenAIProvider(Provider):
+    """Chat completions through the non-blocking AsyncOpenAI client"""
+
+    name = "openai"
+
+    def __init__(self, api_key=OPENAI_API_KEY, model=OPENAI_MODEL, base_url=OPENAI_BASE_URL, client=None):
+        super().__init__()
+        self.model = model
+        self._api_key = api_key
+        self._base_url = base_url
+        self._client = client
+
+    def _prepare(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            # Retries and timeouts are handled by the provider layer
+            self._client = AsyncOpenAI(api_key=self._api_key, base_url=self._base_url, max_retries=0)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._prepare()
+        return self._client
+
+    def _messages(self, prompt):
+        return [{"role": "user", "content": prompt}]
+
+    def _options(self, generation):
+        options = dict(generation_config)
+        for name, value in (generation or {}).items():
+            if name in _GENERATION_NAMES:
+                options[_GENERATION_NAMES[name]] = value
+        return options
+
+    def _translate(self, exc):
+        """Map transient openai errors onto UpstreamUnavailable so retries and failover apply"""
+        if type(exc).__name__ in _TRANSIENT_ERROR_NAMES:
+            return UpstreamUnavailable(f"{type(exc).__name__}: {exc}")
+        return exc
+
+    async def _complete(self, prompt, timeout, generation=None):
+        response = await asyncio.wait_for(
+            self.client.chat.completions.create(
+                model=self.model, messages=self._messages(prompt), timeout=timeout, **self._options(generation)
+            ),
+            timeout=timeout
+        )
+        if response.usage:
+            report_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return (response.choices[0].message.content or "").strip()
+
+    async def _open_stream(self, prompt, timeout, generation=None):
+        return await self.client.chat.completions.create(
+            model=self.model, messages=self._messages(prompt), stream=True, timeout=timeout, **self._options(generation)
+        )
+
+    def _chunk_text(self, chunk):
+        if not chunk.choices:
+            return None
+        return chunk.choices[0].delta.content
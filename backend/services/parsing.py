@@ -0,0 +1,127 @@
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Patterns are compiled once at import instead of being looked up in the
+# re module cache on every call
+_ASTERISK_BULLET = re.compile(r'^\s*\*\s+', re.MULTILINE)
+_BOLD_VARIANT_LABEL = re.compile(r'\*\*Variant (\d+):\*\*')
+_VARIANT_LABEL_SPACING = re.compile(r'(Variant \d+:)(\S)')
+_SINGLE_ASTERISK = re.compile(r'(?<!\*)\*(?!\*)')
+_DOUBLE_ASTERISK = re.compile(r'\*\*(.*?)\*\*')
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+_PROMPT_LINE = re.compile(r"^(?:[-*]\s*)?(.*\S.*)$", re.MULTILINE)
+
+# "Variant N:" header anywhere, and the same header at the start of a line,
+# which is what ends the previous variant
+_VARIANT_HEADER = re.compile(r"(?:\*\*)?Variant (\d+)(?:\*\*)?:")
+_VARIANT_BOUNDARY = re.compile(r"\n(?:\*\*)?Variant \d+(?:\*\*)?:")
+
+
+def clean_markdown_text(text):
+    """Normalise model markdown to plain text with dash bullets.
+
+    Every step only applies when the text can contain a match, so the
+    common case (no asterisks) is a single substitution or none at all.
+    """
+    if "*" in text:
+        # Replace asterisk bullet points with dashes
+        text = _ASTERISK_BULLET.sub('- ', text)
+
+        # Clean up variant headers (remove asterisks from variant labels)
+        if "**Variant" in text:
+            text = _BOLD_VARIANT_LABEL.sub('Variant \\1:', text)
+
+    # Ensure consistent spacing after variant label
+    if "Variant" in text:
+        text = _VARIANT_LABEL_SPACING.sub('\\1 \\2', text)
+
+    if "*" in text:
+        # Remove any remaining standalone asterisks
+        text = _SINGLE_ASTERISK.sub('', text)
+
+        # Remove double asterisks (bold markdown)
+        if "**" in text:
+            text = _DOUBLE_ASTERISK.sub('\\1', text)
+
+    return text
+
+
+def split_variants(text):
+    """Return (number, content) pairs for each 'Variant N:' block in text.
+
+    Equivalent to re.findall over
+    (?:\\*\\*)?Variant (\\d+)(?:\\*\\*)?:(.+?)(?=(?:\\n(?:\\*\\*)?Variant \\d+(?:\\*\\*)?:|$))
+    with DOTALL, but jumps between headers with two anchored searches
+    instead of testing the lookahead at every character.
+    """
+    variants = []
+    length = len(text)
+    position = 0
+    while True:
+        header = _VARIANT_HEADER.search(text, position)
+        if header is None:
+            break
+        start = header.end()
+        # The variant body is at least one character long
+        boundary = _VARIANT_BOUNDARY.search(text, start + 1)
+        if boundary is not None:
+            end = boundary.start()
+        elif start < length:
+            end = length
+            # A trailing newline is not part of the final variant ($ semantics)
+            if text.endswith("\n") and end - 1 > start:
+                end -= 1
+        else:
+            break
+        variants.append((header.group(1), text[start:end]))
+        position = end
+    return variants
+
+
+def parse_prompt_lines(text):
+    """Extract one prompt per line for the basic/quick modes"""
+    lines = _PROMPT_LINE.findall(text)
+    return [l.strip() for l in lines if l.strip() and not l.lower().startswith("prompt")]
+
+
+def parse_variants(text):
+    """Split `deep` mode output into cleaned variants"""
+    variants = split_variants(text)
+    if not variants:
+        # If no variants found, return the cleaned text
+        return [clean_markdown_text(text)]
+
+    # Clean each variant and format properly
+    cleaned_variants = [
+        clean_markdown_text(f"Variant {variant_num}:{variant_content}")
+        for variant_num, variant_content in variants
+        if variant_content.strip()
+    ]
+    return cleaned_variants if cleaned_variants else [clean_markdown_text(text)]
+
+
+def strip_code_fence(text):
+    """Text without the ```json fence models like to wrap structured answers in"""
+    return _CODE_FENCE.sub("", text.strip())
+
+def parse_response(text, mode, return_format):
+    """Turn raw model output into the list (or JSON object) returned to clients"""
+    if return_format == "json":
+        try:
+            # Try to parse as JSON object or array
+            return json.loads(text)
+        except Exception as e:
+            logger.debug("JSON parsing error: %s", e)
+            # Fallback: return as single string
+            return [text]
+    if mode in ("basic", "quick"):
+        return parse_prompt_lines(text)
+    if mode == "deep":
+        return parse_variants(text)
+    # For few-shot and cot, clean and return the full text
+    return [clean_markdown_text(text)]
@@ -0,0 +1,327 @@
+import os
+import gc
+import sys
+import time
+import random
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from services.metrics import EVENT_LOOP_LAG, EVENT_LOOP_LAG_MAX, EVENT_LOOP_BLOCKED, GC_PAUSE
+
+logger = logging.getLogger(__name__)
+
+# Every worker measures how late its event loop wakes up, every
+# LOOP_MONITOR_INTERVAL seconds; a watchdog thread logs the stack of any
+# step that holds the loop for longer than LOOP_BLOCK_THRESHOLD seconds
+# (0 disables the watchdog)
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "1").lower() not in ("0", "false", "no")
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", 0.05))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", 0.1))
+# Window over which the worst lag is reported as a gauge
+LOOP_LAG_WINDOW = 10
+
+# Fraction of requests whose event-loop stacks are sampled every
+# PROFILE_INTERVAL seconds; 0 samples none until changed at runtime
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+# Distinct stacks kept per profile; further ones are counted under "[other]"
+PROFILE_MAX_STACKS = 20000
+PROFILE_MAX_SECONDS = 60
+
+RECENT_BLOCKS = 50
+
+# Requests being served by this worker: asyncio task -> [ASGI scope, sampled]
+_requests = {}
+
+
+def _request_label(task):
+    """"METHOD /route" of the request a task serves, or None for background work"""
+    entry = _requests.get(task) if task is not None else None
+    if entry is None:
+        return None
+    scope = entry[0]
+    route = getattr(scope.get("route"), "path", None) or scope["path"]
+    return f"{scope['method']} {route}"
+
+
+def _current_task(loop):
+    """The task the loop is running right now (safe to call from another thread)"""
+    try:
+        return asyncio.current_task(loop)
+    except RuntimeError:
+        return None
+
+
+def fold_stack(frame):
+    """A frame's stack as one "root;...;leaf" line of function (file:line) names, flamegraph style"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def render_folded(stacks):
+    """Collapsed-stack text (one "stack count" per line) for flamegraph.pl, speedscope or inferno"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class LoopMonitor:
+    """Event-loop lag monitor and blocking watchdog for one worker.
+
+    A task sleeps for `interval` seconds at a time and records how late it
+    woke up (the time every other coroutine waited too). A daemon thread
+    checks that task's heartbeat; when the loop has not come back for
+    `threshold` seconds it logs the stack of the code holding the loop,
+    with the route of the request it belongs to.
+    """
+
+    def __init__(self, interval=LOOP_MONITOR_INTERVAL, threshold=LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.loop = None
+        self.thread_id = None
+        self.heartbeat = time.monotonic()
+        self.lag = 0.0
+        self.window_max = 0.0
+        self.window_started = time.monotonic()
+        self.blocked = 0
+        self.recent = deque(maxlen=RECENT_BLOCKS)
+        self._task = None
+        self._pid = None
+        self._reported = None  # heartbeat of the block already logged
+        self._gc_started = None
+
+    def start(self):
+        """Start monitoring the running loop (once per worker process)"""
+        if self._pid == os.getpid() and self._task is not None and not self._task.done():
+            return
+        self._pid = os.getpid()
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._task = self.loop.create_task(self._run())
+        if self._gc_callback not in gc.callbacks:
+            gc.callbacks.append(self._gc_callback)
+        if self.threshold > 0:
+            threading.Thread(target=self._watch, args=(self._task,), name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.heartbeat = now
+            self.lag = max(0.0, now - expected)
+            EVENT_LOOP_LAG.observe(self.lag)
+            if self.lag > self.threshold > 0 and self.recent and self.recent[-1]["duration"] is None:
+                # The step the watchdog caught has finished: record how long it took
+                self.recent[-1]["duration"] = round(self.lag, 4)
+            if now - self.window_started >= LOOP_LAG_WINDOW:
+                self.window_max, self.window_started = self.lag, now
+            else:
+                self.window_max = max(self.window_max, self.lag)
+            EVENT_LOOP_LAG_MAX.set(self.window_max, worker=self._pid)
+
+    def _watch(self, task):
+        while not task.done():
+            time.sleep(self.threshold / 2)
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled > self.threshold and heartbeat != self._reported:
+                self._reported = heartbeat
+                self._report(stalled)
+
+    def _report(self, stalled):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        route = _request_label(_current_task(self.loop)) or "background"
+        in_gc = self._gc_started is not None
+        self.blocked += 1
+        EVENT_LOOP_BLOCKED.inc(route=route)
+        self.recent.append({
+            "at": time.time(),
+            "route": route,
+            "blocked_for": round(stalled, 4),
+            "duration": None,
+            "gc": in_gc,
+            "stack": stack,
+        })
+        logger.warning(
+            "Event loop blocked for %.3fs so far in %s%s; stack:\n%s",
+            stalled, route, " (during garbage collection)" if in_gc else "", stack,
+        )
+
+    def _gc_callback(self, phase, info):
+        if phase == "start":
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            GC_PAUSE.observe(time.perf_counter() - self._gc_started, generation=info.get("generation", "-"))
+            self._gc_started = None
+
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "running": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            "block_threshold": self.threshold,
+            "lag": round(self.lag, 4),
+            "max_lag": round(self.window_max, 4),
+            "blocked": self.blocked,
+            "gc_collections": [generation["collections"] for generation in gc.get_stats()],
+        }
+
+
+class SamplingProfiler:
+    """Statistical profiler of the event-loop thread.
+
+    A daemon thread reads the loop thread's current stack every `interval`
+    seconds, but only while a sampled request is in flight or a capture is
+    running, so it costs nothing otherwise. Requests are picked with
+    probability `sample_rate` when they start; their samples are counted
+    per "METHOD /route;stack" line. A capture records every sample for a
+    number of seconds, including idle time and background work.
+    """
+
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, interval=PROFILE_INTERVAL):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.loop = None
+        self.thread_id = None
+        self.sampled_active = 0
+        self.sampled_requests = 0
+        self.samples = 0
+        self._stacks = Counter()  # samples of sampled requests
+        self._capture = None  # Counter while a capture is running
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample_loop, name="loop-profiler", daemon=True)
+        self._thread.start()
+
+    def should_sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def request_started(self, sampled):
+        if sampled:
+            self._ensure_thread()
+            self.sampled_active += 1
+            self.sampled_requests += 1
+            self._wake.set()
+
+    def request_finished(self, sampled):
+        if sampled:
+            self.sampled_active -= 1
+
+    def _sample_loop(self):
+        while True:
+            self._wake.wait()
+            while self.sampled_active > 0 or self._capture is not None:
+                time.sleep(self.interval)
+                self._sample()
+            self._wake.clear()
+            # A request may have started between the check and the clear
+            if self.sampled_active > 0 or self._capture is not None:
+                self._wake.set()
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        task = _current_task(self.loop)
+        label = _request_label(task)
+        stack = fold_stack(frame) if frame is not None else ""
+        with self._lock:
+            self.samples += 1
+            if self._capture is not None:
+                prefix = label or ("idle" if task is None else "background")
+                self._add(self._capture, f"{prefix};{stack}")
+            entry = _requests.get(task) if task is not None else None
+            if entry is not None and entry[1]:
+                self._add(self._stacks, f"{label};{stack}")
+
+    @staticmethod
+    def _add(stacks, line):
+        if line in stacks or len(stacks) < PROFILE_MAX_STACKS:
+            stacks[line] += 1
+        else:
+            stacks["[other]"] += 1
+
+    async def capture(self, seconds):
+        """Sample everything the loop does for `seconds`; returns the stack counts"""
+        if self._capture is not None:
+            raise RuntimeError("A profile capture is already running in this worker")
+        self._ensure_thread()
+        with self._lock:
+            self._capture = Counter()
+        self._wake.set()
+        try:
+            await asyncio.sleep(min(max(seconds, 0), PROFILE_MAX_SECONDS))
+        finally:
+            with self._lock:
+                stacks, self._capture = self._capture, None
+        return stacks
+
+    def request_stacks(self, reset=False):
+        """Stack counts of the sampled requests so far"""
+        with self._lock:
+            stacks = Counter(self._stacks)
+            if reset:
+                self._stacks.clear()
+        return stacks
+
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "sample_rate": self.sample_rate,
+            "interval": self.interval,
+            "sampled_requests": self.sampled_requests,
+            "sampled_in_flight": self.sampled_active,
+            "samples": self.samples,
+            "distinct_stacks": len(self._stacks),
+            "capturing": self._capture is not None,
+        }
+
+
+class ProfilingMiddleware:
+    """Tracks which task serves which request, and starts sampling the requests picked for it"""
+
+    def __init__(self, app, profiler, skip_paths=()):
+        self.app = app
+        self.profiler = profiler
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        task = asyncio.current_task()
+        sampled = self.profiler.should_sample()
+        _requests[task] = [scope, sampled]
+        self.profiler.request_started(sampled)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.request_finished(sampled)
+            _requests.pop(task, None)
+
+
+loop_monitor = LoopMonitor() if LOOP_MONITOR else None
+profiler = SamplingProfiler()
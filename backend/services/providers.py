@@ -0,0 +1,357 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from services.admission import AdmissionController, Overloaded, UpstreamUnavailable
+from services.resilience import ResilientCaller, CircuitOpen, is_transient
+from services.tokens import report_usage
+from services.metrics import (
+    STAGE_LATENCY,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_TIMEOUTS,
+    UPSTREAM_ERRORS,
+    PROVIDER_REQUESTS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Providers are ranked by their latency EWMA, inflated by their recent error
+# rate (x (1 + PROVIDER_ERROR_PENALTY * error rate)). A small share of calls
+# goes to the runner-up so its numbers stay current.
+PROVIDER_EWMA_ALPHA = 0.2
+PROVIDER_ERROR_PENALTY = float(os.getenv("PROVIDER_ERROR_PENALTY", 5))
+PROVIDER_EXPLORE_RATE = float(os.getenv("PROVIDER_EXPLORE_RATE", 0.05))
+
+
+def should_fail_over(exc):
+    """Errors another provider might not have: shedding, open circuits and transient failures"""
+    return isinstance(exc, Overloaded) or is_transient(exc)
+
+
+class Provider:
+    """One upstream model behind a common async interface.
+
+    Subclasses implement `_complete(prompt, timeout, generation)` returning
+    the response text, and `_open_stream(prompt, timeout, generation)` /
+    `_chunk_text(chunk)` for streaming. `generation` is None or a dict of
+    per-call overrides of the sampling settings, in Gemini's names
+    (temperature, top_p, top_k, max_output_tokens). Each provider gets its own admission controller and
+    retry/hedging/circuit-breaker layer, and keeps the latency and error
+    EWMAs the router ranks it by.
+
+    SDK imports and client setup belong in `_prepare()`, which runs once per
+    process in a worker thread (started by `warm()` at app startup, or by the
+    first call), so importing the app stays fast. `_translate(exc)` maps SDK
+    errors onto UpstreamUnavailable where retries and failover should apply.
+    """
+
+    name = "base"
+
+    def __init__(self, name=None):
+        if name:
+            self.name = name
+        self.admission = AdmissionController(self.name)
+        self.resilience = ResilientCaller(self.name)
+        self.latency_ewma = None
+        self.error_ewma = 0.0
+        self._prepared_pid = None
+        self._prepare_task = None
+        self._prepare_lock = threading.Lock()
+
+    def _prepare(self):
+        """Import the SDK and create the client (blocking, runs off the event loop)"""
+
+    def _translate(self, exc):
+        return exc
+
+    def _prepare_once(self):
+        with self._prepare_lock:
+            if self._prepared_pid != os.getpid():
+                self._prepare()
+                self._prepared_pid = os.getpid()
+
+    def warm(self):
+        """Start preparing the provider in the background; safe to call repeatedly"""
+        if self._prepared_pid == os.getpid():
+            return None
+        loop = asyncio.get_running_loop()
+        task = self._prepare_task
+        # A failed attempt is retried; one from before a fork belongs to another loop
+        if task is None or task.get_loop() is not loop or (task.done() and self._prepare_failed(task)):
+            task = loop.run_in_executor(None, self._prepare_once)
+            task.add_done_callback(self._log_prepare_failure)
+            self._prepare_task = task
+        return task
+
+    @staticmethod
+    def _prepare_failed(task):
+        return task.cancelled() or task.exception() is not None
+
+    def _log_prepare_failure(self, task):
+        if self._prepare_failed(task):
+            logger.error("Preparing provider '%s' failed: %r", self.name, None if task.cancelled() else task.exception())
+
+    async def ready(self):
+        """Wait until the provider is prepared"""
+        task = self.warm()
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def _complete(self, prompt, timeout, generation=None):
+        raise NotImplementedError
+
+    async def _open_stream(self, prompt, timeout, generation=None):
+        raise NotImplementedError
+
+    def _chunk_text(self, chunk):
+        raise NotImplementedError
+
+    def available(self):
+        return not self.resilience.breaker.is_open()
+
+    def score(self):
+        """Lower is better; providers without data yet rank first"""
+        if self.latency_ewma is None:
+            return 0.0
+        return self.latency_ewma * (1 + PROVIDER_ERROR_PENALTY * self.error_ewma)
+
+    def record(self, latency, ok):
+        self.error_ewma += PROVIDER_EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_ewma)
+        if latency is not None:
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma += PROVIDER_EWMA_ALPHA * (latency - self.latency_ewma)
+        PROVIDER_REQUESTS.inc(provider=self.name, outcome="ok" if ok else "error")
+
+    async def complete(self, prompt, deadline, route="-", mode="-", generation=None):
+        """Return the response text for prompt, with retries and hedging, before deadline"""
+        async def attempt(attempt_deadline, hedge):
+            queued_at = time.monotonic()
+            # A hedged request only goes out if a slot is free right away
+            async with self.admission.slot(attempt_deadline, wait=not hedge):
+                STAGE_LATENCY.observe(time.monotonic() - queued_at, route=route, mode=mode, stage="queue")
+                with UPSTREAM_IN_FLIGHT.track_inprogress(provider=self.name, route=route), \
+                        STAGE_LATENCY.time(route=route, mode=mode, stage="upstream"):
+                    try:
+                        return await self._complete(prompt, max(0, attempt_deadline - time.monotonic()), generation)
+                    except asyncio.TimeoutError:
+                        UPSTREAM_TIMEOUTS.inc(provider=self.name, route=route)
+                        raise
+                    except Exception as e:
+                        UPSTREAM_ERRORS.inc(provider=self.name, route=route)
+                        translated = self._translate(e)
+                        if translated is e:
+                            raise
+                        raise translated from e
+
+        await self.ready()
+        started = time.monotonic()
+        try:
+            text = await self.resilience.call(attempt, deadline, route=route)
+        except CircuitOpen:
+            raise
+        except Exception:
+            self.record(None, ok=False)
+            raise
+        self.record(time.monotonic() - started, ok=True)
+        return text
+
+    async def stream(self, prompt, deadline, route="-", mode="-", generation=None):
+        """Yield response text chunks for prompt as they are generated, before deadline"""
+        async def attempt(attempt_deadline):
+            queued_at = time.monotonic()
+            async with self.admission.slot(attempt_deadline):
+                STAGE_LATENCY.observe(time.monotonic() - queued_at, route=route, mode=mode, stage="queue")
+                with UPSTREAM_IN_FLIGHT.track_inprogress(provider=self.name, route=route), \
+                        STAGE_LATENCY.time(route=route, mode=mode, stage="upstream"):
+                    try:
+                        response = await asyncio.wait_for(
+                            self._open_stream(prompt, max(0, attempt_deadline - time.monotonic()), generation),
+                            timeout=max(0, attempt_deadline - time.monotonic())
+                        )
+                        chunks = response.__aiter__()
+                        while True:
+                            remaining = attempt_deadline - time.monotonic()
+                            if remaining <= 0:
+                                raise asyncio.TimeoutError()
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+                            except StopAsyncIteration:
+                                return
+                            text = self._chunk_text(chunk)
+                            if text:
+                                yield text
+                    except asyncio.TimeoutError:
+                        UPSTREAM_TIMEOUTS.inc(provider=self.name, route=route)
+                        raise
+                    except Exception as e:
+                        UPSTREAM_ERRORS.inc(provider=self.name, route=route)
+                        translated = self._translate(e)
+                        if translated is e:
+                            raise
+                        raise translated from e
+
+        await self.ready()
+        try:
+            async for text in self.resilience.stream(attempt, deadline, route=route):
+                yield text
+        except CircuitOpen:
+            raise
+        except Exception:
+            self.record(None, ok=False)
+            raise
+        # Whole-stream durations are not comparable with single calls, so
+        # streams only feed the error rate
+        self.record(None, ok=True)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "error_ewma": round(self.error_ewma, 3),
+            "admission": self.admission.stats(),
+            "resilience": self.resilience.stats(),
+        }
+
+
+# google.api_core error types worth retrying or failing over on: rate
+# limiting, upstream 5xx and server-side timeouts
+_GOOGLE_TRANSIENT_ERROR_NAMES = (
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "GatewayTimeout",
+    "DeadlineExceeded",
+    "Aborted",
+)
+
+
+class GeminiProvider(Provider):
+    """google-generativeai GenerativeModel, or the offline FakeGenerativeModel.
+
+    Given `model`, that object is used as is; otherwise the SDK is imported
+    and a GenerativeModel for `model_name` is created in `_prepare()`.
+    """
+
+    name = "gemini"
+
+    def __init__(self, model=None, name=None, api_key=None, model_name=None, generation_config=None):
+        super().__init__(name)
+        self.model = model
+        self._api_key = api_key
+        self._model_name = model_name
+        self._generation_config = generation_config
+
+    def _prepare(self):
+        if self.model is not None:
+            return
+        import google.generativeai as genai
+        genai.configure(api_key=self._api_key)
+        self.model = genai.GenerativeModel(self._model_name, generation_config=self._generation_config)
+
+    def _translate(self, exc):
+        # Matched by name, so google.api_core is only imported with the SDK
+        if type(exc).__name__ in _GOOGLE_TRANSIENT_ERROR_NAMES:
+            return UpstreamUnavailable(f"{type(exc).__name__}: {exc}")
+        return exc
+
+    def _options(self, generation):
+        # Merged over the model's generation_config by the SDK
+        return {"generation_config": generation} if generation else {}
+
+    async def _complete(self, prompt, timeout, generation=None):
+        # Create a task for the API call and wait for it within the budget
+        api_task = asyncio.create_task(self.model.generate_content_async(prompt, **self._options(generation)))
+        response = await asyncio.wait_for(api_task, timeout=timeout)
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            report_usage(usage.prompt_token_count, usage.candidates_token_count)
+        return response.text.strip()
+
+    async def _open_stream(self, prompt, timeout, generation=None):
+        return await self.model.generate_content_async(prompt, stream=True, **self._options(generation))
+
+    def _chunk_text(self, chunk):
+        return chunk.text
+
+
+class ProviderRouter:
+    """Pick a provider per call from live latency/error data and fail over on errors.
+
+    Failover happens when a provider sheds the call, has its circuit open,
+    or still fails transiently after its own retries, for as long as the
+    deadline allows. Streams only fail over before their first chunk.
+    """
+
+    def __init__(self, providers, explore_rate=PROVIDER_EXPLORE_RATE):
+        self.providers = list(providers)
+        self.explore_rate = explore_rate
+        self.failovers = 0
+
+    def __bool__(self):
+        return bool(self.providers)
+
+    def __len__(self):
+        return len(self.providers)
+
+    def warm(self):
+        """Start preparing every provider in the background (call from the running event loop)"""
+        for provider in self.providers:
+            provider.warm()
+
+    def available(self):
+        """Whether any provider can be called right now (not every circuit is open)"""
+        return any(p.available() for p in self.providers)
+
+    def ranked(self):
+        available = sorted((p for p in self.providers if p.available()), key=lambda p: p.score())
+        if len(available) > 1 and random.random() < self.explore_rate:
+            available[0], available[1] = available[1], available[0]
+        # Providers with an open circuit go last; they fail fast if reached
+        return available + [p for p in self.providers if not p.available()]
+
+    def _fail_over(self, provider, exc):
+        self.failovers += 1
+        logger.warning("Provider '%s' failed (%s), failing over", provider.name, type(exc).__name__)
+
+    async def complete(self, prompt, deadline, route="-", mode="-", generation=None):
+        last_error = None
+        for provider in self.ranked():
+            if last_error is not None and time.monotonic() >= deadline:
+                break
+            try:
+                return await provider.complete(prompt, deadline, route=route, mode=mode, generation=generation)
+            except Exception as e:
+                if not should_fail_over(e):
+                    raise
+                last_error = e
+                self._fail_over(provider, e)
+        raise last_error or RuntimeError("No model provider configured")
+
+    async def stream(self, prompt, deadline, route="-", mode="-", generation=None):
+        last_error = None
+        for provider in self.ranked():
+            if last_error is not None and time.monotonic() >= deadline:
+                break
+            started = False
+            try:
+                async for text in provider.stream(prompt, deadline, route=route, mode=mode, generation=generation):
+                    started = True
+                    yield text
+                return
+            except Exception as e:
+                if started or not should_fail_over(e):
+                    raise
+                last_error = e
+                self._fail_over(provider, e)
+        raise last_error or RuntimeError("No model provider configured")
+
+    def stats(self):
+        return {
+            "order": [p.name for p in sorted(self.providers, key=lambda p: (not p.available(), p.score()))],
+            "failovers": self.failovers,
+            "providers": {p.name: p.stats() for p in self.providers},
+        }
@@ -0,0 +1,236 @@
+import os
+import math
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from services.cache_backends import CACHE_SQLITE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Default limit applied to every rate-limited route
+RATE_LIMIT = int(os.getenv("RATE_LIMIT", 50))
+RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", 60))
+
+# Per-route overrides as "path=limit/window" pairs, e.g. "/refine/batch=5/60,/explain=30/60"
+RATE_LIMIT_ROUTES = os.getenv("RATE_LIMIT_ROUTES", "/refine/batch=10/60")
+
+# Known API keys and their limits as "key=limit/window" pairs. Requests
+# carrying one of these in X-API-Key are limited per key instead of per IP;
+# unknown keys are ignored so they cannot be used to dodge the IP limit.
+RATE_LIMIT_API_KEYS = os.getenv("RATE_LIMIT_API_KEYS", "")
+
+# "memory" keeps counters per worker; "sqlite" shares them across workers on the node
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", CACHE_SQLITE_PATH)
+
+# How often idle keys are evicted, in seconds
+RATE_LIMIT_SWEEP_INTERVAL = 60
+
+RateLimit = namedtuple("RateLimit", ["limit", "window"])
+RateLimitResult = namedtuple("RateLimitResult", ["limited", "limit", "remaining", "reset", "retry_after"])
+
+
+def parse_limits(spec):
+    """Parse "name=limit/window,..." into {name: RateLimit}"""
+    limits = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            name, rule = part.rsplit("=", 1)
+            limit, window = rule.split("/")
+            limits[name.strip()] = RateLimit(int(limit), int(window))
+        except ValueError:
+            logger.warning("Ignoring malformed rate limit '%s'", part)
+    return limits
+
+
+def sliding_window(state, limit, window, now):
+    """Apply one request to a sliding-window counter.
+
+    `state` is [window_start, previous_count, current_count]. The request
+    rate is estimated as the current window's count plus the previous
+    window's count weighted by how much of it still overlaps the sliding
+    window, which needs constant space per key. Returns the updated state
+    and the RateLimitResult.
+    """
+    window_start, previous, current = state
+    elapsed_windows = int((now - window_start) // window)
+    if elapsed_windows >= 1:
+        previous = current if elapsed_windows == 1 else 0
+        current = 0
+        window_start += elapsed_windows * window
+
+    elapsed = now - window_start
+    weight = 1 - elapsed / window
+    estimate = previous * weight + current
+    reset = max(1, math.ceil(window - elapsed))
+
+    if estimate + 1 > limit:
+        # Time until enough of the previous window has slid out of view
+        if current + 1 > limit:
+            retry_after = (window - elapsed) + max(0, window * (1 - (limit - 1) / max(current, 1)))
+        else:
+            retry_after = window * (1 - (limit - current - 1) / previous) - elapsed
+        retry_after = max(1, math.ceil(retry_after))
+        result = RateLimitResult(True, limit, 0, reset, retry_after)
+    else:
+        current += 1
+        remaining = max(0, int(limit - (estimate + 1)))
+        result = RateLimitResult(False, limit, remaining, reset, 0)
+
+    return [window_start, previous, current], result
+
+
+class RateLimiter:
+    """Sliding-window-counter rate limiter with O(1) state per key.
+
+    Keys that have been idle for two full windows carry no information and
+    are evicted by a periodic sweep, so memory tracks active clients rather
+    than every client ever seen.
+    """
+
+    def __init__(self, rate_limit=RATE_LIMIT, time_window=RATE_LIMIT_WINDOW):
+        self.default = RateLimit(rate_limit, time_window)
+        self.routes = parse_limits(RATE_LIMIT_ROUTES)
+        self.api_keys = parse_limits(RATE_LIMIT_API_KEYS)
+        self.rejections = 0
+
+    def policy_for(self, path, api_key=None):
+        """Return (bucket prefix, RateLimit) for a request"""
+        if api_key and api_key in self.api_keys:
+            return f"key:{api_key}", self.api_keys[api_key]
+        # Longest matching route prefix wins
+        for route in sorted(self.routes, key=len, reverse=True):
+            if path == route or path.startswith(route.rstrip("/") + "/"):
+                return f"route:{route}", self.routes[route]
+        return "default", self.default
+
+    async def check(self, client_ip, path, api_key=None):
+        prefix, rule = self.policy_for(path, api_key)
+        key = prefix if prefix.startswith("key:") else f"{prefix}:{client_ip}"
+        result = await self.hit(key, rule.limit, rule.window)
+        if result.limited:
+            self.rejections += 1
+        return result
+
+    async def hit(self, key, limit, window):
+        raise NotImplementedError
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Rate limiter with counters kept in this worker's memory"""
+
+    def __init__(self, rate_limit=RATE_LIMIT, time_window=RATE_LIMIT_WINDOW):
+        super().__init__(rate_limit, time_window)
+        self.buckets = {}  # key -> [window_start, previous_count, current_count, window]
+        self._last_sweep = time.time()
+
+    async def hit(self, key, limit, window):
+        now = time.time()
+        if now - self._last_sweep >= RATE_LIMIT_SWEEP_INTERVAL:
+            self.evict_idle(now)
+
+        bucket = self.buckets.get(key)
+        state = bucket[:3] if bucket else [now - now % window, 0, 0]
+        state, result = sliding_window(state, limit, window, now)
+        self.buckets[key] = state + [window]
+        return result
+
+    def evict_idle(self, now=None):
+        """Drop keys with no requests in the last two windows"""
+        now = now or time.time()
+        idle = [key for key, bucket in self.buckets.items() if now - bucket[0] >= 2 * bucket[3]]
+        for key in idle:
+            del self.buckets[key]
+        self._last_sweep = now
+        return len(idle)
+
+
+class SQLiteRateLimiter(RateLimiter):
+    """Rate limiter with counters in a SQLite file shared by all workers on a node"""
+
+    def __init__(self, rate_limit=RATE_LIMIT, time_window=RATE_LIMIT_WINDOW, path=RATE_LIMIT_SQLITE_PATH):
+        super().__init__(rate_limit, time_window)
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._last_sweep = time.time()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits ("
+                " key TEXT PRIMARY KEY,"
+                " window_start REAL NOT NULL,"
+                " previous INTEGER NOT NULL,"
+                " current INTEGER NOT NULL,"
+                " window INTEGER NOT NULL)"
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _hit_sync(self, key, limit, window):
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            # BEGIN IMMEDIATE serialises the read-modify-write across workers
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT window_start, previous, current FROM rate_limits WHERE key = ?", (key,)
+                ).fetchone()
+                state = list(row) if row else [now - now % window, 0, 0]
+                state, result = sliding_window(state, limit, window, now)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, window_start, previous, current, window) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, state[0], state[1], state[2], window),
+                )
+                if now - self._last_sweep >= RATE_LIMIT_SWEEP_INTERVAL:
+                    conn.execute("DELETE FROM rate_limits WHERE ? - window_start >= 2 * window", (now,))
+                    self._last_sweep = now
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return result
+
+    async def hit(self, key, limit, window):
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-limit")
+            self._executor_pid = os.getpid()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._hit_sync, key, limit, window)
+
+
+def create_rate_limiter(backend=None):
+    backend = (backend or RATE_LIMIT_BACKEND).lower()
+    if backend == "sqlite":
+        return SQLiteRateLimiter()
+    if backend != "memory":
+        logger.warning("Unknown RATE_LIMIT_BACKEND '%s', falling back to memory", backend)
+    return MemoryRateLimiter()
+
+
+def rate_limit_headers(result):
+    """Standard X-RateLimit-* headers (plus Retry-After when limited)"""
+    headers = {
+        "X-RateLimit-Limit": str(result.limit),
+        "X-RateLimit-Remaining": str(result.remaining),
+        "X-RateLimit-Reset": str(result.reset),
+    }
+    if result.limited:
+        headers["Retry-After"] = str(result.retry_after)
+    return headers
@@ -0,0 +1,321 @@
+import os
+import math
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from services.admission import Overloaded, UpstreamUnavailable
+from services.metrics import UPSTREAM_RETRIES, UPSTREAM_HEDGES, CIRCUIT_STATE
+
+logger = logging.getLogger(__name__)
+
+# Retries: at most UPSTREAM_MAX_ATTEMPTS tries per request, separated by
+# full-jitter exponential backoff, and only while the request's deadline
+# leaves room for another typical call. By default a try may use all of
+# the request's remaining deadline (MAX_API_TIMEOUT), since deep and
+# few-shot answers can legitimately take most of it. With
+# UPSTREAM_ATTEMPT_TIMEOUT set, a try is cut off (and retried) after that
+# many seconds, or UPSTREAM_ATTEMPT_P99_MULTIPLE times the observed p99
+# latency if that is longer, so a slow-but-healthy upstream is never cut
+# off below its own normal tail
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", 3))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", 0.25))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", 4.0))
+UPSTREAM_ATTEMPT_TIMEOUT = float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT", 0))
+UPSTREAM_ATTEMPT_P99_MULTIPLE = 3
+
+# Hedging: when a call runs past the observed p95 latency, a second
+# identical call is started if an upstream slot is free; first answer wins
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "1").lower() not in ("0", "false", "no")
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", 0.95))
+UPSTREAM_HEDGE_MIN_SAMPLES = 20
+
+# Circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive transient
+# failures calls fail fast for CIRCUIT_COOLDOWN seconds, then one probe call
+# decides whether to close the circuit again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", 30))
+
+# Failures worth retrying: rate limiting, upstream 5xx, timeouts and dropped
+# connections (providers report the SDK-specific ones as UpstreamUnavailable)
+TRANSIENT_ERRORS = (asyncio.TimeoutError, ConnectionError, UpstreamUnavailable)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def is_transient(exc):
+    return isinstance(exc, TRANSIENT_ERRORS) and not isinstance(exc, Overloaded)
+
+
+def backoff_delay(attempt, base=UPSTREAM_BACKOFF_BASE, cap=UPSTREAM_BACKOFF_MAX):
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitOpen(Overloaded):
+    """Raised instead of calling an upstream that is currently failing"""
+
+
+class LatencyTracker:
+    """Recent upstream latencies, for hedging and retry budgeting"""
+
+    def __init__(self, size=256):
+        self._samples = deque(maxlen=size)
+        self._sorted = None
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, latency):
+        self._samples.append(latency)
+        self._sorted = None
+
+    def percentile(self, fraction):
+        if not self._samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        index = min(len(self._sorted) - 1, int(fraction * len(self._sorted)))
+        return self._sorted[index]
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open probe after a cooldown"""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+        CIRCUIT_STATE.set(0, circuit=name)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning("Circuit '%s' %s -> %s", self.name, self.state, state)
+            self.state = state
+            CIRCUIT_STATE.set(_STATE_VALUES[state], circuit=self.name)
+
+    def retry_after(self):
+        return max(1, math.ceil(self.opened_at + self.cooldown - time.monotonic()))
+
+    def is_open(self):
+        return self.state == OPEN and time.monotonic() < self.opened_at + self.cooldown
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go upstream now"""
+        if self.state == CLOSED:
+            return
+        if self.state == OPEN and time.monotonic() >= self.opened_at + self.cooldown:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpen(f"circuit_{self.state}", self.retry_after())
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._probing = False
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def record_abandoned(self):
+        # A probe that was cancelled or failed for a non-upstream reason
+        self._probing = False
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+class ResilientCaller:
+    """Retry, hedging and circuit breaking around one upstream.
+
+    `call(attempt, deadline, route)` runs `attempt(attempt_deadline, hedge)`,
+    a coroutine function making one upstream call, until it succeeds, fails
+    with a non-transient error, runs out of attempts or of deadline budget,
+    or the circuit is open.
+    """
+
+    def __init__(
+        self,
+        name,
+        max_attempts=UPSTREAM_MAX_ATTEMPTS,
+        attempt_timeout=UPSTREAM_ATTEMPT_TIMEOUT,
+        hedge=UPSTREAM_HEDGE,
+        hedge_percentile=UPSTREAM_HEDGE_PERCENTILE,
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.attempt_timeout = attempt_timeout
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.breaker = CircuitBreaker(name)
+        self.latency = LatencyTracker()
+
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def attempt_cap(self):
+        """Longest a single try may run, or None to let it use the whole remaining deadline"""
+        if not self.attempt_timeout:
+            return None
+        p99 = self.latency.percentile(0.99) if len(self.latency) >= UPSTREAM_HEDGE_MIN_SAMPLES else None
+        return max(self.attempt_timeout, UPSTREAM_ATTEMPT_P99_MULTIPLE * p99) if p99 else self.attempt_timeout
+
+    async def _attempt(self, attempt, deadline, hedge):
+        """One tracked upstream call; feeds the breaker and latency window"""
+        self.breaker.before_call()
+        started = time.monotonic()
+        cap = self.attempt_cap()
+        attempt_deadline = deadline if cap is None else min(deadline, started + cap)
+        try:
+            result = await attempt(attempt_deadline, hedge)
+        except Overloaded:
+            # Not admitted, so the upstream was never asked
+            self.breaker.record_abandoned()
+            raise
+        except asyncio.CancelledError:
+            self.breaker.record_abandoned()
+            raise
+        except Exception as e:
+            if is_transient(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_abandoned()
+            raise
+        self.latency.add(time.monotonic() - started)
+        self.breaker.record_success()
+        return result
+
+    def hedge_delay(self):
+        if not self.hedge or len(self.latency) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    async def _hedged(self, attempt, deadline, route):
+        primary = asyncio.ensure_future(self._attempt(attempt, deadline, False))
+        delay = self.hedge_delay()
+        tasks = [primary]
+        try:
+            if delay is None or delay >= deadline - time.monotonic():
+                return await primary
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.hedges += 1
+            UPSTREAM_HEDGES.inc(provider=self.name, route=route)
+            tasks.append(asyncio.ensure_future(self._attempt(attempt, deadline, True)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        if task is not primary:
+                            self.hedges_won += 1
+                        return task.result()
+            # Both failed; the primary's error is the meaningful one
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _retry_delay(self, exc, attempts, deadline, route):
+        """Backoff before the next attempt, or None if exc should be raised"""
+        if not is_transient(exc) or attempts >= self.max_attempts:
+            return None
+        delay = backoff_delay(attempts)
+        typical = self.latency.percentile(0.5) or 0.0
+        if time.monotonic() + delay + typical >= deadline:
+            return None
+        self.retries += 1
+        UPSTREAM_RETRIES.inc(provider=self.name, route=route)
+        logger.info(
+            "Retrying %s call after %s (attempt %d, backoff %.2fs)",
+            self.name, type(exc).__name__, attempts + 1, delay,
+        )
+        return delay
+
+    async def call(self, attempt, deadline, route="-"):
+        attempts = 0
+        last_error = None
+        while True:
+            attempts += 1
+            try:
+                return await self._hedged(attempt, deadline, route)
+            except CircuitOpen:
+                raise
+            except Overloaded as e:
+                # A retry that can no longer be admitted in time fails with
+                # the error that caused it, not as a shed request
+                if last_error is not None:
+                    raise last_error from e
+                raise
+            except Exception as e:
+                delay = self._retry_delay(e, attempts, deadline, route)
+                if delay is None:
+                    raise
+                last_error = e
+            await asyncio.sleep(delay)
+
+    async def stream(self, attempt, deadline, route="-"):
+        """Like call() for `attempt(deadline)` returning an async iterator of chunks.
+
+        Streams are never hedged, and are only retried if they fail
+        before the first chunk has been passed on.
+        """
+        attempts = 0
+        while True:
+            attempts += 1
+            self.breaker.before_call()
+            started = False
+            try:
+                async for chunk in attempt(deadline):
+                    started = True
+                    yield chunk
+            except Overloaded:
+                self.breaker.record_abandoned()
+                raise
+            except (asyncio.CancelledError, GeneratorExit):
+                self.breaker.record_abandoned()
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    self.breaker.record_abandoned()
+                    raise
+                self.breaker.record_failure()
+                delay = None if started else self._retry_delay(e, attempts, deadline, route)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return
+
+    def stats(self):
+        p95 = self.latency.percentile(0.95)
+        return {
+            "name": self.name,
+            "circuit": self.breaker.stats(),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "p95_latency": round(p95, 3) if p95 is not None else None,
+        }
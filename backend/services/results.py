@@ -0,0 +1,77 @@
+import os
+import re
+import hashlib
+import contextvars
+from services.asgi import encoded_etag, COMPRESSED_ENCODINGS
+
+# Results are addressable by their cache key at GET /results/<kind>/<key>,
+# with a strong ETag and a Cache-Control lifetime that follows the cache's
+# own TTLs. They may be kept by shared caches (CDNs, reverse proxies) unless
+# RESULTS_SHARED_CACHE=0, which marks them private to the browser
+RESULTS_SHARED_CACHE = os.getenv("RESULTS_SHARED_CACHE", "1").lower() not in ("0", "false", "no")
+
+# Cache keys are MD5 hex digests
+RESULT_KEY_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# (kind, cache key) of results the current request was answered with that
+# are stored under exactly that key; a set, so results noted in tasks the
+# request spawns are seen too. None unless a route asked for it
+stored_results = contextvars.ContextVar("stored_results", default=None)
+
+
+def track_results():
+    """Collect the stored results the current request is answered with"""
+    stored = set()
+    stored_results.set(stored)
+    return stored
+
+
+def note_stored(kind, cache_key):
+    """Record that the current request's `kind` result is the value cached under cache_key"""
+    stored = stored_results.get()
+    if stored is not None:
+        stored.add((kind, cache_key))
+
+
+def stored_key(kind, cache_key):
+    """cache_key if the current request was answered with the value stored under it, else None"""
+    stored = stored_results.get()
+    return cache_key if stored is not None and (kind, cache_key) in stored else None
+
+
+def result_link(kind, cache_key):
+    """The result_key and result_url fields of a response (both None for results that aren't stored)"""
+    return {
+        "result_key": cache_key,
+        "result_url": f"/results/{kind}/{cache_key}" if cache_key else None,
+    }
+
+
+def entity_tag(body):
+    """Strong ETag of a response body"""
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def etag_matches(if_none_match, etag):
+    """The tag in an If-None-Match header that matches etag (or a compressed variant of it), or None"""
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return etag
+    variants = {etag}.union(encoded_etag(etag, encoding) for encoding in COMPRESSED_ENCODINGS)
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        # If-None-Match uses the weak comparison
+        if (tag[2:] if tag.startswith("W/") else tag) in variants:
+            return tag
+    return None
+
+
+def cache_control(entry, cache):
+    """Cache-Control for a cached entry: fresh until the cache's TTL, then stale-while-revalidate"""
+    fresh_for = max(0, int(cache.ttl - entry.age))
+    stale_for = max(0, int(cache.hard_ttl - max(entry.age, cache.ttl)))
+    return (
+        f"{'public' if RESULTS_SHARED_CACHE else 'private'}, max-age={fresh_for}, "
+        f"stale-while-revalidate={stale_for}, stale-if-error={cache.stale_if_error}"
+    )
@@ -0,0 +1,301 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import logging
+import contextvars
+from contextlib import asynccontextmanager
+from services.admission import Overloaded
+from services.metrics import (
+    SCHEDULER_QUEUE_DEPTH,
+    SCHEDULER_WAIT,
+    SCHEDULER_DISPATCHED,
+    SCHEDULER_REJECTED,
+    SCHEDULER_TOKENS,
+    SCHEDULER_BUDGET,
+)
+
+logger = logging.getLogger(__name__)
+
+# Upstream quota per worker process (divide the provider's quota by the
+# number of workers); 0 means unlimited. Calls wait in a weighted-fair queue
+# until both budgets allow them, or are shed with 503 + Retry-After
+SCHEDULER_RPM = float(os.getenv("SCHEDULER_RPM", 0))
+SCHEDULER_TPM = float(os.getenv("SCHEDULER_TPM", 0))
+SCHEDULER_QUEUE_SIZE = int(os.getenv("SCHEDULER_QUEUE_SIZE", 256))
+# Output tokens reserved for a call until its real output is known
+SCHEDULER_OUTPUT_TOKENS = int(os.getenv("SCHEDULER_OUTPUT_TOKENS", 400))
+
+# Priority classes and their share of the quota when every class is busy,
+# and the class each mode falls into unless the request sets its own
+SCHEDULER_WEIGHTS = os.getenv("SCHEDULER_WEIGHTS", "interactive=4,standard=2,bulk=1")
+SCHEDULER_MODE_CLASSES = os.getenv(
+    "SCHEDULER_MODE_CLASSES", "basic=interactive,quick=interactive,explain=interactive,cot=standard,deep=bulk,few-shot=bulk"
+)
+DEFAULT_CLASS = "standard"
+
+# Who the current request is for (API key or client IP) and, for work such
+# as jobs and batches, the priority class it runs at
+client_key = contextvars.ContextVar("client_key", default="anonymous")
+priority_class = contextvars.ContextVar("priority_class", default=None)
+
+
+def parse_mapping(spec, cast=str):
+    """Parse "name=value,name=value" into a dict"""
+    mapping = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            mapping[name.strip()] = cast(value.strip())
+    return mapping
+
+
+class TokenBucket:
+    """Refills at capacity per minute, continuously; may go into debt when a reservation is settled"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount):
+        """Seconds until amount is available (after refill)"""
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+class _Waiter:
+    __slots__ = ("future", "cost", "cls", "client", "queued_at")
+
+    def __init__(self, future, cost, cls, client):
+        self.future = future
+        self.cost = cost
+        self.cls = cls
+        self.client = client
+        self.queued_at = time.monotonic()
+
+
+class Reservation:
+    """Budget held by one upstream call; settle() corrects it once the real output is known"""
+
+    __slots__ = ("scheduler", "input_tokens", "reserved", "settled")
+
+    def __init__(self, scheduler, input_tokens, reserved):
+        self.scheduler = scheduler
+        self.input_tokens = input_tokens
+        self.reserved = reserved
+        self.settled = False
+
+    def settle(self, output_tokens):
+        if self.settled or self.scheduler is None:
+            return
+        self.settled = True
+        self.scheduler._settle(self.reserved, self.input_tokens + output_tokens)
+
+
+class QuotaScheduler:
+    """Weighted-fair queue in front of the upstream, paced by RPM and TPM token buckets.
+
+    Each (priority class, client) pair is a flow. Requests get a virtual
+    finish time of max(virtual clock, the flow's last finish) + cost /
+    class weight and are dispatched lowest first (self-clocked fair
+    queueing), so a client that floods the queue only delays its own
+    requests, and interactive classes get a larger share than bulk ones
+    when both are waiting. Cost is the estimated token count of the call.
+    With no RPM or TPM budget configured calls pass straight through.
+    """
+
+    def __init__(
+        self,
+        rpm=SCHEDULER_RPM,
+        tpm=SCHEDULER_TPM,
+        weights=SCHEDULER_WEIGHTS,
+        mode_classes=SCHEDULER_MODE_CLASSES,
+        queue_size=SCHEDULER_QUEUE_SIZE,
+        output_tokens=SCHEDULER_OUTPUT_TOKENS,
+    ):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.weights = parse_mapping(weights, float) if isinstance(weights, str) else dict(weights)
+        self.mode_classes = parse_mapping(mode_classes) if isinstance(mode_classes, str) else dict(mode_classes)
+        self.queue_size = queue_size
+        self.output_tokens = output_tokens
+
+        self._heap = []  # (finish tag, sequence, _Waiter)
+        self._sequence = 0
+        self._virtual_time = 0.0
+        self._last_finish = {}  # (class, client) -> finish tag of its latest request
+        self._timer = None
+
+        self.dispatched = {}
+        self.rejected = 0
+
+    @property
+    def enabled(self):
+        return self.requests is not None or self.tokens is not None
+
+    def classify(self, mode):
+        return priority_class.get() or self.mode_classes.get(mode, DEFAULT_CLASS)
+
+    def _queued(self):
+        return sum(1 for _, _, waiter in self._heap if not waiter.future.done())
+
+    def _queued_by_class(self):
+        counts = {}
+        for _, _, waiter in self._heap:
+            if not waiter.future.done():
+                counts[waiter.cls] = counts.get(waiter.cls, 0) + 1
+        return counts
+
+    def _publish_depth(self):
+        counts = self._queued_by_class()
+        for cls in set(self.weights) | set(counts):
+            SCHEDULER_QUEUE_DEPTH.set(counts.get(cls, 0), priority=cls)
+
+    def _refill(self):
+        now = time.monotonic()
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+
+    def _wait_for(self, cost):
+        """Seconds until both buckets can cover a call of this cost"""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_for(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_for(min(cost, self.tokens.capacity)))
+        return wait
+
+    def _take(self, waiter):
+        if self.requests is not None:
+            self.requests.tokens -= 1
+        if self.tokens is not None:
+            self.tokens.tokens -= waiter.cost
+        waited = time.monotonic() - waiter.queued_at
+        SCHEDULER_WAIT.observe(waited, priority=waiter.cls)
+        SCHEDULER_DISPATCHED.inc(priority=waiter.cls)
+        SCHEDULER_TOKENS.inc(waiter.cost, priority=waiter.cls)
+        self.dispatched[waiter.cls] = self.dispatched.get(waiter.cls, 0) + 1
+
+    def _pump(self):
+        """Dispatch queued calls in finish-tag order while the budgets allow"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._heap:
+            tag, _, waiter = self._heap[0]
+            if waiter.future.done():
+                heapq.heappop(self._heap)
+                continue
+            wait = self._wait_for(waiter.cost)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._pump)
+                break
+            heapq.heappop(self._heap)
+            self._virtual_time = max(self._virtual_time, tag)
+            self._take(waiter)
+            waiter.future.set_result(None)
+        self._publish_depth()
+        self._publish_budget()
+
+    def _publish_budget(self):
+        if self.requests is not None:
+            SCHEDULER_BUDGET.set(self.requests.tokens, bucket="requests")
+        if self.tokens is not None:
+            SCHEDULER_BUDGET.set(self.tokens.tokens, bucket="tokens")
+
+    def _finish_tag(self, cls, client, cost):
+        flow = (cls, client)
+        start = max(self._virtual_time, self._last_finish.get(flow, 0.0))
+        tag = start + cost / self.weights.get(cls, 1.0)
+        self._last_finish[flow] = tag
+        if len(self._last_finish) > 10000:
+            # Flows at or behind the virtual clock start from it anyway
+            self._last_finish = {f: t for f, t in self._last_finish.items() if t > self._virtual_time}
+        return tag
+
+    def _shed(self, cls, reason, retry_after):
+        self.rejected += 1
+        SCHEDULER_REJECTED.inc(reason=reason, priority=cls)
+        raise Overloaded(f"quota_{reason}", max(1, math.ceil(retry_after)))
+
+    async def acquire(self, input_tokens, deadline, mode="-", output_tokens=None):
+        """Wait for this call's turn and budget; returns its Reservation"""
+        reserved = input_tokens + (output_tokens or self.output_tokens)
+        if not self.enabled:
+            return Reservation(None, input_tokens, reserved)
+
+        cls = self.classify(mode)
+        client = client_key.get()
+        if self._queued() >= self.queue_size:
+            self._shed(cls, "queue_full", self._wait_for(reserved) or 1)
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop.create_future(), reserved, cls, client)
+        self._sequence += 1
+        heapq.heappush(self._heap, (self._finish_tag(cls, client, reserved), self._sequence, waiter))
+        self._pump()
+        if not waiter.future.done():
+            timeout = deadline - time.monotonic() if deadline is not None else None
+            if timeout is not None and self._wait_for(reserved) > timeout:
+                # Not even this call's own budget comes back in time
+                waiter.future.cancel()
+                self._publish_depth()
+                self._shed(cls, "deadline", self._wait_for(reserved))
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                if not waiter.future.done():
+                    waiter.future.cancel()
+                    self._publish_depth()
+                    self._shed(cls, "deadline", self._wait_for(reserved))
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # Dispatched just as the caller went away: give the budget back
+                    self._settle(reserved, 0, request=True)
+                else:
+                    waiter.future.cancel()
+                raise
+        return Reservation(self, input_tokens, reserved)
+
+    def _settle(self, reserved, actual, request=False):
+        """Correct the token bucket by the difference between reserved and used tokens"""
+        if self.tokens is not None:
+            self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + reserved - actual)
+        if request and self.requests is not None:
+            self.requests.tokens = min(self.requests.capacity, self.requests.tokens + 1)
+        if self._heap:
+            self._pump()
+
+    @asynccontextmanager
+    async def slot(self, input_tokens, deadline, mode="-", output_tokens=None):
+        """Hold a scheduled slot for one upstream call; settle() the reservation with the real output"""
+        reservation = await self.acquire(input_tokens, deadline, mode, output_tokens)
+        try:
+            yield reservation
+        except BaseException:
+            # A failed call still used its request and its input tokens
+            reservation.settle(0)
+            raise
+
+    def stats(self):
+        self._refill()
+        return {
+            "enabled": self.enabled,
+            "requests_available": round(self.requests.tokens, 1) if self.requests is not None else None,
+            "tokens_available": round(self.tokens.tokens) if self.tokens is not None else None,
+            "queued": self._queued_by_class(),
+            "dispatched": dict(self.dispatched),
+            "rejected": self.rejected,
+            "flows": len(self._last_finish),
+        }
+
+
+scheduler = QuotaScheduler()
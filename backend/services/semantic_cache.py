@@ -0,0 +1,274 @@
+import os
+import re
+import time
+import zlib
+import logging
+import unicodedata
+from array import array
+from collections import OrderedDict
+from services.cache import CACHE_TTL, CACHE_MAX_ENTRIES
+from services.stale_cache import FRESH
+from services.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Near-duplicate lookup behind the exact-match response cache. Set
+# SEMANTIC_CACHE=0 to turn it off; the threshold is the minimum Jaccard
+# similarity of the inputs' character trigrams for a cached answer to be reused
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "1").lower() not in ("0", "false", "no")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.9))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", CACHE_MAX_ENTRIES))
+
+# MinHash signature layout: BANDS x ROWS slots. Two inputs become candidates
+# when any band matches exactly, which for 8x4 happens with probability
+# 0.98 at similarity 0.8 and 0.9998 at 0.9
+BANDS = 8
+ROWS = 4
+SIGNATURE_SIZE = BANDS * ROWS
+SHINGLE_SIZE = 3
+# Inputs shorter than this many trigrams only match after normalisation
+MIN_SHINGLES = 8
+# Candidates whose signatures agree on fewer slots than threshold minus this
+# margin are rejected without computing their exact similarity
+ESTIMATE_MARGIN = 0.2
+
+_SLOT_BITS = 5  # log2(SIGNATURE_SIZE)
+_SLOT_MASK = SIGNATURE_SIZE - 1
+_DENSIFY_STEP = 1 << (32 - _SLOT_BITS)
+
+_WHITESPACE = re.compile(r"\s+")
+_WORD_HYPHEN = re.compile(r"(?<=\w)[-‐‑‒–—_]+(?=\w)")
+_LEADING_QUOTES = re.compile(r"^[\"'“”‘’`\s]+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?,;:…\"'“”‘’`]+$")
+# Numbers, negations and comparisons: a few characters of these can reverse
+# what a long prompt asks for ("under 100 words" / "over 100 words"), so
+# near-duplicates must have the same ones, in the same order
+_GUARD_TOKENS = re.compile(
+    r"\d+(?:[.,]\d+)*"
+    r"|\b(?:not|no|never|none|nor|without|except|avoid|don't|doesn't|isn't|aren't|can't|cannot|won't|"
+    r"under|over|below|above|less|more|fewer|least|most|min|max|minimum|maximum|before|after)\b"
+)
+
+
+def normalize_text(text):
+    """Canonical form used for near-duplicate matching.
+
+    Case, Unicode compatibility forms, runs of whitespace, hyphenation
+    between words, surrounding quotes and trailing punctuation are ignored;
+    all other punctuation is kept since it can change what a prompt asks for.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _WORD_HYPHEN.sub(" ", text)
+    text = _WHITESPACE.sub(" ", text).strip()
+    text = _LEADING_QUOTES.sub("", text)
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+def guard_tokens(text):
+    """The numbers, negations and comparison words of normalised text, in order"""
+    return tuple(_GUARD_TOKENS.findall(text))
+
+
+def shingles(text):
+    """Hashed character trigrams of normalised text"""
+    padded = f" {text} "
+    grams = {padded[i:i + SHINGLE_SIZE] for i in range(len(padded) - SHINGLE_SIZE + 1)}
+    return {zlib.crc32(gram.encode()) for gram in grams}
+
+
+def signature(hashes):
+    """One-permutation MinHash: one hash per shingle, the minimum kept per slot.
+
+    Empty slots (short inputs) borrow from the next filled slot so that
+    every slot is usable for banding.
+    """
+    slots = [None] * SIGNATURE_SIZE
+    for h in hashes:
+        slot = h & _SLOT_MASK
+        value = h >> _SLOT_BITS
+        current = slots[slot]
+        if current is None or value < current:
+            slots[slot] = value
+    for i in range(SIGNATURE_SIZE):
+        if slots[i] is None:
+            for step in range(1, SIGNATURE_SIZE):
+                borrowed = slots[(i + step) % SIGNATURE_SIZE]
+                if borrowed is not None and borrowed < _DENSIFY_STEP:
+                    slots[i] = borrowed + step * _DENSIFY_STEP
+                    break
+    return slots
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SemanticCache:
+    """Second cache tier that maps near-duplicate inputs onto exact cache keys.
+
+    Each cached input is indexed by its normalised text and by
+    locality-sensitive hashes of its character trigrams, within a partition
+    (e.g. mode/tone/persona/format) so only interchangeable requests can
+    match. A lookup returns the exact cache entry of the most similar
+    indexed input at or above the threshold that has the same numbers,
+    negations and comparison words. The index only stores keys; values
+    stay in the exact cache, so its budgets and TTL still apply, and only
+    fresh entries are served (stale ones are refreshed by exact lookups).
+    """
+
+    def __init__(
+        self,
+        cache,
+        ttl=CACHE_TTL,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+        enabled=SEMANTIC_CACHE_ENABLED,
+    ):
+        self.cache = cache
+        self.name = f"{cache.name}_semantic"
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.enabled = enabled
+
+        # cache key -> (partition, text, bands, expires_at, signature, shingle count, guard tokens)
+        self._entries = OrderedDict()
+        self._exact = {}  # (partition, normalised text) -> cache key
+        self._buckets = {}  # band hash -> cache key
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _bands(self, partition, slots):
+        return tuple(
+            hash((partition, band, *slots[band * ROWS:(band + 1) * ROWS]))
+            for band in range(BANDS)
+        )
+
+    def find(self, partition, text):
+        """Return the cache key of the closest indexed input, or None"""
+        if not self.enabled or not self._entries:
+            return None
+        normalized = normalize_text(text)
+        now = time.time()
+
+        key = self._exact.get((partition, normalized))
+        if key is not None:
+            if self._entries[key][3] > now:
+                self._entries.move_to_end(key)
+                return key
+            self.discard(key)
+
+        hashes = shingles(normalized)
+        if len(hashes) < MIN_SHINGLES:
+            return None
+
+        slots = signature(hashes)
+        count = len(hashes)
+        guard = guard_tokens(normalized)
+        min_agreement = (self.threshold - ESTIMATE_MARGIN) * SIGNATURE_SIZE
+        best_key, best_score = None, self.threshold
+        seen = set()
+        for band_hash in self._bands(partition, slots):
+            key = self._buckets.get(band_hash)
+            if key is None or key in seen:
+                continue
+            seen.add(key)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != partition:
+                continue
+            if entry[3] <= now:
+                self.discard(key)
+                continue
+            # Cheap rejections: set sizes too far apart, or signatures disagree
+            if min(count, entry[5]) < self.threshold * max(count, entry[5]):
+                continue
+            if sum(a == b for a, b in zip(slots, entry[4])) < min_agreement:
+                continue
+            if entry[6] != guard:
+                continue
+            score = jaccard(hashes, shingles(entry[1]))
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is not None:
+            self._entries.move_to_end(best_key)
+        return best_key
+
+    async def get(self, partition, text):
+        """Return the cached value for a near-duplicate of text, or None"""
+        if not self.enabled:
+            return None
+        key = self.find(partition, text)
+        entry = await self.cache.lookup(key) if key is not None else None
+        if entry is None or entry.state != FRESH:
+            if key is not None and (entry is None or not entry.usable):
+                # Evicted or expired in the exact cache
+                self.discard(key)
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache=self.name, result="miss")
+            return None
+        self.hits += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="hit")
+        logger.debug("Near-duplicate cache hit in '%s'", self.name)
+        return entry.value
+
+    def add(self, partition, text, cache_key):
+        """Index text so that near-duplicates resolve to cache_key"""
+        if not self.enabled:
+            return
+        if cache_key in self._entries:
+            self.discard(cache_key)
+
+        normalized = normalize_text(text)
+        hashes = shingles(normalized)
+        if len(hashes) >= MIN_SHINGLES:
+            slots = array("I", signature(hashes))
+            bands = self._bands(partition, slots)
+        else:
+            slots, bands = None, ()
+
+        expires_at = time.time() + self.ttl
+        self._entries[cache_key] = (
+            partition, normalized, bands, expires_at, slots, len(hashes), guard_tokens(normalized)
+        )
+        self._exact[(partition, normalized)] = cache_key
+        for band_hash in bands:
+            self._buckets[band_hash] = cache_key
+
+        while len(self._entries) > self.max_entries:
+            self.discard(next(iter(self._entries)))
+
+    def discard(self, cache_key):
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return
+        partition, normalized, bands = entry[:3]
+        if self._exact.get((partition, normalized)) == cache_key:
+            del self._exact[(partition, normalized)]
+        for band_hash in bands:
+            if self._buckets.get(band_hash) == cache_key:
+                del self._buckets[band_hash]
+
+    def clear(self):
+        self._entries.clear()
+        self._exact.clear()
+        self._buckets.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
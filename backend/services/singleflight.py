@@ -0,0 +1,68 @@
+import asyncio
+from services.metrics import COALESCED_REQUESTS
+
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one upstream call.
+
+    The first caller for a key (the leader) starts the work as a separate
+    task; callers arriving while it is in flight (followers) await the same
+    task instead of starting their own. Each caller waits through
+    asyncio.shield, so a caller being cancelled (e.g. a client disconnect)
+    never cancels the shared work for the others. The work is only
+    cancelled once every caller has stopped waiting for it.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+        self.leaders = 0
+        self.followers = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    def in_flight(self, key):
+        return key in self._calls
+
+    async def do(self, key, fn):
+        """Run fn() for key unless an identical call is already in flight"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task, key=key, call=call: self._finish(key, call))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            COALESCED_REQUESTS.inc(route=f"/{self.name}")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _finish(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Mark the exception as retrieved even if every waiter has gone away
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+import logging
+from services.cache import CACHE_TTL
+from services.metrics import CACHE_STALE_SERVED, CACHE_REFRESHES
+
+logger = logging.getLogger(__name__)
+
+# Entries are fresh for CACHE_TTL seconds. Until CACHE_HARD_TTL they are
+# still served straight away while one background call refreshes them; after
+# that a request waits for a new answer, unless the upstream fails or its
+# circuit is open, in which case entries up to CACHE_STALE_IF_ERROR seconds
+# past the hard TTL are served instead of an error
+CACHE_HARD_TTL = int(os.getenv("CACHE_HARD_TTL", 6 * 3600))
+CACHE_STALE_IF_ERROR = int(os.getenv("CACHE_STALE_IF_ERROR", 24 * 3600))
+
+FRESH, STALE, EXPIRED = "fresh", "stale", "expired"
+
+
+class CacheEntry:
+    """A cached value and how old it is relative to the soft and hard TTLs"""
+
+    __slots__ = ("value", "age", "state")
+
+    def __init__(self, value, age, state):
+        self.value = value
+        self.age = age
+        self.state = state
+
+    @property
+    def usable(self):
+        """Whether the entry may be served without asking the upstream first"""
+        return self.state != EXPIRED
+
+
+class StaleCache:
+    """Stale-while-revalidate layer over a response cache backend.
+
+    Values are stored with the time they were produced and kept by the
+    backend until the hard TTL plus the stale-if-error window, so the
+    freshness policy works the same for every backend and across workers
+    sharing one. Background refreshes go through the same SingleFlight as
+    foreground misses, so a key is never fetched twice at once per worker.
+    With a CacheSnapshot, writes are also appended to it and backend misses
+    are looked up in it, so a restarted worker starts with the old entries.
+    """
+
+    def __init__(
+        self,
+        backend,
+        flight,
+        ttl=CACHE_TTL,
+        hard_ttl=CACHE_HARD_TTL,
+        stale_if_error=CACHE_STALE_IF_ERROR,
+        snapshot=None,
+    ):
+        self.backend = backend
+        self.name = backend.name
+        self.flight = flight
+        self.ttl = ttl
+        self.hard_ttl = max(hard_ttl, ttl)
+        self.stale_if_error = stale_if_error
+        self.snapshot = snapshot
+        self._refreshing = {}  # key -> background refresh task
+
+        self.stale_served = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.fallbacks = 0
+        self.snapshot_hits = 0
+
+    def _state(self, age):
+        if age < self.ttl:
+            return FRESH
+        if age < self.hard_ttl:
+            return STALE
+        return EXPIRED
+
+    async def lookup(self, key):
+        """Return the CacheEntry for key, or None if there is nothing to serve"""
+        data = await self.backend.get(key)
+        if data is None and self.snapshot is not None:
+            data = await self._restore(key)
+        if data is None:
+            return None
+        if isinstance(data, dict) and "stored_at" in data:
+            value, age = data["value"], max(0.0, time.time() - data["stored_at"])
+        else:
+            # Written before entries carried their age; the backend's own
+            # expiry still bounds how long it lives
+            value, age = data, 0.0
+        return CacheEntry(value, age, self._state(age))
+
+    async def _restore(self, key):
+        """Copy an entry from the snapshot into the backend, if it is still worth keeping"""
+        found = self.snapshot.get(self.name, key)
+        if found is None:
+            return None
+        stored_at, value = found
+        remaining = stored_at + self.hard_ttl + self.stale_if_error - time.time()
+        if remaining <= 0:
+            return None
+        data = {"value": value, "stored_at": stored_at}
+        await self.backend.set(key, data, ttl=remaining)
+        self.snapshot_hits += 1
+        return data
+
+    async def get(self, key):
+        """Return the cached value for key if it may be served, or None"""
+        entry = await self.lookup(key)
+        return entry.value if entry is not None and entry.usable else None
+
+    async def set(self, key, value, ttl=None):
+        hard_ttl = ttl if ttl is not None else self.hard_ttl
+        stored_at = time.time()
+        await self.backend.set(key, {"value": value, "stored_at": stored_at}, ttl=hard_ttl + self.stale_if_error)
+        if self.snapshot is not None:
+            self.snapshot.append(self.name, key, stored_at, value)
+
+    async def delete(self, key):
+        await self.backend.delete(key)
+
+    def serve_stale(self, entry, reason):
+        """Count and return a stale entry served in place of a fresh answer"""
+        self.stale_served += 1
+        if reason != "revalidate":
+            self.fallbacks += 1
+            logger.info("Serving %s entry from '%s' (%s, %.0fs old)", entry.state, self.name, reason, entry.age)
+        CACHE_STALE_SERVED.inc(cache=self.name, reason=reason)
+        return entry.value
+
+    def revalidate(self, key, fetch):
+        """Refresh key in the background with fetch() unless that is already under way"""
+        task = self._refreshing.get(key)
+        if (task is not None and not task.done()) or self.flight.in_flight(key):
+            return
+        task = asyncio.ensure_future(self._refresh(key, fetch))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _, key=key: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key, fetch):
+        try:
+            await self.flight.do(key, fetch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The stale entry keeps being served; the next stale hit tries again
+            self.refresh_failures += 1
+            CACHE_REFRESHES.inc(cache=self.name, outcome="error")
+            logger.warning("Background refresh in '%s' failed: %s", self.name, type(e).__name__)
+            return
+        self.refreshes += 1
+        CACHE_REFRESHES.inc(cache=self.name, outcome="ok")
+
+    def stats(self):
+        stats = self.backend.stats()
+        stats.update({
+            "ttl": self.ttl,
+            "hard_ttl": self.hard_ttl,
+            "stale_if_error": self.stale_if_error,
+            "stale_served": self.stale_served,
+            "stale_fallbacks": self.fallbacks,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "refreshing": len(self._refreshing),
+            "snapshot_hits": self.snapshot_hits,
+        })
+        return stats
@@ -0,0 +1,59 @@
+import re
+import json
+
+# Headers that keep proxies from buffering Server-Sent Events
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# A variant header that starts a new line, e.g. "\nVariant 2:" or "\n**Variant 2:**"
+VARIANT_BOUNDARY = re.compile(r"\n(?:\*\*)?Variant \d+(?:\*\*)?:")
+VARIANT_HEADER = re.compile(r"(?:\*\*)?Variant \d+(?:\*\*)?:")
+
+# Longest text a header can span, so a partial header at the end of the
+# buffer is rescanned once the next chunk arrives
+_HEADER_LOOKBACK = 32
+
+
+def format_sse(event, data):
+    """Encode one Server-Sent Event"""
+    payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class VariantStreamParser:
+    """Split streamed `deep` mode output into variant blocks as they complete.
+
+    A variant is complete once the header of the next one has arrived, so
+    feed() returns every block finished by the new chunk and finish()
+    returns the last one. Text before the first header is dropped, matching
+    parse_response.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._scan_from = 0
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        blocks = []
+        while True:
+            match = VARIANT_BOUNDARY.search(self.buffer, self._scan_from)
+            if match is None:
+                self._scan_from = max(0, len(self.buffer) - _HEADER_LOOKBACK)
+                return blocks
+            block = self._take(match.start())
+            self.buffer = self.buffer[match.start() + 1:]
+            self._scan_from = 0
+            if block:
+                blocks.append(block)
+
+    def finish(self):
+        block = self._take(len(self.buffer))
+        self.buffer = ""
+        self._scan_from = 0
+        return [block] if block else []
+
+    def _take(self, end):
+        block = self.buffer[:end].strip()
+        if VARIANT_HEADER.match(block) and VARIANT_HEADER.sub("", block, count=1).strip():
+            return block
+        return None
@@ -0,0 +1,99 @@
+import os
+import re
+import contextvars
+from services.metrics import INPUT_BUDGET
+
+# Rough BPE-style token count without a tokenizer: a word is one token plus
+# one per further 7 characters, a punctuation mark or symbol is one token.
+# On the PROMPT_TEMPLATES prompts this lands at or slightly above the usual
+# 4-characters-per-token rule, erring high, which is the safe side when
+# budgeting against a tokens-per-minute quota.
+_PIECES = re.compile(r"\w+|[^\w\s]")
+WORD_CHARS_PER_TOKEN = 7
+
+# Longest raw input (or prompt to explain) sent upstream, in estimated
+# tokens; 0 disables the check. Longer input is handled per
+# INPUT_BUDGET_POLICY: "reject" answers 413, "compact" squeezes out repeated
+# whitespace and duplicate lines and answers 413 if that is not enough, and
+# "truncate" compacts and then cuts the input to the budget
+INPUT_TOKEN_BUDGET = int(os.getenv("INPUT_TOKEN_BUDGET", 4000))
+INPUT_BUDGET_POLICY = os.getenv("INPUT_BUDGET_POLICY", "compact").lower()
+
+_SPACES = re.compile(r"[ \t\f\v]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+# Token counts reported by the provider for the current upstream call
+upstream_usage = contextvars.ContextVar("upstream_usage", default=None)
+
+
+class InputTooLarge(Exception):
+    """Input over INPUT_TOKEN_BUDGET that the policy does not shorten enough; answered with 413"""
+
+    def __init__(self, tokens, budget):
+        super().__init__(f"Input too long: about {tokens} tokens (limit {budget})")
+        self.tokens = tokens
+        self.budget = budget
+
+
+def estimate_tokens(text):
+    """Estimated number of model tokens in text"""
+    if not text:
+        return 0
+    return sum(1 + len(piece) // WORD_CHARS_PER_TOKEN for piece in _PIECES.findall(text))
+
+
+def compact_text(text):
+    """Text without runs of spaces, trailing spaces, extra blank lines or repeated lines"""
+    lines = []
+    previous = None
+    for line in _SPACES.sub(" ", text).split("\n"):
+        line = line.strip()
+        if line:
+            # A line repeating the last non-blank one (pasted twice, log spam)
+            if line == previous:
+                continue
+            previous = line
+        lines.append(line)
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def truncate_tokens(text, budget):
+    """The longest prefix of text estimated at no more than budget tokens"""
+    tokens = 0
+    end = 0
+    for piece in _PIECES.finditer(text):
+        tokens += 1 + len(piece.group()) // WORD_CHARS_PER_TOKEN
+        if tokens > budget:
+            break
+        end = piece.end()
+    return text[:end]
+
+
+def fit_input(text, mode="-", budget=INPUT_TOKEN_BUDGET, policy=INPUT_BUDGET_POLICY):
+    """Text within the input token budget, shortened per the policy, or InputTooLarge"""
+    # No piece counts more tokens than it has characters, so short input needs no count
+    if budget <= 0 or len(text) <= budget:
+        return text
+    tokens = estimate_tokens(text)
+    if tokens <= budget:
+        return text
+    if policy in ("compact", "truncate"):
+        compacted = compact_text(text)
+        compacted_tokens = estimate_tokens(compacted)
+        if compacted_tokens <= budget:
+            INPUT_BUDGET.inc(mode=mode, action="compacted")
+            return compacted
+        if policy == "truncate":
+            INPUT_BUDGET.inc(mode=mode, action="truncated")
+            return truncate_tokens(compacted, budget)
+        tokens = compacted_tokens
+    INPUT_BUDGET.inc(mode=mode, action="rejected")
+    raise InputTooLarge(tokens, budget)
+
+
+def report_usage(input_tokens, output_tokens):
+    """Called by providers with the token counts the upstream reported for a call"""
+    usage = upstream_usage.get()
+    if usage is not None:
+        usage["input"] = input_tokens
+        usage["output"] = output_tokens
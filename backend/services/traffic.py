@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import hmac
+import queue
+import random
+import hashlib
+import logging
+import threading
+import contextvars
+from logging.handlers import RotatingFileHandler
+from services.scheduler import client_key
+
+logger = logging.getLogger(__name__)
+
+# Opt-in traffic recorder: when TRAFFIC_LOG_DIR is set, every worker appends
+# the anonymised shape of each API request (route, options, input length
+# and keyed hash, status, latency, cache outcome) as one JSON line to
+# traffic-<pid>.jsonl there, rotated at TRAFFIC_LOG_MAX_BYTES with
+# TRAFFIC_LOG_BACKUPS old files kept. benchmarks/replay_traffic.py replays it
+TRAFFIC_LOG_DIR = os.getenv("TRAFFIC_LOG_DIR")
+TRAFFIC_LOG_MAX_BYTES = int(os.getenv("TRAFFIC_LOG_MAX_BYTES", 20 * 1024 * 1024))
+TRAFFIC_LOG_BACKUPS = int(os.getenv("TRAFFIC_LOG_BACKUPS", 5))
+TRAFFIC_SAMPLE_RATE = float(os.getenv("TRAFFIC_SAMPLE_RATE", 1.0))
+# Inputs and clients are only stored as HMACs with this key; keep it secret
+# and the same across workers and restarts so identical inputs still match
+TRAFFIC_HASH_KEY = os.getenv("TRAFFIC_HASH_KEY", "")
+
+# Request bodies larger than this are recorded without their shape
+MAX_RECORDED_BODY = 256 * 1024
+# Writes wait in memory for the writer thread; past this, records are dropped
+MAX_PENDING = 10000
+
+# Per-request notes (such as the cache outcome) made deeper in the stack;
+# a dict, so notes made in tasks the request spawns are seen too
+request_notes = contextvars.ContextVar("request_notes", default=None)
+
+
+def note_cache(outcome):
+    """Record how the current request was answered: hit, stale, semantic, coalesced or miss"""
+    notes = request_notes.get()
+    if notes is not None and "cache" not in notes:
+        notes["cache"] = outcome
+
+
+def anonymise(text):
+    """Keyed hash of text: equal inputs match, but they can't be read or guessed back"""
+    return hmac.new(TRAFFIC_HASH_KEY.encode(), text.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def request_shape(body):
+    """The anonymised options and input of a refine/explain request body"""
+    shape = {}
+    for field, key in (("mode", "mode"), ("tone", "tone"), ("persona", "persona"), ("return_format", "fmt")):
+        value = body.get(field)
+        if isinstance(value, str):
+            # Free-form persona text is hashed like the input
+            shape[key] = anonymise(value) if field == "persona" and value else value
+    text = body.get("raw_input", body.get("prompt"))
+    if isinstance(text, str):
+        shape["len"] = len(text)
+        shape["h"] = anonymise(text)
+    if body.get("callback_url"):
+        shape["cb"] = 1
+    items = body.get("items")
+    if isinstance(items, list):
+        shape["items"] = [request_shape(item) for item in items if isinstance(item, dict)]
+    if isinstance(body.get("concurrency"), int):
+        shape["concurrency"] = body["concurrency"]
+    return shape
+
+
+class TrafficRecorder:
+    """Writes one compact JSON line per request from a background thread.
+
+    The request path only queues the raw pieces; parsing the body,
+    hashing and file I/O happen on the writer thread, which is started
+    once per worker process.
+    """
+
+    def __init__(self, directory=TRAFFIC_LOG_DIR, sample_rate=TRAFFIC_SAMPLE_RATE):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self._pid = None
+        self.recorded = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.sample_rate > 0
+
+    def should_record(self):
+        return self.enabled and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    def _ensure_writer(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        handler = RotatingFileHandler(
+            os.path.join(self.directory, f"traffic-{self._pid}.jsonl"),
+            maxBytes=TRAFFIC_LOG_MAX_BYTES,
+            backupCount=TRAFFIC_LOG_BACKUPS,
+            encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        threading.Thread(target=self._write_loop, args=(handler,), name="traffic-recorder", daemon=True).start()
+
+    def record(self, entry, body):
+        """Queue a request's entry (and raw body, shaped on the writer thread)"""
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((entry, body))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self, handler):
+        while True:
+            entry, body = self._queue.get()
+            try:
+                entry["client"] = anonymise(entry["client"])
+                if body:
+                    try:
+                        parsed = json.loads(body)
+                    except ValueError:
+                        parsed = None
+                    if isinstance(parsed, dict):
+                        entry.update(request_shape(parsed))
+                line = json.dumps(entry, separators=(",", ":"))
+                handler.emit(logging.makeLogRecord({"msg": line}))
+                self.recorded += 1
+            except Exception:
+                logger.exception("Could not record a request")
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "recorded": self.recorded,
+            "pending": self._queue.qsize(),
+            "dropped": self.dropped,
+        }
+
+
+class TrafficMiddleware:
+    """Records the shape, outcome and latency of requests picked by the recorder"""
+
+    def __init__(self, app, recorder, skip_paths=()):
+        self.app = app
+        self.recorder = recorder
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths or not self.recorder.should_record():
+            await self.app(scope, receive, send)
+            return
+
+        started = time.time()
+        timer = time.perf_counter()
+        notes = {}
+        request_notes.set(notes)
+        chunks = []
+        size = 0
+        status = 500
+        first_byte = None
+
+        async def receive_and_keep():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request" and size <= MAX_RECORDED_BODY:
+                body = message.get("body", b"")
+                size += len(body)
+                chunks.append(body)
+            return message
+
+        async def send_and_time(message):
+            nonlocal status, first_byte
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                first_byte = time.perf_counter() - timer
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_keep, send_and_time)
+        finally:
+            entry = {
+                "t": round(started, 3),
+                "method": scope["method"],
+                "route": getattr(scope.get("route"), "path", scope["path"]),
+                "status": status,
+                "dur": round(time.perf_counter() - timer, 4),
+                "ttfb": round(first_byte, 4) if first_byte is not None else None,
+                "cache": notes.get("cache"),
+                "client": client_key.get(),
+            }
+            self.recorder.record(entry, b"".join(chunks) if size <= MAX_RECORDED_BODY else None)
+
+
+traffic_recorder = TrafficRecorder()
@@ -0,0 +1,12 @@
+import os
+import sys
+from pathlib import Path
+
+# Offline, per-process settings, before any app module is imported
+os.environ["GEMINI_FAKE"] = "1"
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["CACHE_SNAPSHOT"] = "0"
+os.environ["SEMANTIC_CACHE"] = "0"
+os.environ.pop("TRAFFIC_LOG_DIR", None)
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+from services.cache_backends import MemoryCacheBackend
+from services.cache_snapshot import CacheSnapshot
+from services.singleflight import SingleFlight
+from services.stale_cache import StaleCache, FRESH, STALE, EXPIRED
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    flight = SingleFlight("test-flight")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert (flight.leaders, flight.followers) == (1, 4)
+    assert len(flight) == 0
+
+
+def test_single_flight_survives_a_cancelled_caller():
+    flight = SingleFlight("test-flight-cancel")
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("key", fetch))
+        follower = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == "answer"
+
+
+def test_stale_entries_are_served_while_one_refresh_runs():
+    cache = StaleCache(MemoryCacheBackend("test-swr"), SingleFlight("test-swr"), ttl=0.05, hard_ttl=10)
+    refreshes = []
+
+    async def refresh():
+        refreshes.append(1)
+        await asyncio.sleep(0.02)
+        await cache.set("key", "new")
+        return "new"
+
+    async def main():
+        await cache.set("key", "old")
+        assert (await cache.lookup("key")).state == FRESH
+        await asyncio.sleep(0.06)
+        entry = await cache.lookup("key")
+        assert entry.state == STALE and entry.usable and entry.value == "old"
+        cache.revalidate("key", refresh)
+        cache.revalidate("key", refresh)
+        await asyncio.sleep(0.05)
+        return await cache.lookup("key")
+
+    entry = asyncio.run(main())
+    assert entry.state == FRESH and entry.value == "new"
+    assert len(refreshes) == 1
+    assert cache.refreshes == 1
+
+
+def test_entries_past_the_hard_ttl_are_not_served():
+    cache = StaleCache(MemoryCacheBackend("test-hard-ttl"), SingleFlight("test-hard-ttl"), ttl=0.01, hard_ttl=0.02)
+
+    async def main():
+        await cache.set("key", "old")
+        await asyncio.sleep(0.03)
+        return await cache.lookup("key"), await cache.get("key")
+
+    entry, value = asyncio.run(main())
+    assert entry.state == EXPIRED and not entry.usable
+    assert value is None
+
+
+def write_snapshot(path, count=3):
+    snapshot = CacheSnapshot(path=str(path))
+    for number in range(count):
+        snapshot.append("refine", f"key{number}", time.time(), [f"value {number}"])
+    return path.read_bytes()
+
+
+def test_snapshot_round_trip(tmp_path):
+    write_snapshot(tmp_path / "cache.snapshot")
+    snapshot = CacheSnapshot(path=str(tmp_path / "cache.snapshot"))
+    assert snapshot.get("refine", "key2")[1] == ["value 2"]
+    assert snapshot.get("explain", "key2") is None
+    assert snapshot.loaded == 3
+
+
+def test_snapshot_ignores_a_torn_last_record(tmp_path):
+    path = tmp_path / "cache.snapshot"
+    data = write_snapshot(path)
+    path.write_bytes(data[:-3])
+    snapshot = CacheSnapshot(path=str(path))
+    assert snapshot.get("refine", "key1")[1] == ["value 1"]
+    assert snapshot.get("refine", "key2") is None
+
+
+def test_snapshot_stops_at_a_corrupt_record(tmp_path):
+    path = tmp_path / "cache.snapshot"
+    data = bytearray(write_snapshot(path))
+    # Flip a byte inside the second record's value
+    second = data.index(b"key1")
+    data[second + 8] ^= 0xFF
+    path.write_bytes(bytes(data))
+    snapshot = CacheSnapshot(path=str(path))
+    assert snapshot.get("refine", "key0")[1] == ["value 0"]
+    assert snapshot.get("refine", "key1") is None
+    assert snapshot.get("refine", "key2") is None
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import services.jobs as jobs
+from services.cache import CACHE_MAX_ENTRIES
+from services.jobs import JobQueue, DONE, FAILED
+
+
+def test_job_records_outlive_the_cache_budget():
+    queue = JobQueue(name="test-retention", ttl=60)
+
+    async def main():
+        first = await queue.submit("refine", None, cached=["answer"])
+        for _ in range(CACHE_MAX_ENTRIES + 50):
+            await queue.submit("refine", None, cached=["answer"])
+        return await queue.get(first["job_id"])
+
+    record = asyncio.run(main())
+    assert record is not None and record["status"] == DONE
+    assert queue.store.stats()["evictions"] == 0
+
+
+def test_job_records_expire_after_their_ttl():
+    queue = JobQueue(name="test-expiry", ttl=0.1)
+
+    async def main():
+        record = await queue.submit("refine", None, cached=["answer"])
+        kept = await queue.get(record["job_id"])
+        await asyncio.sleep(0.2)
+        return kept, await queue.get(record["job_id"])
+
+    kept, expired = asyncio.run(main())
+    assert kept is not None
+    assert expired is None
+
+
+def test_job_runs_and_failures_are_recorded():
+    queue = JobQueue(name="test-run", workers=2, ttl=60)
+
+    async def ok():
+        return ["refined"]
+
+    async def broken():
+        raise RuntimeError("upstream said no")
+
+    async def main():
+        done = await queue.submit("refine", ok)
+        failed = await queue.submit("refine", broken)
+        return await queue.wait(done["job_id"], 5), await queue.wait(failed["job_id"], 5)
+
+    done, failed = asyncio.run(main())
+    assert done["status"] == DONE and done["result"] == ["refined"]
+    assert failed["status"] == FAILED and "upstream said no" in failed["error"]
+
+
+@pytest.mark.parametrize("address", [
+    "127.0.0.1", "10.1.2.3", "192.168.0.10", "169.254.169.254", "100.64.0.1", "::1", "::ffff:127.0.0.1", "fe80::1%eth0",
+])
+def test_callbacks_may_not_reach_private_addresses(address):
+    assert not jobs._allowed_address(address)
+
+
+def test_callbacks_may_reach_public_addresses():
+    assert jobs._allowed_address("93.184.216.34")
+    assert jobs._allowed_address("2606:2800:220:1:248:1893:25c8:1946")
+
+
+def test_callback_url_validation(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", {"localhost", "hooks.example.com"})
+
+    def check(url):
+        return asyncio.run(jobs.validate_callback_url(url))
+
+    assert "http(s)" in check("ftp://hooks.example.com/done")
+    assert "not allowed" in check("https://elsewhere.example.com/done")
+    assert "non-public" in check("http://localhost:8080/done")
+
+
+def test_callbacks_are_disabled_without_allowed_hosts(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", set())
+    assert "not enabled" in asyncio.run(jobs.validate_callback_url("https://hooks.example.com/done"))
+
+
+def test_callback_connections_recheck_the_address():
+    with pytest.raises(ValueError):
+        jobs._connect_checked("localhost", 80, 1)
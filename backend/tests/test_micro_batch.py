@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+from services.micro_batch import MicroBatcher, unpack_prompt, split_response
+from services.scheduler import client_key
+
+
+def batcher():
+    return MicroBatcher(window=0.02, max_window=0.1, max_size=8)
+
+
+def answering(tag, packed_calls):
+    """A complete() answering packed prompts with one string per item, and single prompts directly"""
+    async def complete(prompt, generation):
+        unpacked = unpack_prompt(prompt)
+        if unpacked is not None:
+            packed_calls.append((client_key.get(), unpacked[1]))
+            return json.dumps([f"answer to {item}" for item in unpacked[1]])
+        return f"{tag} single {prompt}"
+    return complete
+
+
+def test_concurrent_calls_are_packed_and_split():
+    packed = []
+    micro = batcher()
+
+    async def one(number):
+        client_key.set("client-a")
+        return await micro.call(answering(number, packed), "Refine this", f"item{number}", f"prompt{number}")
+
+    async def main():
+        return await asyncio.gather(*(one(number) for number in range(3)))
+
+    assert asyncio.run(main()) == ["answer to item0", "answer to item1", "answer to item2"]
+    assert packed == [("client-a", ["item0", "item1", "item2"])]
+    assert micro.batches == 1
+
+
+def test_calls_of_different_clients_are_never_packed_together():
+    packed = []
+    micro = batcher()
+
+    async def one(client, number):
+        client_key.set(client)
+        return await micro.call(answering(number, packed), "Refine this", f"item{number}", f"prompt{number}")
+
+    async def main():
+        return await asyncio.gather(one("a", 0), one("a", 1), one("b", 2))
+
+    results = asyncio.run(main())
+    assert results[:2] == ["answer to item0", "answer to item1"]
+    # Alone in its batch, so sent as its ordinary prompt
+    assert results[2] == "2 single prompt2"
+    assert packed == [("a", ["item0", "item1"])]
+
+
+def test_unsplittable_answers_fall_back_to_each_callers_own_call():
+    singles = []
+    micro = batcher()
+
+    def unusable(tag):
+        async def complete(prompt, generation):
+            if generation is not None:
+                return "not a JSON array"
+            singles.append((tag, client_key.get()))
+            return f"{tag}: {prompt}"
+        return complete
+
+    async def one(number):
+        client_key.set(f"client-{number % 2}")
+        return await micro.call(unusable(number), "Refine this", f"item{number}", f"prompt{number}")
+
+    async def main():
+        client_key.set("client-0")
+        return await asyncio.gather(*(one(number) for number in (0, 2, 4)))
+
+    assert asyncio.run(main()) == ["0: prompt0", "2: prompt2", "4: prompt4"]
+    assert sorted(singles) == [(0, "client-0"), (2, "client-0"), (4, "client-0")]
+    assert micro.fallbacks == 1
+
+
+def test_split_response_rejects_wrong_shapes():
+    assert split_response('["a", "b"]', 2) == ["a", "b"]
+    assert split_response('```json\n["a", "b"]\n```', 2) == ["a", "b"]
+    assert split_response('["a"]', 2) is None
+    assert split_response('["a", ""]', 2) is None
+    assert split_response("a\nb", 2) is None
@@ -0,0 +1,156 @@
+import asyncio
+import time
+
+import pytest
+
+from services.resilience import CircuitBreaker, CircuitOpen, ResilientCaller, CLOSED, HALF_OPEN, OPEN
+
+
+def warm(caller, latency, samples=20):
+    for _ in range(samples):
+        caller.latency.add(latency)
+
+
+def test_breaker_lets_one_probe_through_after_cooldown():
+    breaker = CircuitBreaker("test-probe", failure_threshold=2, cooldown=0.05)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    # Only the probe goes upstream until it has an outcome
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    # A failed probe reopens the circuit for another cooldown
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_abandoned_probe_frees_the_probe_slot():
+    breaker = CircuitBreaker("test-abandoned", failure_threshold=1, cooldown=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    breaker.before_call()
+    breaker.record_abandoned()
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+
+
+def test_hedge_wins_and_primary_is_cancelled():
+    caller = ResilientCaller("test-hedge", hedge=True, hedge_percentile=0.95)
+    warm(caller, 0.01)
+    cancelled = []
+
+    async def attempt(deadline, hedge):
+        if hedge:
+            return "hedge"
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "primary"
+
+    async def main():
+        result = await caller.call(attempt, time.monotonic() + 10)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "hedge"
+    assert cancelled == [True]
+    assert caller.hedges == caller.hedges_won == 1
+    assert caller.breaker.state == CLOSED
+
+
+def test_no_hedge_without_enough_samples():
+    caller = ResilientCaller("test-no-hedge", hedge=True)
+    warm(caller, 0.01, samples=5)
+    hedged = []
+
+    async def attempt(deadline, hedge):
+        hedged.append(hedge)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    assert asyncio.run(caller.call(attempt, time.monotonic() + 10)) == "ok"
+    assert hedged == [False]
+    assert caller.hedges == 0
+
+
+def test_try_gets_the_whole_remaining_deadline_by_default():
+    caller = ResilientCaller("test-deadline", attempt_timeout=0, hedge=False)
+    seen = []
+
+    async def attempt(deadline, hedge):
+        seen.append(deadline)
+        return "ok"
+
+    deadline = time.monotonic() + 60
+    asyncio.run(caller.call(attempt, deadline))
+    assert seen == [deadline]
+
+
+def test_configured_try_cap_stretches_to_observed_p99():
+    caller = ResilientCaller("test-cap", attempt_timeout=0.5, hedge=False)
+    assert caller.attempt_cap() == 0.5
+    warm(caller, 2.0)
+    assert caller.attempt_cap() == pytest.approx(6.0)
+
+
+def test_retries_transient_errors_within_the_deadline():
+    caller = ResilientCaller("test-retry", max_attempts=3, hedge=False)
+    calls = []
+
+    async def attempt(deadline, hedge):
+        calls.append(deadline)
+        if len(calls) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert asyncio.run(caller.call(attempt, time.monotonic() + 30)) == "ok"
+    assert len(calls) == 3
+    assert caller.retries == 2
+
+
+def test_no_retry_when_the_deadline_cannot_fit_another_call():
+    caller = ResilientCaller("test-budget", max_attempts=3, hedge=False)
+    # A typical call takes longer than what is left of the deadline
+    warm(caller, 5.0)
+    calls = []
+
+    async def attempt(deadline, hedge):
+        calls.append(deadline)
+        raise ConnectionError("reset")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(caller.call(attempt, time.monotonic() + 1))
+    assert len(calls) == 1
+    assert caller.retries == 0
+
+
+def test_non_transient_errors_are_not_retried_or_counted():
+    caller = ResilientCaller("test-fatal", max_attempts=3, hedge=False)
+    calls = []
+
+    async def attempt(deadline, hedge):
+        calls.append(deadline)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(caller.call(attempt, time.monotonic() + 30))
+    assert len(calls) == 1
+    assert caller.breaker.failures == 0
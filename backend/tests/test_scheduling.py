@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+
+from services.admission import AdmissionController, Overloaded
+from services.scheduler import QuotaScheduler, client_key
+
+
+def test_admission_backs_off_on_overload():
+    controller = AdmissionController("test-aimd-down", initial_limit=10, min_limit=1, backoff=0.5)
+    controller.record(0.1, overloaded=True)
+    assert controller.limit == pytest.approx(5)
+    # At most one decrease per typical call, so a burst of errors does not collapse the limit
+    controller.record(0.1, overloaded=True)
+    assert controller.limit == pytest.approx(5)
+
+
+def test_admission_grows_only_while_the_limit_is_used():
+    controller = AdmissionController("test-aimd-up", initial_limit=4, max_limit=8)
+
+    async def main():
+        controller.record(0.1)
+        idle = controller.limit
+        for _ in range(controller.capacity):
+            await controller.acquire()
+        controller.record(0.1)
+        return idle, controller.limit
+
+    idle, busy = asyncio.run(main())
+    assert idle == pytest.approx(4)
+    assert busy == pytest.approx(4.25)
+
+
+def test_admission_sheds_when_the_queue_is_full():
+    controller = AdmissionController("test-shed", initial_limit=1, queue_size=0)
+
+    async def main():
+        await controller.acquire()
+        with pytest.raises(Overloaded):
+            await controller.acquire()
+        with pytest.raises(Overloaded):
+            await controller.acquire(wait=False)
+
+    asyncio.run(main())
+    assert controller.shed == 1
+
+
+def test_fair_queue_does_not_let_one_client_starve_another():
+    scheduler = QuotaScheduler(rpm=6000, weights="standard=1", mode_classes="")
+    scheduler.requests.tokens = 0
+    order = []
+
+    async def one(client, number):
+        client_key.set(client)
+        await scheduler.acquire(10, time.monotonic() + 5)
+        order.append((client, number))
+
+    async def main():
+        flood = [one("flooder", number) for number in range(8)]
+        return await asyncio.gather(*flood, one("quiet", 0), one("quiet", 1))
+
+    asyncio.run(main())
+    quiet = [position for position, (client, _) in enumerate(order) if client == "quiet"]
+    assert len(order) == 10
+    assert quiet == [1, 3]
+
+
+def test_scheduler_sheds_calls_whose_budget_cannot_return_in_time():
+    scheduler = QuotaScheduler(rpm=60, weights="standard=1", mode_classes="")
+    scheduler.requests.tokens = 0
+
+    async def main():
+        with pytest.raises(Overloaded):
+            await scheduler.acquire(10, time.monotonic() + 0.1)
+
+    asyncio.run(main())
+    assert scheduler.rejected == 1
@@ -0,0 +1,115 @@
+"""Pre-warm the refine/explain caches (and the cache snapshot) from a list of hot prompts.
+
+Each line of the input file is either plain text, refined with --mode, or a
+JSON object: {"raw_input": ..., "mode": ..., "tone": ..., "persona": ...,
+"return_format": ...} for /refine, or {"explain": ...} for /explain.
+Prompts that are already cached are skipped without calling the model.
+
+Usage (from the backend directory):
+    python warm_cache.py hot_prompts.txt [--mode deep] [--concurrency 4]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+from services.logging_config import configure_logging
+configure_logging()
+
+from services import gemini_service
+from services.cache_snapshot import cache_snapshot
+from routers import explain
+
+
+def read_prompts(path, mode):
+    """Yield ("refine", kwargs) or ("explain", prompt) for each non-empty line"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                item = json.loads(line)
+                if "explain" in item:
+                    yield "explain", item["explain"]
+                    continue
+                yield "refine", {
+                    "raw_input": item["raw_input"],
+                    "mode": item.get("mode", mode),
+                    "tone": item.get("tone", "default"),
+                    "persona": item.get("persona", ""),
+                    "return_format": item.get("return_format", "plain"),
+                }
+            else:
+                yield "refine", {"raw_input": line, "mode": mode}
+
+
+async def warm(items, concurrency):
+    """Cache every item, at most `concurrency` model calls at a time; returns per-outcome counts"""
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"cached": 0, "warmed": 0, "failed": 0}
+
+    async def warm_one(kind, item):
+        async with semaphore:
+            try:
+                if kind == "explain":
+                    cache_key = explain.get_explain_cache_key(item)
+                    if await explain.explain_cache.get(cache_key) is not None:
+                        counts["cached"] += 1
+                        return
+                    await explain.fetch_explanation(item, cache_key)
+                else:
+                    mode, raw_input = item["mode"], item["raw_input"]
+                    tone = item.get("tone", "default")
+                    persona = item.get("persona", "")
+                    return_format = item.get("return_format", "plain")
+                    prompt = gemini_service.build_prompt(mode, tone, persona, return_format, raw_input)
+                    cache_key = gemini_service.get_cache_key(prompt, mode)
+                    if await gemini_service.response_cache.get(cache_key) is not None:
+                        counts["cached"] += 1
+                        return
+                    # Straight to the model: a near-duplicate hit would leave this key uncached
+                    partition = gemini_service.get_partition(mode, tone, persona, return_format)
+                    await gemini_service.fetch_refined_prompts(
+                        prompt, cache_key, mode, return_format, partition, raw_input
+                    )
+                counts["warmed"] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"  failed: {str(item)[:60]!r}: {type(e).__name__}: {e}")
+
+    await asyncio.gather(*(warm_one(kind, item) for kind, item in items))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", help="hot prompts, one per line (text or JSON)")
+    parser.add_argument("--mode", default="deep", help="refine mode for plain-text lines")
+    parser.add_argument("--concurrency", type=int, default=4, help="model calls in flight")
+    args = parser.parse_args()
+
+    if not gemini_service.model_router:
+        print(gemini_service.NOT_CONFIGURED_MESSAGE)
+        sys.exit(1)
+
+    items = list(read_prompts(args.file, args.mode))
+    started = time.perf_counter()
+    counts = asyncio.run(warm(items, max(1, args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"Warmed {counts['warmed']} of {len(items)} prompts in {elapsed:.1f}s "
+        f"({counts['cached']} already cached, {counts['failed']} failed)"
+    )
+    if cache_snapshot:
+        stats = cache_snapshot.stats()
+        print(f"Snapshot {stats['path']}: {stats['bytes']} bytes")
+    sys.exit(1 if counts["failed"] and not counts["warmed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
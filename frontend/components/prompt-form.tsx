@@ -6,7 +6,7 @@ import { Card } from "@/components/ui/card"
 import { Textarea } from "@/components/ui/textarea"
 import { Select, SelectTrigger, SelectValue, SelectContent, SelectItem } from "@/components/ui/select"
 import { Label } from "@/components/ui/label"
-import { fetchFromApi, type PromptResponse, type PromptRequest, API_URL } from "@/lib/api"
+import { generatePrompts, type PromptRequest, API_URL } from "@/lib/api"
 import type { Prompt } from "@/types"
 import { useToast } from "@/components/ui/use-toast"
 import { cleanPromptText } from "@/lib/utils"
@@ -89,10 +89,8 @@ export default function PromptForm({ onResults }: Props) {
 			}
 
 			console.log('Sending request to API:', API_URL + '/refine');
-			const response = await fetchFromApi<PromptResponse>('/refine', {
-				method: 'POST',
-				body: JSON.stringify(formData)
-			})
+			// Repeated requests are answered from the client's result cache
+			const response = await generatePrompts(formData)
 
 			if (response.refined_prompts) {
 				const prompts: Prompt[] = response.refined_prompts.map((promptText: string, index: number) => ({
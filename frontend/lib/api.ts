@@ -11,10 +11,26 @@ export interface PromptRequest {
   return_format: string  // Changed from format to match your form data
 }
 
-export interface PromptResponse {
+// Stored results can be fetched again with GET result_url, which browsers
+// and CDNs cache; both are null when the result isn't stored on the server
+export interface StoredResult {
+  result_key?: string | null
+  result_url?: string | null
+}
+
+export interface PromptResponse extends StoredResult {
   refined_prompts: string[]  // Changed to match the API response
 }
 
+export interface ExplainResponse extends StoredResult {
+  explanation: string
+}
+
+export interface RefineExplainResponse extends PromptResponse {
+  explanations: string[]  // explanations[i] explains refined_prompts[i]
+  explanation_keys: (string | null)[]  // explanation i is at /results/explain/<key>
+}
+
 // Default to localhost:8000 if environment variable isn't set
 export const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
@@ -28,8 +44,9 @@ export async function fetchFromApi<T>(
 
   const response = await fetch(url, {
     ...options,
+    // Only requests with a body declare one, so plain GETs need no CORS preflight
     headers: {
-      'Content-Type': 'application/json',
+      ...(options.body ? { 'Content-Type': 'application/json' } : {}),
       ...options.headers,
     },
   })
@@ -43,17 +60,94 @@ export async function fetchFromApi<T>(
   return response.json()
 }
 
-// Typed API functions
-export async function generatePrompts(payload: PromptRequest): Promise<PromptResponse> {
-  return fetchFromApi<PromptResponse>('/refine', {
+// Stored results are kept in memory per request for this long, and
+// identical requests in flight share one fetch
+const RESULT_CACHE_TTL_MS = 10 * 60 * 1000
+const RESULT_CACHE_MAX_ENTRIES = 200
+
+interface CachedResult {
+  value: StoredResult
+  expires: number
+}
+
+const resultCache = new Map<string, CachedResult>()
+const inFlight = new Map<string, Promise<StoredResult>>()
+
+function rememberResult(key: string, entry: CachedResult) {
+  // Map order doubles as recency order: the first entry is the least recently used
+  resultCache.delete(key)
+  resultCache.set(key, entry)
+  if (resultCache.size > RESULT_CACHE_MAX_ENTRIES) {
+    resultCache.delete(resultCache.keys().next().value as string)
+  }
+}
+
+async function loadResult<T extends StoredResult>(
+  endpoint: string,
+  payload: object,
+  readBack: boolean,
+  cached?: CachedResult,
+): Promise<T> {
+  // An expired entry is read back from its result URL, which the browser
+  // cache or a CDN can answer, or revalidate with a 304
+  const url = readBack ? cached?.value.result_url : null
+  if (url) {
+    try {
+      return await fetchFromApi<T>(url)
+    } catch {
+      // Evicted on the server: ask for it again
+    }
+  }
+  return fetchFromApi<T>(endpoint, {
     method: 'POST',
     body: JSON.stringify(payload),
-  });
+  })
+}
+
+// POSTs payload to endpoint unless the same request was answered recently or is
+// in flight. With readBack, the response is all there is at its result_url
+export async function cachedRequest<T extends StoredResult>(
+  endpoint: string,
+  payload: object,
+  readBack = true,
+): Promise<T> {
+  const key = `${endpoint} ${JSON.stringify(payload)}`
+  const cached = resultCache.get(key)
+  if (cached && cached.expires > Date.now()) {
+    rememberResult(key, cached)
+    return cached.value as T
+  }
+
+  let pending = inFlight.get(key) as Promise<T> | undefined
+  if (!pending) {
+    pending = loadResult<T>(endpoint, payload, readBack, cached)
+    inFlight.set(key, pending)
+  }
+  try {
+    const value = await pending
+    // Results the server did not store (error messages, near-duplicate matches) are not kept
+    if (value.result_key) {
+      rememberResult(key, { value, expires: Date.now() + RESULT_CACHE_TTL_MS })
+    }
+    return value
+  } finally {
+    if (inFlight.get(key) === pending) {
+      inFlight.delete(key)
+    }
+  }
+}
+
+// Typed API functions
+export async function generatePrompts(payload: PromptRequest): Promise<PromptResponse> {
+  return cachedRequest<PromptResponse>('/refine', payload);
+}
+
+export async function explainPrompt(prompt: string): Promise<ExplainResponse> {
+  return cachedRequest<ExplainResponse>("/explain", { prompt });
 }
 
-export async function explainPrompt(prompt: string) {
-  return fetchFromApi("/explain", {
-    method: "POST",
-    body: JSON.stringify({ prompt }),
-  });
+// Refined prompts and their explanations from a single upstream call
+export async function refineAndExplain(payload: PromptRequest): Promise<RefineExplainResponse> {
+  // result_url only holds the refined prompts, so expired entries are asked for again
+  return cachedRequest<RefineExplainResponse>('/refine/explain', payload, false);
 }